@@ -0,0 +1,999 @@
+"""
+Read activity folders the way the viewer does, and write/read the records sidecar.
+
+The functions here mirror the viewer's shared core script (parseFitData,
+parseGpxData, calculateMetrics, computeRouteSignificance and the Chart.js
+buildLodPyramid), so that a preprocessed folder shows exactly what parsing the
+raw files in the browser would. Only the standard library is used.
+
+Records are kept as a column store like the viewer's: one `array` per channel,
+plus a per-sample `flags` bitmap for the channels that can be missing.
+"""
+
+import json
+import math
+import os
+import re
+import struct
+import sys
+from array import array
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# Same names, element types and order as RECORD_STORE_COLUMNS in the viewer
+RECORD_COLUMNS = {
+    'timestamp': ('d', 'float64'),     # epoch milliseconds
+    'latitude': ('d', 'float64'),      # degrees
+    'longitude': ('d', 'float64'),     # degrees
+    'distance': ('d', 'float64'),      # cumulative km
+    'elevation': ('f', 'float32'),     # m
+    'speed': ('f', 'float32'),         # as recorded, or km/h derived from position
+    'heartRate': ('h', 'int16'),       # bpm
+    'cadence': ('h', 'int16'),         # rpm / spm
+    'power': ('h', 'int16'),           # W
+    'temperature': ('h', 'int16'),     # °C
+    'flags': ('B', 'uint8'),
+}
+
+CHANNEL_FLAGS = {
+    'timestamp': 1,
+    'elevation': 2,
+    'speed': 4,
+    'heartRate': 8,
+    'cadence': 16,
+    'power': 32,
+    'temperature': 64,
+}
+
+SOURCE_FILES = ('activity.fit', 'activity.gpx')
+METADATA_FILES = ('metadata.yaml', 'metadata.yml', 'metadata.org')
+SIDECAR_NAME = 'activity.records.bin'
+SIDECAR_MAGIC = b'PTFR'
+SIDECAR_VERSION = 2
+
+# Must match LOD_BUCKET_FACTOR in the Chart.js viewer
+LOD_BUCKET_FACTOR = 4
+
+FIT_EPOCH_OFFSET = 631065600           # 1989-12-31T00:00:00Z in Unix seconds
+SEMICIRCLES_TO_DEGREES = 180 / 2 ** 31
+
+
+class ActivityError(Exception):
+    """Raised when an activity file cannot be read."""
+
+
+class UnsupportedFitError(ActivityError):
+    """Raised for FIT files the viewer's fast path leaves to the SDK."""
+
+
+class RecordStore:
+    """Column store for activity samples (see RECORD_COLUMNS)."""
+
+    def __init__(self):
+        self.columns = {name: array(code) for name, (code, _) in RECORD_COLUMNS.items()}
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def append(self, latitude, longitude):
+        """Append a sample with a position; other channels start out missing."""
+        for name, column in self.columns.items():
+            column.append(0)
+        self.columns['latitude'][-1] = latitude
+        self.columns['longitude'][-1] = longitude
+        self.length += 1
+        return self.length - 1
+
+    def set(self, channel, i, value):
+        """Set an optional channel; None/NaN leave it marked missing."""
+        if value is None or value != value:
+            return
+        if RECORD_COLUMNS[channel][0] == 'h':
+            # Int16Array semantics: truncate, then wrap
+            value = (int(value) + 0x8000) % 0x10000 - 0x8000
+        self.columns[channel][i] = value
+        self.columns['flags'][i] |= CHANNEL_FLAGS[channel]
+
+    def get(self, channel, i):
+        """Value of an optional channel, or None when missing."""
+        if self.columns['flags'][i] & CHANNEL_FLAGS[channel]:
+            return self.columns[channel][i]
+        return None
+
+
+# --- FIT ------------------------------------------------------------------
+
+# Base type -> (struct code, invalid value)
+_FIT_BASE_TYPES = {
+    0x00: ('B', 0xFF), 0x01: ('b', 0x7F), 0x02: ('B', 0xFF),
+    0x83: ('h', 0x7FFF), 0x84: ('H', 0xFFFF), 0x85: ('i', 0x7FFFFFFF),
+    0x86: ('I', 0xFFFFFFFF), 0x88: ('f', None), 0x89: ('d', None),
+    0x0A: ('B', 0), 0x8B: ('H', 0), 0x8C: ('I', 0),
+    0x8E: ('q', 0x7FFFFFFFFFFFFFFF), 0x8F: ('Q', 0xFFFFFFFFFFFFFFFF), 0x90: ('Q', 0),
+}
+
+_FIT_LAP = 19
+_FIT_RECORD = 20
+_FIT_HEART_RATE = 132
+_FIT_TIMESTAMP = 253
+_FIT_COMPRESSED_SPEED_DISTANCE = 8
+
+# Record message fields the viewer uses: field number -> (name, scale, offset)
+_FIT_RECORD_FIELDS = {
+    0: ('positionLat', 1, 0),
+    1: ('positionLong', 1, 0),
+    2: ('altitude', 5, 500),
+    3: ('heartRate', 1, 0),
+    4: ('cadence', 1, 0),
+    6: ('speed', 1000, 0),
+    7: ('power', 1, 0),
+    13: ('temperature', 1, 0),
+    73: ('enhancedSpeed', 1000, 0),
+    78: ('enhancedAltitude', 5, 500),
+}
+
+# Lap message fields the viewer uses, likewise
+_FIT_LAP_FIELDS = {
+    2: ('startTime', 1, 0),
+    7: ('totalElapsedTime', 1000, 0),
+    8: ('totalTimerTime', 1000, 0),
+    9: ('totalDistance', 100, 0),
+    15: ('avgHeartRate', 1, 0),
+    16: ('maxHeartRate', 1, 0),
+    19: ('avgPower', 1, 0),
+    21: ('totalAscent', 1, 0),
+}
+_FIT_MESSAGE_FIELDS = {_FIT_RECORD: _FIT_RECORD_FIELDS, _FIT_LAP: _FIT_LAP_FIELDS}
+
+
+def _fit_definition(data, pos, developer):
+    """Parse a definition message at `pos`; return (definition, next position)."""
+    big_endian = data[pos + 1] == 1
+    endian = '>' if big_endian else '<'
+    (global_number,) = struct.unpack_from(endian + 'H', data, pos + 2)
+    if global_number == _FIT_HEART_RATE:
+        raise UnsupportedFitError('FIT file with separate heart rate messages')
+    field_count = data[pos + 4]
+    pos += 5
+
+    layout = endian
+    fields = []
+    for _ in range(field_count):
+        number, size, base_type = data[pos], data[pos + 1], data[pos + 2]
+        pos += 3
+        if global_number == _FIT_RECORD and number == _FIT_COMPRESSED_SPEED_DISTANCE:
+            raise UnsupportedFitError('FIT file with compressed speed/distance')
+        code, invalid = _FIT_BASE_TYPES.get(base_type, (None, None))
+        wanted = number == _FIT_TIMESTAMP or number in _FIT_MESSAGE_FIELDS.get(global_number, ())
+        if wanted and code and struct.calcsize('<' + code) == size:
+            layout += code
+            fields.append((number, invalid))
+        else:
+            layout += f'{size}x'
+
+    if developer:
+        developer_count = data[pos]
+        pos += 1
+        for _ in range(developer_count):
+            layout += f'{data[pos + 1]}x'
+            pos += 3
+
+    return {'global': global_number, 'struct': struct.Struct(layout), 'fields': fields}, pos
+
+
+def decode_fit(data, laps=None):
+    """Decode the record messages of a FIT file into a RecordStore.
+
+    The same decoder as the viewer's decodeFitRecords, and like its SDK path:
+    samples without a position are dropped, altitude/speed fall back to their
+    enhanced fields, and speed is stored as recorded (m/s). Returns (store,
+    point_count) where point_count includes the dropped samples.
+    Raises UnsupportedFitError for what the viewer's fast path declines and
+    hands to the SDK (separate heart rate messages, compressed speed/distance),
+    so nothing is built from records that differ from the viewer's.
+    Lap messages are appended to `laps`, when given, like the viewer's fitLap.
+    """
+    data = bytes(data)
+    if len(data) < 12 or data[8:12] != b'.FIT':
+        raise ActivityError('Not a valid FIT file')
+
+    store = RecordStore()
+    point_count = 0
+    start = 0
+    # Chained FIT files are decoded one after another
+    while start + 12 <= len(data) and data[start + 8:start + 12] == b'.FIT':
+        header_size = data[start]
+        (data_size,) = struct.unpack_from('<I', data, start + 4)
+        pos = start + header_size
+        end = min(len(data), pos + data_size)
+        definitions = {}
+        last_timestamp = None
+
+        while pos < end:
+            header = data[pos]
+            pos += 1
+
+            if header & 0x80:
+                # Compressed timestamp header: 5-bit offset from the last timestamp
+                local = (header >> 5) & 0x03
+                offset = header & 0x1F
+                if last_timestamp is not None:
+                    last_timestamp += (offset - last_timestamp) & 0x1F
+                timestamp = last_timestamp
+            elif header & 0x40:
+                definitions[header & 0x0F], pos = _fit_definition(data, pos, header & 0x20)
+                continue
+            else:
+                local = header & 0x0F
+                timestamp = None
+
+            definition = definitions.get(local)
+            if definition is None:
+                raise ActivityError(f'FIT data message without a definition at byte {pos - 1}')
+            layout = definition['struct']
+            if pos + layout.size > end:
+                break
+            values = layout.unpack_from(data, pos)
+            pos += layout.size
+
+            fields = {}
+            for (number, invalid), value in zip(definition['fields'], values):
+                if value != invalid and value == value:
+                    fields[number] = value
+            if _FIT_TIMESTAMP in fields:
+                last_timestamp = timestamp = fields[_FIT_TIMESTAMP]
+
+            if definition['global'] == _FIT_RECORD:
+                point_count += 1
+                _append_fit_record(store, fields, timestamp)
+            elif definition['global'] == _FIT_LAP and laps is not None:
+                laps.append(_fit_lap(fields))
+
+        start = end + 2  # File CRC
+
+    return store, point_count
+
+
+def _append_fit_record(store, fields, timestamp):
+    record = {}
+    for number, value in fields.items():
+        if number in _FIT_RECORD_FIELDS:
+            name, scale, offset = _FIT_RECORD_FIELDS[number]
+            record[name] = value / scale - offset if scale != 1 or offset else value
+
+    latitude = record.get('positionLat', math.nan) * SEMICIRCLES_TO_DEGREES
+    longitude = record.get('positionLong', math.nan) * SEMICIRCLES_TO_DEGREES
+    if not _truthy(latitude) or not _truthy(longitude):
+        return
+
+    i = store.append(latitude, longitude)
+    if timestamp is not None:
+        store.set('timestamp', i, (timestamp + FIT_EPOCH_OFFSET) * 1000)
+    # `altitude || enhancedAltitude`, where the SDK also expands altitude and
+    # speed into their enhanced fields
+    altitude = record.get('altitude')
+    speed = record.get('speed')
+    store.set('elevation', i, altitude if _truthy(altitude) else record.get('enhancedAltitude', altitude))
+    store.set('heartRate', i, record.get('heartRate'))
+    store.set('speed', i, speed if _truthy(speed) else record.get('enhancedSpeed', speed))
+    store.set('cadence', i, record.get('cadence'))
+    store.set('power', i, record.get('power'))
+    store.set('temperature', i, record.get('temperature'))
+
+
+def _fit_lap(fields):
+    lap = {name: fields[number] / scale - offset if scale != 1 or offset else fields[number]
+           for number, (name, scale, offset) in _FIT_LAP_FIELDS.items() if number in fields}
+    distance = lap.get('totalDistance')
+    timer = lap.get('totalTimerTime')
+    start = lap.get('startTime')
+    return {
+        'startTime': (start + FIT_EPOCH_OFFSET) * 1000 if start is not None else None,
+        'elapsed': lap.get('totalElapsedTime'),
+        'timer': timer,
+        'distance': distance / 1000 if distance is not None else None,
+        'avgSpeed': distance / timer * 3.6 if distance is not None and timer else None,
+        'avgHeartRate': lap.get('avgHeartRate'),
+        'maxHeartRate': lap.get('maxHeartRate'),
+        'avgPower': lap.get('avgPower'),
+        'ascent': lap.get('totalAscent'),
+    }
+
+
+def _truthy(value):
+    """JavaScript truthiness for numbers (0, NaN and undefined are false)."""
+    return value is not None and value == value and value != 0
+
+
+# --- GPX ------------------------------------------------------------------
+
+_GPX_TOKEN = re.compile(r'<!--.*?-->|<!\[CDATA\[(.*?)\]\]>|<([^>]*)>', re.S)
+_GPX_LAT = re.compile(r'\slat\s*=\s*["\']([^"\']*)["\']')
+_GPX_LON = re.compile(r'\slon\s*=\s*["\']([^"\']*)["\']')
+_JS_FLOAT = re.compile(r'\s*([+-]?(?:Infinity|(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?))')
+_JS_INT = re.compile(r'\s*([+-]?\d+)')
+_FRACTION = re.compile(r'\.(\d+)')
+_UNIX_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _parse_float(text):
+    """JavaScript parseFloat: the longest numeric prefix, else NaN."""
+    match = _JS_FLOAT.match(text or '')
+    return float(match.group(1).replace('Infinity', 'inf')) if match else math.nan
+
+
+def _parse_int(text):
+    """JavaScript parseInt (base 10)."""
+    match = _JS_INT.match(text or '')
+    return int(match.group(1)) if match else math.nan
+
+
+def _parse_time(text):
+    """Epoch milliseconds of an ISO 8601 time (UTC when no offset is given), or NaN."""
+    text = text.strip()
+    if text.endswith(('Z', 'z')):
+        text = text[:-1] + '+00:00'
+    # Date.parse keeps whole milliseconds; fromisoformat (3.10) wants 3 or 6 digits
+    text = _FRACTION.sub(lambda match: '.' + match.group(1)[:3].ljust(6, '0'), text, count=1)
+    try:
+        moment = datetime.fromisoformat(text)
+    except ValueError:
+        return math.nan
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return (moment - _UNIX_EPOCH) // timedelta(milliseconds=1)
+
+
+def _local_name(name):
+    return name.split(':', 1)[1] if ':' in name else name
+
+
+def parse_gpx(text):
+    """Parse GPX track points into a RecordStore, like parseGpxData in the viewer.
+
+    <ele> and <time> match unprefixed only, heart rate matches any namespace
+    prefix, and the first occurrence of each inside a <trkpt> wins.
+    Returns (store, point_count).
+    """
+    if '<!--' not in text and '<![CDATA[' not in text:
+        try:
+            return _parse_gpx_points(text)
+        except _IrregularGpx:
+            pass
+    return _parse_gpx_tokens(text)
+
+
+class _IrregularGpx(Exception):
+    """Markup the per-point fast path does not handle; use the tokenizer."""
+
+
+_GPX_POINT = re.compile(r'<trkpt(?=[\s/>])([^>]*)>')
+_GPX_CLOSE = re.compile(r'</([^\s/>]*)')
+_GPX_FIELD_TAGS = {
+    'ele': re.compile(r'<(?P<name>ele)(?=[\s/>])(?P<attributes>[^>]*)>'),
+    'time': re.compile(r'<(?P<name>time)(?=[\s/>])(?P<attributes>[^>]*)>'),
+    'hr': re.compile(r'<(?P<name>(?:[^\s/>:<]+:)?hr)(?=[\s/>])(?P<attributes>[^>]*)>'),
+}
+
+
+def _parse_gpx_points(text):
+    """Fast path for well-formed GPX: one regex search per point and field."""
+    store = RecordStore()
+    for match in _GPX_POINT.finditer(text):
+        tag = match.group(1)
+        point = {
+            'latitude': _parse_float(_match(_GPX_LAT, tag)),
+            'longitude': _parse_float(_match(_GPX_LON, tag)),
+            'ele': None, 'time': None, 'hr': None,
+        }
+        if not tag.endswith('/'):
+            end = text.find('</trkpt', match.end())
+            if end == -1:
+                break  # Never closed, so never added
+            body = text[match.end():end]
+            if '<trkpt' in body or _GPX_CLOSE.match(text, end).group(1) != 'trkpt':
+                raise _IrregularGpx()
+            for key in point.keys() & _GPX_FIELD_TAGS.keys():
+                point[key] = _gpx_field_text(body, key)
+        _append_gpx_point(store, point)
+    return store, len(store)
+
+
+def _gpx_field_text(body, key):
+    """Text of the first non-empty <key> element in a point body, or None."""
+    pattern = _GPX_FIELD_TAGS[key]
+    match = pattern.search(body)
+    while match and match.group('attributes').endswith('/'):
+        match = pattern.search(body, match.end())
+    if not match:
+        return None
+    end = body.find('<', match.end())
+    close = _GPX_CLOSE.match(body, end) if end != -1 else None
+    if not close or not (close.group(1) == key or (key == 'hr' and _local_name(close.group(1)) == 'hr')):
+        raise _IrregularGpx()
+    return body[match.end():end]
+
+
+def _parse_gpx_tokens(text):
+    """Tag-by-tag port of the viewer's streaming tokenizer."""
+    store = RecordStore()
+    point = None
+    field = None
+    content = []
+    pos = 0
+
+    for match in _GPX_TOKEN.finditer(text):
+        if field and match.start() > pos:
+            content.append(text[pos:match.start()])
+        pos = match.end()
+
+        cdata, tag = match.group(1), match.group(2)
+        if cdata is not None:
+            if field:
+                content.append(cdata)
+            continue
+        if tag is None or tag[:1] in ('?', '!'):
+            continue
+
+        closing = tag.startswith('/')
+        name = re.match(r'[^\s/]*', tag[1:] if closing else tag).group(0)
+        if closing:
+            if field and (name == field or (field == 'hr' and _local_name(name) == 'hr')):
+                point[field] = ''.join(content)
+                field = None
+            elif name == 'trkpt' and point:
+                _append_gpx_point(store, point)
+                point, field = None, None
+        elif name == 'trkpt':
+            point = {
+                'latitude': _parse_float(_match(_GPX_LAT, tag)),
+                'longitude': _parse_float(_match(_GPX_LON, tag)),
+                'ele': None, 'time': None, 'hr': None,
+            }
+            if tag.endswith('/'):
+                _append_gpx_point(store, point)
+                point, field = None, None
+        elif point and not tag.endswith('/'):
+            key = name if name in ('ele', 'time') else 'hr' if _local_name(name) == 'hr' else None
+            if key and point[key] is None:
+                field = key
+                content = []
+
+    return store, len(store)
+
+
+def _append_gpx_point(store, point):
+    i = store.append(point['latitude'], point['longitude'])
+    if point['ele'] is not None:
+        store.set('elevation', i, _parse_float(point['ele']))
+    if point['time'] is not None:
+        store.set('timestamp', i, _parse_time(point['time']))
+    if point['hr'] is not None:
+        store.set('heartRate', i, _parse_int(point['hr']))
+
+
+def _match(pattern, text):
+    match = pattern.search(text)
+    return match.group(1) if match else None
+
+
+# --- Metrics --------------------------------------------------------------
+
+def calculate_distance(lat1, lon1, lat2, lon2):
+    """Haversine distance in km."""
+    d_lat = math.radians(lat2 - lat1)
+    d_lon = math.radians(lon2 - lon1)
+    a = (math.sin(d_lat / 2) * math.sin(d_lat / 2) +
+         math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) *
+         math.sin(d_lon / 2) * math.sin(d_lon / 2))
+    return 6371 * 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+def calculate_metrics(store):
+    """Fill the distance column (and derived speeds) and return the summary.
+
+    Same rules as calculateMetrics in the viewer; times are epoch milliseconds.
+    """
+    latitude, longitude = store['latitude'], store['longitude']
+    distance, elevation = store['distance'], store['elevation']
+    total_distance = elevation_gain = elevation_loss = 0.0
+    speed_sum = speed_count = max_speed = 0
+    heart_rate_sum = heart_rate_count = max_heart_rate = 0
+
+    for i in range(len(store)):
+        if i == 0:
+            distance[0] = 0
+        else:
+            dist = calculate_distance(latitude[i - 1], longitude[i - 1], latitude[i], longitude[i])
+            total_distance += dist
+            distance[i] = total_distance
+
+            time, previous_time = store.get('timestamp', i), store.get('timestamp', i - 1)
+            if not store.get('speed', i) and time and previous_time:
+                time_diff = (time - previous_time) / 1000
+                if time_diff > 0:
+                    store.set('speed', i, dist / time_diff * 3600)
+
+            if store.get('elevation', i) and store.get('elevation', i - 1):
+                diff = elevation[i] - elevation[i - 1]
+                if diff > 0:
+                    elevation_gain += diff
+                else:
+                    elevation_loss += abs(diff)
+
+        speed = store.get('speed', i)
+        if speed is not None and speed > 0:
+            speed_sum += speed
+            speed_count += 1
+            max_speed = max(max_speed, speed)
+        heart_rate = store.get('heartRate', i)
+        if heart_rate:
+            heart_rate_sum += heart_rate
+            heart_rate_count += 1
+            max_heart_rate = max(max_heart_rate, heart_rate)
+
+    n = len(store)
+    start_time = store.get('timestamp', 0) if n else None
+    end_time = store.get('timestamp', n - 1) if n else None
+    duration = (end_time - start_time) / 1000 if start_time and end_time else 0
+
+    avg_speed = 0
+    if speed_count > 0:
+        avg_speed = speed_sum / speed_count
+    elif total_distance > 0 and duration > 0:
+        avg_speed = total_distance / duration * 3600
+
+    return {
+        'distance': total_distance,
+        'duration': duration,
+        'elevationGain': elevation_gain,
+        'elevationLoss': elevation_loss,
+        'avgSpeed': avg_speed,
+        'maxSpeed': max_speed,
+        'avgHeartRate': heart_rate_sum / heart_rate_count if heart_rate_count else 0,
+        'maxHeartRate': max_heart_rate,
+        'startTime': start_time or None,
+        'endTime': end_time or None,
+        'bestEfforts': best_efforts(store),
+    }
+
+
+# Must match BEST_EFFORT_DISTANCES, BEST_EFFORT_DURATIONS and BEST_EFFORT_MAX_GAP in the viewer
+BEST_EFFORT_DISTANCES = (0.4, 1, 5, 10, 21.0975)   # km
+BEST_EFFORT_DURATIONS = (5, 60, 1200, 3600)         # s
+BEST_EFFORT_MAX_GAP = 10000                         # ms
+
+
+def best_efforts(store):
+    """Fastest times over set distances and best average power/heart rate over set durations.
+
+    Same as computeBestEfforts in the viewer: one O(n) pass with a two-pointer
+    window per distance or duration. None unless every record has a timestamp.
+    """
+    n = len(store)
+    timestamp, distance, flags = store['timestamp'], store['distance'], store['flags']
+    if n < 2:
+        return None
+    time_flag = CHANNEL_FLAGS['timestamp']
+    for i in range(n):
+        if not flags[i] & time_flag or (i > 0 and timestamp[i] < timestamp[i - 1]):
+            return None
+
+    def averages(channel):
+        # Running total of value x time: each sample stands for the time since
+        # the previous one, up to the gap limit
+        bit, values = CHANNEL_FLAGS[channel], store[channel]
+        total = [0.0] * n
+        present = False
+        for i in range(1, n):
+            sample = bool(flags[i] & bit)
+            present = present or sample
+            total[i] = total[i - 1] + (
+                values[i] * min(timestamp[i] - timestamp[i - 1], BEST_EFFORT_MAX_GAP) if sample else 0)
+        if not present:
+            return []
+        efforts = (_best_average(total, timestamp, n, duration) for duration in BEST_EFFORT_DURATIONS
+                   if timestamp[n - 1] - timestamp[0] >= duration * 1000)
+        return [effort for effort in efforts if effort]
+
+    return {
+        'distance': [_fastest_over(distance, timestamp, n, target)
+                     for target in BEST_EFFORT_DISTANCES if target <= distance[n - 1]],
+        'power': averages('power'),
+        'heartRate': averages('heartRate'),
+    }
+
+
+def _fastest_over(distance, timestamp, n, target):
+    best_seconds, best_start, best_end = math.inf, 0, 0
+    start = 0
+    for end in range(1, n):
+        start_distance = distance[end] - target
+        if start_distance < 0:
+            continue
+        while distance[start + 1] <= start_distance:
+            start += 1
+        # The time from the sample after the start is a lower bound
+        if (timestamp[end] - timestamp[start + 1]) / 1000 >= best_seconds:
+            continue
+        span = distance[start + 1] - distance[start]
+        fraction = (start_distance - distance[start]) / span if span > 0 else 0
+        seconds = (timestamp[end] - timestamp[start] - fraction * (timestamp[start + 1] - timestamp[start])) / 1000
+        if seconds < best_seconds:
+            best_seconds, best_start, best_end = seconds, start, end
+    return {'distance': target, 'seconds': best_seconds, 'start': best_start, 'end': best_end}
+
+
+def _best_average(total, timestamp, n, duration):
+    span = duration * 1000
+    best, best_start, best_end = 0, 0, 0
+    start = 0
+    for end in range(1, n):
+        if timestamp[end] - timestamp[0] < span:
+            continue
+        while timestamp[end] - timestamp[start + 1] >= span:
+            start += 1
+        value = (total[end] - total[start]) / (timestamp[end] - timestamp[start])
+        if value > best:
+            best, best_start, best_end = value, start, end
+    return {'duration': duration, 'value': best, 'start': best_start, 'end': best_end} if best > 0 else None
+
+
+def route_significance(latitude, longitude):
+    """Douglas-Peucker significance of every vertex, in zoom-0 Mercator pixels.
+
+    Same as computeRouteSignificance in the viewer: the vertices to draw at
+    zoom z are those with significance >= tolerancePx / 2**z.
+    """
+    n = len(latitude)
+    x = [(lon + 180) / 360 * 256 for lon in longitude]
+    y = []
+    for lat in latitude:
+        sin = math.sin(math.radians(lat))
+        y.append((0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * 256)
+
+    significance = array('f', bytes(4 * n))
+    if n == 0:
+        return significance
+    significance[0] = significance[n - 1] = math.inf
+
+    stack = [(0, n - 1, math.inf)]
+    while stack:
+        first, last, cap = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = x[first], y[first]
+        dx, dy = x[last] - ax, y[last] - ay
+        segment_length = dx * dx + dy * dy
+        farthest, farthest_distance = first + 1, -1.0
+        i = first + 1
+        # The hot loop: same arithmetic as the viewer, written for CPython
+        for xi, yi in zip(x[first + 1:last], y[first + 1:last]):
+            t = ((xi - ax) * dx + (yi - ay) * dy) / segment_length if segment_length > 0 else 0.0
+            if t < 0.0:
+                t = 0.0
+            elif t > 1.0:
+                t = 1.0
+            px = xi - (ax + t * dx)
+            py = yi - (ay + t * dy)
+            distance = px * px + py * py
+            if distance > farthest_distance:
+                farthest, farthest_distance = i, distance
+            i += 1
+
+        value = min(math.sqrt(farthest_distance), cap)
+        significance[farthest] = value
+        # Pushed in this order so spans are visited like the viewer's stack
+        stack.append((first, farthest, value))
+        stack.append((farthest, last, value))
+
+    return significance
+
+
+def build_lod_pyramid(values):
+    """Min/max pyramid over `values` (NaN = no data), like buildLodPyramid.
+
+    Returns a list of (bucket_size, lo, hi) levels, lo/hi holding the record
+    index of each bucket's minimum/maximum.
+    """
+    n = len(values)
+    levels = []
+    lo = hi = None
+    bucket_size = 1
+
+    while n > 0 and bucket_size * LOD_BUCKET_FACTOR < n:
+        child_size = bucket_size
+        bucket_size *= LOD_BUCKET_FACTOR
+        count = -(-n // bucket_size)
+        child_count = -(-n // child_size)
+        next_lo = array('I', bytes(4 * count))
+        next_hi = array('I', bytes(4 * count))
+
+        for bucket in range(count):
+            min_index = max_index = bucket * bucket_size
+            min_value, max_value = math.inf, -math.inf
+            first_child = bucket * LOD_BUCKET_FACTOR
+            for child in range(first_child, min(first_child + LOD_BUCKET_FACTOR, child_count)):
+                for i in ((lo[child], hi[child]) if lo else (child, child)):
+                    value = values[i]
+                    if value < min_value:
+                        min_value, min_index = value, i
+                    if value > max_value:
+                        max_value, max_index = value, i
+            next_lo[bucket] = min_index
+            next_hi[bucket] = max_index
+
+        levels.append((bucket_size, next_lo, next_hi))
+        lo, hi = next_lo, next_hi
+
+    return levels
+
+
+def chart_pyramids(store):
+    """The pyramids the Chart.js viewer builds for its elevation, HR and pace charts."""
+    n = len(store)
+    elevation = array('f', (store['elevation'][i] if store.get('elevation', i) else 0 for i in range(n)))
+    heart_rate = array('f', (store.get('heartRate', i) or math.nan for i in range(n)))
+    speed = array('f', (store.get('speed', i) or math.nan for i in range(n)))
+    return {
+        'elevation': build_lod_pyramid(elevation),
+        'heartRate': build_lod_pyramid(heart_rate),
+        'speed': build_lod_pyramid(speed),
+    }
+
+
+# --- Folders and the sidecar ----------------------------------------------
+
+def source_stats(folder):
+    """Size and mtime of the folder's activity files, keyed by file name."""
+    stats = {}
+    for name in SOURCE_FILES:
+        path = Path(folder) / name
+        if path.is_file():
+            stat = path.stat()
+            stats[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    return stats
+
+
+def find_activity_folders(roots, names=SOURCE_FILES):
+    """Yield every folder under `roots` that contains one of `names`."""
+    for root in roots:
+        for folder, subfolders, files in os.walk(root):
+            # Hidden folders (.git, .venv, ...) are never activities
+            subfolders[:] = sorted(name for name in subfolders if not name.startswith('.'))
+            if any(name in files for name in names):
+                yield Path(folder)
+
+
+def read_metadata(folder):
+    """The folder's metadata as a dict of strings, or {} if it has none.
+
+    Org files are read like parseOrgFile in the viewer. YAML is read without
+    a YAML library, so only top-level scalar fields (title, date, type, ...)
+    are returned; lists and block text are skipped.
+    """
+    for name in METADATA_FILES:
+        path = Path(folder) / name
+        if path.is_file():
+            text = path.read_text(encoding='utf-8', errors='replace')
+            return _parse_org(text) if name.endswith('.org') else _parse_yaml_scalars(text)
+    return {}
+
+
+_YAML_FIELD = re.compile(r'^([A-Za-z_][\w-]*)\s*:\s*(.*?)\s*$')
+_ORG_FIELD = re.compile(r'^(?:#\+|:)(\w+):\s*(.+)$')
+
+
+def _parse_yaml_scalars(text):
+    metadata = {}
+    for line in text.splitlines():
+        match = _YAML_FIELD.match(line)
+        if not match or not match.group(2):
+            continue
+        value = match.group(2)
+        if value[0] in '"\'':
+            end = value.find(value[0], 1)
+            value = value[1:end] if end > 0 else value[1:]
+        elif value[0] in '|>[{&*!':
+            continue
+        else:
+            value = value.split(' #', 1)[0].rstrip()
+        metadata[match.group(1)] = value
+    return metadata
+
+
+def _parse_org(text):
+    metadata = {}
+    for line in text.split('\n'):
+        match = _ORG_FIELD.match(line)
+        if match:
+            metadata[match.group(1).lower()] = match.group(2).strip()
+    return metadata
+
+
+def load_activity(folder):
+    """Parse a folder's activity files like the viewer does.
+
+    FIT records win; the GPX is only parsed when there is no readable FIT
+    file. A FIT file only the SDK can read raises UnsupportedFitError rather
+    than falling back to the GPX, whose records the viewer would not show.
+    Returns a dict with the store, point count, summary, FIT laps and the
+    name of the source file, or None when the folder has no track.
+    """
+    folder = Path(folder)
+    store = point_count = source = None
+    laps = []
+
+    fit_path = folder / 'activity.fit'
+    if fit_path.is_file():
+        try:
+            store, point_count = decode_fit(fit_path.read_bytes(), laps)
+            source = fit_path.name
+        except UnsupportedFitError:
+            raise
+        except (ActivityError, struct.error, IndexError) as error:
+            print(f'Could not load {fit_path}: {error}', file=sys.stderr)
+
+    gpx_path = folder / 'activity.gpx'
+    if store is None and gpx_path.is_file():
+        laps = []
+        store, point_count = parse_gpx(gpx_path.read_text(encoding='utf-8', errors='replace'))
+        source = gpx_path.name
+
+    if store is None:
+        return None
+    summary = calculate_metrics(store) if len(store) else None
+    return {'store': store, 'pointCount': point_count, 'summary': summary, 'laps': laps, 'source': source}
+
+
+def track_bounds(store):
+    """(south, west, north, east) of the track in degrees, or None without points."""
+    if not len(store):
+        return None
+    latitude, longitude = store['latitude'], store['longitude']
+    return min(latitude), min(longitude), max(latitude), max(longitude)
+
+
+def load_track(folder):
+    """The folder's records, from a current sidecar or else by parsing.
+
+    Returns (store, summary), or (None, None) when the folder has no track.
+    """
+    folder = Path(folder)
+    if sidecar_is_current(folder):
+        header, store = read_sidecar(folder / SIDECAR_NAME)
+        return store, header['summary']
+    activity = load_activity(folder)
+    if activity is None:
+        return None, None
+    return activity['store'], activity['summary']
+
+
+def write_sidecar(path, activity, sources):
+    """Write the records sidecar for a loaded activity.
+
+    Layout (little-endian): b'PTFR', uint32 version, uint32 header length,
+    the UTF-8 JSON header, then every array at an 8-byte aligned offset given
+    in the header, so the viewer can view them in place as typed arrays.
+    """
+    store = activity['store']
+    blocks = []
+
+    def add(values, kind):
+        blocks.append(values)
+        return {'type': kind, 'index': len(blocks) - 1}
+
+    columns = {name: add(store[name], kind) for name, (_, kind) in RECORD_COLUMNS.items()}
+    significance = add(route_significance(store['latitude'], store['longitude']), 'float32')
+    lod = {
+        channel: [{'bucketSize': size, 'lo': add(lo, 'uint32'), 'hi': add(hi, 'uint32')}
+                  for size, lo, hi in levels]
+        for channel, levels in chart_pyramids(store).items()
+    }
+    header = {
+        'version': SIDECAR_VERSION,
+        'source': activity['source'],
+        'sources': sources,
+        'length': len(store),
+        'pointCount': activity['pointCount'],
+        'summary': activity['summary'],
+        'laps': activity['laps'],
+        'columns': columns,
+        'routeSignificance': significance,
+        'lod': lod,
+    }
+
+    # Offsets depend on the header length, which depends on the offsets: settle
+    # it by reserving room for the final numbers and padding the JSON with spaces
+    refs = [columns[name] for name in columns] + [significance] + \
+        [ref for levels in lod.values() for level in levels for ref in (level['lo'], level['hi'])]
+    for ref in refs:
+        ref['offset'] = 10 ** 15
+    reserved = _align(12 + len(_header_bytes(header)), 8)
+
+    offset = reserved
+    offsets = []
+    for values in blocks:
+        offsets.append(offset)
+        offset = _align(offset + len(values) * values.itemsize, 8)
+    for ref in refs:
+        ref['offset'] = offsets[ref.pop('index')]
+
+    encoded = _header_bytes(header)
+    with open(path, 'wb') as f:
+        f.write(SIDECAR_MAGIC + struct.pack('<II', SIDECAR_VERSION, reserved - 12))
+        f.write(encoded.ljust(reserved - 12, b' '))
+        for values, start in zip(blocks, offsets):
+            f.seek(start)
+            f.write(_little_endian(values))
+        f.truncate(offset)
+
+
+def read_sidecar_header(path):
+    """The JSON header of a sidecar, or None if it is missing or another version."""
+    try:
+        with open(path, 'rb') as f:
+            prefix = f.read(12)
+            if len(prefix) < 12 or prefix[:4] != SIDECAR_MAGIC:
+                return None
+            version, length = struct.unpack('<II', prefix[4:])
+            if version != SIDECAR_VERSION:
+                return None
+            return json.loads(f.read(length))
+    except (OSError, ValueError):
+        return None
+
+
+def read_sidecar(path):
+    """Read a sidecar back into (header, RecordStore)."""
+    data = Path(path).read_bytes()
+    header = read_sidecar_header(path)
+    if header is None:
+        raise ActivityError(f'{path} is not a version {SIDECAR_VERSION} records sidecar')
+    store = RecordStore()
+    store.length = header['length']
+    for name, (code, _) in RECORD_COLUMNS.items():
+        ref = header['columns'][name]
+        column = array(code)
+        column.frombytes(data[ref['offset']:ref['offset'] + store.length * column.itemsize])
+        store.columns[name] = _little_endian(column)
+    return header, store
+
+
+def sidecar_is_current(folder):
+    """True when the folder's sidecar was written from its current activity files."""
+    header = read_sidecar_header(Path(folder) / SIDECAR_NAME)
+    return header is not None and header.get('sources') == source_stats(folder)
+
+
+def preprocess_folder(folder):
+    """Write the sidecar for one activity folder; returns the number of records."""
+    folder = Path(folder)
+    sources = source_stats(folder)
+    activity = load_activity(folder)
+    if activity is None or not len(activity['store']):
+        raise ActivityError(f'No track points in {folder}')
+    # Write under a temporary name so a viewer never sees half a file
+    temporary = folder / (SIDECAR_NAME + '.tmp')
+    write_sidecar(temporary, activity, sources)
+    temporary.replace(folder / SIDECAR_NAME)
+    return len(activity['store'])
+
+
+def _header_bytes(header):
+    return json.dumps(header, separators=(',', ':')).encode('utf-8')
+
+
+def _align(value, alignment):
+    return -(-value // alignment) * alignment
+
+
+def _little_endian(values):
+    if sys.byteorder == 'big':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values
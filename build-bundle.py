@@ -32,61 +32,27 @@ def bundle_html(input_file: str, output_file: str, chart_lib: str):
     else:  # d3
         chart_js = (libs_dir / 'd3.js').read_text()
 
-    # Helper function to safely replace - escapes backslashes in replacement
-    def safe_replace(pattern, replacement_template, content_var):
-        # Use a lambda to avoid interpreting backslashes in the content
-        return re.sub(pattern, lambda m: replacement_template.format(content=content_var), html)
-
     # Replace Leaflet CSS link with inline style
     leaflet_css_pattern = r'<link rel="stylesheet" href="https://unpkg\.com/leaflet@[\d\.]+/dist/leaflet\.css"\s*/>'
     html = re.sub(leaflet_css_pattern, lambda m: f'<style>/* Leaflet CSS */\n{leaflet_css}\n</style>', html)
 
-    # Replace script tags with inline scripts
-    # Leaflet
-    leaflet_js_pattern = r'<script src="https://unpkg\.com/leaflet@[\d\.]+/dist/leaflet\.js"></script>'
-    html = re.sub(leaflet_js_pattern, lambda m: f'<script>/* Leaflet.js */\n{leaflet_js}\n</script>', html)
-
-    # Chart.js or D3.js
-    if chart_lib == 'chartjs':
-        chart_pattern = r'<script src="https://cdn\.jsdelivr\.net/npm/chart\.js@[\d\.]+/dist/chart\.umd\.min\.js"></script>'
-        html = re.sub(chart_pattern, lambda m: f'<script>/* Chart.js */\n{chart_js}\n</script>', html)
-    else:
-        d3_pattern = r'<script src="https://d3js\.org/d3\.v7\.min\.js"></script>'
-        html = re.sub(d3_pattern, lambda m: f'<script>/* D3.js */\n{chart_js}\n</script>', html)
-
-    # js-yaml
-    yaml_pattern = r'<script src="https://cdn\.jsdelivr\.net/npm/js-yaml@[\d\.]+/dist/js-yaml\.min\.js"></script>'
-    html = re.sub(yaml_pattern, lambda m: f'<script>/* js-yaml */\n{js_yaml}\n</script>', html)
-
-    # Garmin FIT SDK (ES Module) - bundled inline with blob URL
-    # Match the entire ES module script block
-    fit_pattern = r'<!-- FIT SDK as ES Module[^>]*>\s*<script type="module">\s*import[^<]+from[^;]+;\s*//[^<]+\s*window\.FitDecoder[^<]+\s*window\.FitStream[^<]+\s*</script>'
-
-    # Create inline module using blob URL to load the bundled FIT SDK
-    def create_fit_replacement(match):
-        # Escape backticks and ${} in the fit_sdk content for template literal
-        escaped_sdk = fit_sdk.replace('\\', '\\\\').replace('`', '\\`').replace('${', '\\${')
-        return f'''<!-- FIT SDK as ES Module - bundled inline -->
-    <script type="module">
-        /* @garmin/fitsdk bundled by jsDelivr */
-        const fitSdkCode = `{escaped_sdk}`;
-        const blob = new Blob([fitSdkCode], {{ type: 'text/javascript' }});
-        const url = URL.createObjectURL(blob);
-        const module = await import(url);
-        URL.revokeObjectURL(url);
-        // Expose to window
-        window.FitDecoder = module.Decoder;
-        window.FitStream = module.Stream;
-        // Dispatch custom event to signal FIT SDK is ready
-        window.dispatchEvent(new Event('fitsdk-ready'));
-    </script>'''
-
-    html = re.sub(fit_pattern, create_fit_replacement, html, flags=re.DOTALL)
+    # The libraries go in as inert text blocks, which the page only compiles
+    # (from a Blob URL) when it first needs them - see LIBRARIES in the source
+    libraries = {'leaflet': leaflet_js, chart_lib: chart_js, 'jsyaml': js_yaml, 'fitsdk': fit_sdk}
+    blocks = []
+    for name, code in libraries.items():
+        if re.search(r'</script', code, re.IGNORECASE):
+            raise ValueError(f'{name} contains </script and cannot be inlined')
+        blocks.append(f'<script type="text/plain" id="library-{name}">{code}</script>')
+    marker = '<!-- Bundled builds inline the libraries here (build-bundle.py) -->'
+    if marker not in html:
+        raise ValueError(f'{input_file} has no library marker')
+    html = html.replace(marker, '\n'.join(blocks))
 
     # Add a comment at the top indicating this is a bundled version
     html = re.sub(
         r'(<!DOCTYPE html>)',
-        r'\1\n<!-- BUNDLED VERSION: All JavaScript/CSS dependencies inlined.\n     Note: Map tiles still load from OpenStreetMap servers (requires internet for maps).\n     Charts, stats, and data processing work fully offline. -->',
+        r'\1\n<!-- BUNDLED VERSION: All JavaScript/CSS dependencies inlined.\n     Note: Map tiles still load from OpenStreetMap servers (requires internet for maps),\n     unless saved next to the activity with prefetch-tiles.py.\n     Charts, stats, and data processing work fully offline. -->',
         html
     )
 
@@ -125,7 +91,8 @@ def main():
     print("  - src/single-page-chartjs.html (Chart.js source)")
     print("  - src/single-page-d3.html (D3.js source)")
     print("\nNote: All JavaScript/CSS is bundled, but map tiles still load from")
-    print("      OpenStreetMap servers (internet required for maps).")
+    print("      OpenStreetMap servers (internet required for maps), unless saved")
+    print("      next to the activity with prefetch-tiles.py.")
     print("      Charts, stats, and data processing work fully offline.")
 
 
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Render a heatmap of every activity in an archive as a map tile pyramid.
+
+Rasterizes the route of each activity folder under the root into 256x256 PNG
+tiles, heatmap/{z}/{x}/{y}.png, where a pixel's colour says how many
+activities passed through it, and writes heatmap/heatmap.json describing the
+pyramid. The heatmap page (src/heatmap.html, saved next to the heatmap
+folder) shows the tiles over the base map as one more tile layer, so an
+archive of thousands of routes pans like a single map.
+
+Routes are kept in .heatmap-cache.json, by the size and modification time of
+each folder's activity files, with the tiles they cross: a rerun only reads
+new and changed folders, and only rerenders the tiles that new, changed or
+removed activities cross. Tiles are rendered by worker processes, in blocks
+of 8x8 tiles of one zoom level. Tiles left empty are deleted. PNGs are
+written with zlib, so only the standard library is needed.
+"""
+
+import argparse
+import json
+import math
+import os
+import shutil
+import struct
+import sys
+import time
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from activity_io import ActivityError, find_activity_folders, load_track, route_significance, source_stats
+
+HEATMAP_DIR = 'heatmap'
+HEATMAP_INFO = 'heatmap.json'
+CACHE_NAME = '.heatmap-cache.json'
+HEATMAP_VERSION = 1
+
+TILE_SIZE = 256
+BLOCK_TILES = 8            # Tiles per side of one rendering task
+DEFAULT_ZOOMS = '5-16'
+DEFAULT_SATURATION = 20    # Activities through a pixel for the brightest colour
+
+# Colour ramp from one activity (t = 0) to the saturation count (t = 1): (t, r, g, b, alpha)
+HEAT_STOPS = ((0.0, 200, 30, 0, 110), (0.5, 255, 140, 0, 210), (1.0, 255, 255, 190, 255))
+
+
+def parse_zooms(text):
+    low, _, high = text.partition('-')
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high <= 20:
+        raise argparse.ArgumentTypeError(f'invalid zoom range {text!r}')
+    return range(low, high + 1)
+
+
+def project(latitude, longitude, zoom):
+    """Web Mercator pixel coordinates of a point at `zoom`."""
+    scale = TILE_SIZE * 2 ** zoom
+    sin = math.sin(math.radians(max(-85.0511, min(85.0511, latitude))))
+    return ((longitude + 180) / 360 * scale,
+            (0.5 - math.log((1 + sin) / (1 - sin)) / (4 * math.pi)) * scale)
+
+
+def unproject(x, y, zoom):
+    """(latitude, longitude) of Web Mercator pixel coordinates at `zoom`."""
+    scale = TILE_SIZE * 2 ** zoom
+    return (math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale)))),
+            x / scale * 360 - 180)
+
+
+def route_pixels(folder, zoom):
+    """The folder's route as flat [x, y, ...] integer pixels at `zoom`.
+
+    Only the vertices the viewer would draw at that zoom are kept (route
+    significance of at least half a pixel), and repeats of a pixel dropped.
+    """
+    store, _ = load_track(folder)
+    if store is None or not len(store):
+        return []
+    latitude, longitude = store['latitude'], store['longitude']
+    significance = route_significance(latitude, longitude)
+    tolerance = 0.5 / 2 ** zoom
+    pixels = []
+    for i in range(len(store)):
+        if significance[i] < tolerance:
+            continue
+        x, y = project(latitude[i], longitude[i], zoom)
+        x, y = int(x), int(y)
+        if not pixels or x != pixels[-2] or y != pixels[-1]:
+            pixels += (x, y)
+    return pixels
+
+
+def crossed_tiles(pixels):
+    """The tiles a route's lines cross, as sorted [x, y] pairs."""
+    tiles = set()
+    for k in range(0, len(pixels), 2):
+        x, y = pixels[k], pixels[k + 1]
+        tiles.add((x // TILE_SIZE, y // TILE_SIZE))
+        if k:
+            # Long segments (GPS dropouts) cross tiles without vertices
+            dx, dy = x - pixels[k - 2], y - pixels[k - 1]
+            steps = max(abs(dx), abs(dy)) // (TILE_SIZE // 2)
+            for step in range(1, steps):
+                tiles.add(((x - dx * step // steps) // TILE_SIZE, (y - dy * step // steps) // TILE_SIZE))
+    return sorted([x, y] for x, y in tiles)
+
+
+def index_folder(folder, zoom):
+    pixels = route_pixels(folder, zoom)
+    return {'pixels': pixels, 'tiles': crossed_tiles(pixels)}
+
+
+def heat_palette(saturation):
+    """bytes.translate tables (red, green, blue, alpha) from a pixel's activity count."""
+    tables = [bytearray(256) for _ in range(4)]
+    for count in range(1, 256):
+        t = min(1.0, math.log(count) / math.log(saturation)) if saturation > 1 else 1.0
+        for (t0, *low), (t1, *high) in zip(HEAT_STOPS, HEAT_STOPS[1:]):
+            if t <= t1:
+                f = (t - t0) / (t1 - t0)
+                for table, a, b in zip(tables, low, high):
+                    table[count] = round(a + f * (b - a))
+                break
+    return [bytes(table) for table in tables]
+
+
+def encode_png(counts, palette):
+    """A TILE_SIZE-square RGBA PNG of per-pixel activity counts."""
+    rgba = bytearray(len(counts) * 4)
+    for channel, table in enumerate(palette):
+        rgba[channel::4] = counts.translate(table)
+    stride = TILE_SIZE * 4
+    raw = b''.join(b'\x00' + rgba[row * stride:(row + 1) * stride] for row in range(TILE_SIZE))
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', TILE_SIZE, TILE_SIZE, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(bytes(raw), 6))
+            + chunk(b'IEND', b''))
+
+
+# Routes by number, set in each worker process by _init_worker
+_routes = None
+
+
+def _init_worker(routes):
+    global _routes
+    _routes = routes
+
+
+def render_block(output, zoom, max_zoom, block, tiles, numbers, palette):
+    """Render the given tiles of one block from the routes that cross it.
+
+    Each route counts once per pixel. Returns (tiles written, tiles removed).
+    """
+    shift = max_zoom - zoom
+    size = BLOCK_TILES * TILE_SIZE
+    left, top = block[0] * size, block[1] * size
+    counts = bytearray(size * size)
+    stamps = array('i', [-1]) * (size * size)
+
+    for number in numbers:
+        pixels = _routes[number]
+        x0 = y0 = None
+        for k in range(0, len(pixels), 2):
+            x1, y1 = (pixels[k] >> shift) - left, (pixels[k + 1] >> shift) - top
+            if k == 0:
+                x0, y0 = x1, y1  # Drawn as a dot if it is the only vertex
+            elif x1 == x0 and y1 == y0:
+                continue
+            if max(x0, x1) < 0 or max(y0, y1) < 0 or min(x0, x1) >= size or min(y0, y1) >= size:
+                x0, y0 = x1, y1  # Outside the block
+                continue
+            dx, dy = x1 - x0, y1 - y0
+            steps = max(abs(dx), abs(dy), 1)
+            for step in range(steps + 1):
+                x, y = x0 + dx * step // steps, y0 + dy * step // steps
+                if 0 <= x < size and 0 <= y < size:
+                    p = y * size + x
+                    if stamps[p] != number:
+                        stamps[p] = number
+                        if counts[p] < 255:
+                            counts[p] += 1
+            x0, y0 = x1, y1
+
+    written = removed = 0
+    for tile_x, tile_y in tiles:
+        column = (tile_x - block[0] * BLOCK_TILES) * TILE_SIZE
+        row = (tile_y - block[1] * BLOCK_TILES) * TILE_SIZE
+        tile = bytearray()
+        for y in range(row, row + TILE_SIZE):
+            tile += counts[y * size + column:y * size + column + TILE_SIZE]
+        path = Path(output) / str(zoom) / str(tile_x) / f'{tile_y}.png'
+        if not any(tile):
+            if path.exists():
+                path.unlink()
+                removed += 1
+            continue
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Under a temporary name first, so the page never shows half a tile
+        temporary = path.with_name(path.name + '.tmp')
+        temporary.write_bytes(encode_png(tile, palette))
+        temporary.replace(path)
+        written += 1
+    return written, removed
+
+
+def load_cache(root, settings):
+    try:
+        cache = json.loads((root / CACHE_NAME).read_text())
+    except (OSError, ValueError):
+        return None
+    if cache.get('version') != HEATMAP_VERSION or cache.get('settings') != settings:
+        return None
+    return cache['folders']
+
+
+def write_json(path, data):
+    # Write under a temporary name so the page never sees half a file
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(data, separators=(',', ':'), ensure_ascii=False), encoding='utf-8')
+    temporary.replace(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root', type=Path, help='folder containing the activity folders')
+    parser.add_argument('--zoom', type=parse_zooms, default=DEFAULT_ZOOMS,
+                        help=f'zoom levels to render, e.g. 12 or 5-16 (default: {DEFAULT_ZOOMS})')
+    parser.add_argument('--saturation', type=int, default=DEFAULT_SATURATION,
+                        help=f'activities through a pixel for the brightest colour (default: {DEFAULT_SATURATION})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='reread every folder and rerender every tile')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    root = args.root.resolve()
+    output = root / HEATMAP_DIR
+    zooms = args.zoom
+    max_zoom = zooms[-1]
+    settings = {'zooms': [zooms[0], max_zoom], 'saturation': args.saturation}
+
+    cached = None if args.force else load_cache(root, settings)
+    if cached is None:
+        # New settings (or none yet): start over
+        shutil.rmtree(output, ignore_errors=True)
+        cached = {}
+
+    folders = {folder.relative_to(root).as_posix(): folder for folder in find_activity_folders([root])}
+    stats = {path: source_stats(folder) for path, folder in folders.items()}
+    pending = [path for path in folders if path not in cached or cached[path]['stats'] != stats[path]]
+    removed = [path for path in cached if path not in folders]
+    print(f"Found {len(folders)} activity folders, {len(folders) - len(pending)} unchanged, {len(removed)} removed")
+
+    # Tiles crossed by the routes that changed, before and after
+    dirty = set()
+    for path in pending + removed:
+        if path in cached:
+            dirty.update(map(tuple, cached[path]['tiles']))
+    entries = {path: cached[path] for path in folders if path not in pending}
+
+    failed = 0
+    jobs = max(1, args.jobs)
+    if pending:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            futures = {pool.submit(index_folder, folders[path], max_zoom): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    entry = future.result()
+                except (ActivityError, OSError, ValueError) as error:
+                    failed += 1
+                    print(f"  {path}: failed ({error})", file=sys.stderr)
+                    continue
+                entries[path] = {'stats': stats[path], **entry}
+                dirty.update(map(tuple, entry['tiles']))
+                print(f"  {path}: {len(entry['pixels']) // 2} vertices")
+
+    # Dirty tiles of every zoom level, in blocks, with the routes crossing each block
+    paths = list(entries)
+    blocks = {}
+    for zoom in zooms:
+        shift = max_zoom - zoom
+        for x, y in dirty:
+            x, y = x >> shift, y >> shift
+            blocks.setdefault((zoom, x // BLOCK_TILES, y // BLOCK_TILES), [set(), []])[0].add((x, y))
+    for number, path in enumerate(paths):
+        tiles = entries[path]['tiles']
+        for zoom in zooms:
+            shift = max_zoom - zoom
+            for key in {(zoom, (x >> shift) // BLOCK_TILES, (y >> shift) // BLOCK_TILES) for x, y in tiles}:
+                if key in blocks:
+                    blocks[key][1].append(number)
+
+    written = emptied = 0
+    if blocks:
+        palette = heat_palette(args.saturation)
+        routes = [entries[path]['pixels'] for path in paths]
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(routes,)) as pool:
+            futures = [pool.submit(render_block, output, zoom, max_zoom, (block_x, block_y),
+                                   sorted(tiles), numbers, palette)
+                       for (zoom, block_x, block_y), (tiles, numbers) in blocks.items()]
+            for future in as_completed(futures):
+                tiles_written, tiles_removed = future.result()
+                written += tiles_written
+                emptied += tiles_removed
+
+    # Bounds of everything rendered, from the tiles the routes cross at the deepest zoom
+    all_tiles = [tile for entry in entries.values() for tile in entry['tiles']]
+    bounds = None
+    if all_tiles:
+        north, west = unproject(min(x for x, _ in all_tiles) * TILE_SIZE, min(y for _, y in all_tiles) * TILE_SIZE, max_zoom)
+        south, east = unproject((max(x for x, _ in all_tiles) + 1) * TILE_SIZE,
+                                (max(y for _, y in all_tiles) + 1) * TILE_SIZE, max_zoom)
+        bounds = [round(south, 5), round(west, 5), round(north, 5), round(east, 5)]
+
+    output.mkdir(exist_ok=True)
+    write_json(output / HEATMAP_INFO, {
+        'version': HEATMAP_VERSION,
+        'tiles': '{z}/{x}/{y}.png',
+        'minZoom': zooms[0],
+        'maxZoom': max_zoom,
+        'bounds': bounds,
+        'activities': sum(1 for entry in entries.values() if entry['pixels']),
+        'saturation': args.saturation,
+    })
+    write_json(root / CACHE_NAME, {'version': HEATMAP_VERSION, 'settings': settings, 'folders': entries})
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Rendered {written} tiles ({emptied} emptied) from {len(pending) - failed} new or changed"
+          f" activities in {elapsed:.1f}s -> {output}" + (f" ({failed} failed)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Build library.json, the index of an archive of activity folders.
+
+Walks the root for activity folders (any folder with an activity file or a
+metadata file), and for each one records the title, date and type from its
+metadata plus distance, duration, elevation gain and bounding box from its
+track. The library page (src/library.html, saved as index.html in the root)
+lists that index.
+
+Results are cached in .library-cache.json by the size and modification time
+of each folder's files, so a rescan only reads the folders that changed. A
+current activity.records.bin (see preprocess-activities.py) is read instead
+of parsing the raw files.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timezone
+from pathlib import Path
+
+from activity_io import (
+    METADATA_FILES, SIDECAR_NAME, SOURCE_FILES, ActivityError, find_activity_folders,
+    load_track, read_metadata, track_bounds,
+)
+
+INDEX_NAME = 'library.json'
+CACHE_NAME = '.library-cache.json'
+INDEX_VERSION = 1
+
+# Column order of the rows in library.json
+INDEX_FIELDS = ['path', 'title', 'date', 'type', 'distance', 'duration', 'elevationGain', 'bbox']
+
+
+def folder_stats(folder):
+    """[size, mtime_ns] of every file an index row is built from."""
+    stats = {}
+    for name in SOURCE_FILES + METADATA_FILES + (SIDECAR_NAME,):
+        try:
+            stat = (folder / name).stat()
+        except OSError:
+            continue
+        stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def index_row(folder, root):
+    """The library.json row for one activity folder."""
+    metadata = read_metadata(folder)
+    path = folder.relative_to(root).as_posix()
+    store, summary = load_track(folder)
+
+    date = str(metadata.get('date', ''))[:10]
+    if not date and summary and summary['startTime']:
+        date = datetime.fromtimestamp(summary['startTime'] / 1000, timezone.utc).strftime('%Y-%m-%d')
+
+    bounds = track_bounds(store) if store is not None else None
+    bbox = [round(value, 5) for value in bounds] if bounds else None
+
+    return [
+        path,
+        metadata.get('title') or metadata.get('name') or folder.name,
+        date,
+        metadata.get('type', ''),
+        round(summary['distance'], 3) if summary else None,
+        round(summary['duration']) if summary else None,
+        round(summary['elevationGain'], 1) if summary else None,
+        bbox,
+    ]
+
+
+def load_cache(root):
+    try:
+        cache = json.loads((root / CACHE_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+    if cache.get('version') != INDEX_VERSION or cache.get('fields') != INDEX_FIELDS:
+        return {}
+    return cache['folders']
+
+
+def write_json(path, data):
+    # Write under a temporary name so the page never sees half a file
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_text(json.dumps(data, separators=(',', ':'), ensure_ascii=False), encoding='utf-8')
+    temporary.replace(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root', type=Path, help='folder containing the activity folders')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore the cache and reread every folder')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    root = args.root.resolve()
+    cache = {} if args.force else load_cache(root)
+    folders = {}
+    for folder in find_activity_folders([root], SOURCE_FILES + METADATA_FILES):
+        folders[folder.relative_to(root).as_posix()] = (folder, folder_stats(folder))
+
+    entries = {}
+    pending = []
+    for path, (folder, stats) in folders.items():
+        cached = cache.get(path)
+        if cached and cached['stats'] == stats:
+            entries[path] = cached
+        else:
+            pending.append(path)
+    print(f"Found {len(folders)} activity folders, {len(folders) - len(pending)} unchanged")
+
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            futures = {pool.submit(index_row, folders[path][0], root): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    entries[path] = {'stats': folders[path][1], 'row': future.result()}
+                    print(f"  {path}")
+                except (ActivityError, OSError, ValueError) as error:
+                    failed += 1
+                    print(f"  {path}: failed ({error})", file=sys.stderr)
+
+    # Newest first, which is how the page opens
+    rows = sorted((entry['row'] for entry in entries.values()), key=lambda row: (row[2], row[0]), reverse=True)
+    write_json(root / INDEX_NAME, {'version': INDEX_VERSION, 'fields': INDEX_FIELDS, 'activities': rows})
+    write_json(root / CACHE_NAME, {'version': INDEX_VERSION, 'fields': INDEX_FIELDS, 'folders': entries})
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Indexed {len(rows)} activities in {elapsed:.1f}s -> {root / INDEX_NAME}"
+          + (f" ({failed} failed)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
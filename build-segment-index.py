@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Build the segment index of an archive of activity folders, and look up a stretch.
+
+Indexes the route of every activity folder under the root into
+.segment-index.json (see segment_index.py); a rerun only reads the folders
+that are new or changed, and drops the ones that are gone. serve.py answers
+the viewer's lookups from that file.
+
+With --find, also lists the other activities that covered a stretch of one
+activity, given as the folder and the distances (km) where it starts and ends:
+
+    python3 build-segment-index.py ~/activities --find 2025/11-02-run 1.2 2.8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from activity_io import ActivityError
+from segment_index import INDEX_NAME, SegmentIndex, index_entry, load_entries, pending_folders, write_entries
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(round(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}' if hours else f'{minutes}:{seconds:02d}'
+
+
+def update_index(root, jobs, force):
+    """Index new and changed folders; returns (entries, number updated, number failed)."""
+    cached = {} if force else load_entries(root)
+    folders, pending = pending_folders(root, cached)
+    entries = {path: cached[path] for path in folders if path not in pending}
+    print(f"Found {len(folders)} activity folders, {len(entries)} unchanged")
+
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, jobs)) as pool:
+            futures = {pool.submit(index_entry, folders[path][0]): path for path in pending}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    entry = future.result()
+                except (ActivityError, OSError, ValueError) as error:
+                    failed += 1
+                    print(f"  {path}: failed ({error})", file=sys.stderr)
+                    continue
+                # Folders without a timed track are kept too, so they are not reread
+                entries[path] = {'stats': folders[path][1], **(entry or {})}
+                print(f"  {path}: {len(entry['cells']) if entry else 0} cells")
+    if pending or len(entries) != len(cached):
+        write_entries(root, entries)
+    return entries, len(pending) - failed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root', type=Path, help='folder containing the activity folders')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='ignore the index and reread every folder')
+    parser.add_argument('--find', nargs=3, metavar=('FOLDER', 'FROM', 'TO'),
+                        help='list the other activities over this stretch of FOLDER (km from its start)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    root = args.root.resolve()
+    entries, updated, failed = update_index(root, args.jobs, args.force)
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Indexed {updated} folders in {elapsed:.1f}s -> {root / INDEX_NAME}"
+          + (f" ({failed} failed)" if failed else ""))
+
+    if args.find:
+        folder, start, end = args.find
+        path = Path(folder).resolve().relative_to(root).as_posix() if Path(folder).is_dir() else folder.strip('/')
+        index = SegmentIndex(entries)
+        started = time.perf_counter()
+        try:
+            result = index.find(path, float(start), float(end))
+        except ValueError as error:
+            print(f"Cannot look up {start}-{end} km of {path}: {error}", file=sys.stderr)
+            return 1
+        if result is None:
+            print(f"{path} is not an indexed activity", file=sys.stderr)
+            return 1
+        lookup_ms = (time.perf_counter() - started) * 1000
+        print(f"\n{path}, {result['from']:.2f}-{result['to']:.2f} km: {format_duration(result['elapsed'])}")
+        print(f"{len(result['matches'])} passes in {len(index)} activities ({lookup_ms:.1f} ms):")
+        for match in result['matches']:
+            print(f"  {format_duration(match['elapsed']):>8}  {match['date']}  {match['title']} "
+                  f"({match['path']}, from {match['start']:.2f} km)")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Write small thumbnails of the photos and videos in activity folders.
+
+For every folder under the given roots with a media/ directory, writes a
+square JPEG thumbnail of each photo and video, and a poster frame of each
+video, into thumbnails/ next to media/, with thumbnails/thumbnails.json
+listing them. The viewer shows those in the description card instead of
+downloading and decoding every full-size original, and shows the poster frame
+until a video is played. SVG images are left alone: they are small and scale
+by themselves.
+
+Photos are resized with Pillow when it is installed (it also applies the
+EXIF orientation), and with ffmpeg otherwise; video frames always come from
+ffmpeg. Thumbnails newer than their original are kept, so rerunning over an
+archive only touches what changed, and thumbnails of deleted media are
+removed.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+MEDIA_DIR = 'media'
+THUMBNAILS_DIR = 'thumbnails'
+THUMBNAIL_INDEX = 'thumbnails.json'
+THUMBNAIL_INDEX_VERSION = 1
+# The extensions the viewer's detectMediaFiles() recognizes, minus SVG
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif', '.webp')
+VIDEO_EXTENSIONS = ('.mp4', '.mov', '.avi', '.webm')
+# Shown at 64x64 CSS pixels; twice that for high-density screens
+DEFAULT_SIZE = 128
+POSTER_WIDTH = 1280
+JPEG_QUALITY = 80
+
+
+class ThumbnailError(Exception):
+    """A media file could not be read or its thumbnail not written."""
+
+
+def find_media_folders(roots):
+    """Yield every folder under `roots` that has a media/ directory."""
+    for root in roots:
+        for folder, subfolders, _ in os.walk(root):
+            if MEDIA_DIR in subfolders:
+                yield Path(folder)
+            # Hidden folders are skipped, and media/ and thumbnails/ hold no activities
+            subfolders[:] = sorted(name for name in subfolders
+                                   if not name.startswith('.') and name not in (MEDIA_DIR, THUMBNAILS_DIR))
+
+
+def media_files(folder):
+    """{name: 'image' | 'video'} of the folder's media, by path relative to media/."""
+    media = {}
+    for path in sorted((folder / MEDIA_DIR).rglob('*')):
+        name = path.relative_to(folder / MEDIA_DIR).as_posix()
+        if not path.is_file() or any(part.startswith('.') for part in name.split('/')):
+            continue
+        lower = name.lower()
+        if lower.endswith(IMAGE_EXTENSIONS):
+            media[name] = 'image'
+        elif lower.endswith(VIDEO_EXTENSIONS):
+            media[name] = 'video'
+    return media
+
+
+def is_current(source, target):
+    return target.exists() and target.stat().st_mtime >= source.stat().st_mtime
+
+
+def run_ffmpeg(arguments):
+    try:
+        subprocess.run(['ffmpeg', '-v', 'error', '-y', *arguments], check=True, capture_output=True, text=True)
+    except FileNotFoundError:
+        raise ThumbnailError('ffmpeg is not installed') from None
+    except subprocess.CalledProcessError as error:
+        raise ThumbnailError(error.stderr.strip().splitlines()[-1] if error.stderr.strip() else error) from None
+
+
+def write_atomically(target, write):
+    """Write `target` through `write(path)` under a temporary name, so the viewer never sees half a file."""
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary = target.with_name(target.name + '.tmp.jpg')
+    try:
+        write(temporary)
+        temporary.replace(target)
+    finally:
+        temporary.unlink(missing_ok=True)
+
+
+def write_thumbnail(source, target, size):
+    """A size x size JPEG of the middle of the image `source`."""
+    def write(path):
+        if Image is not None:
+            try:
+                with Image.open(source) as image:
+                    # JPEGs are decoded at the smallest scale still larger than needed
+                    image.draft('RGB', (size * 2, size * 2))
+                    image = ImageOps.exif_transpose(image).convert('RGB')
+                    ImageOps.fit(image, (size, size), Image.LANCZOS).save(
+                        path, 'JPEG', quality=JPEG_QUALITY, optimize=True)
+            except OSError as error:
+                raise ThumbnailError(error) from None
+        else:
+            run_ffmpeg(['-i', str(source), '-frames:v', '1', '-q:v', '4', '-vf',
+                        f'scale={size}:{size}:force_original_aspect_ratio=increase,crop={size}:{size}',
+                        str(path)])
+    write_atomically(target, write)
+
+
+def write_poster(source, target):
+    """A JPEG of an early frame of the video `source`, at most POSTER_WIDTH wide."""
+    scale = f"scale='min({POSTER_WIDTH},iw)':-2"
+
+    def write(path):
+        try:
+            # A second in skips fades from black; clips shorter than that use their first frame
+            run_ffmpeg(['-ss', '1', '-i', str(source), '-frames:v', '1', '-q:v', '3', '-vf', scale, str(path)])
+        except ThumbnailError:
+            pass
+        if not path.exists() or path.stat().st_size == 0:
+            run_ffmpeg(['-i', str(source), '-frames:v', '1', '-q:v', '3', '-vf', scale, str(path)])
+    write_atomically(target, write)
+
+
+def thumbnail_media(folder, name, kind, size, force):
+    """Write one media file's thumbnail (and poster); returns its index entry and whether anything was written."""
+    source = folder / MEDIA_DIR / name
+    output = folder / THUMBNAILS_DIR
+    entry = {'thumbnail': f'{name}.jpg'}
+    written = False
+    if kind == 'video':
+        entry['poster'] = f'{name}.poster.jpg'
+        poster = output / entry['poster']
+        if force or not is_current(source, poster):
+            write_poster(source, poster)
+            written = True
+        # The thumbnail is cut from the poster frame
+        source = poster
+    thumbnail = output / entry['thumbnail']
+    if force or not is_current(source, thumbnail):
+        write_thumbnail(source, thumbnail, size)
+        written = True
+    return entry, written
+
+
+def thumbnail_folder(folder, args):
+    """Thumbnail one folder's media; returns (written, failed)."""
+    media = media_files(folder)
+    if not media:
+        print(f"  {folder}: no photos or videos")
+        return 0, 0
+
+    # Thumbnails of another size are all rewritten
+    output = folder / THUMBNAILS_DIR
+    try:
+        force = args.force or json.loads((output / THUMBNAIL_INDEX).read_text()).get('size') != args.size
+    except (OSError, ValueError):
+        force = args.force
+
+    def run(item):
+        try:
+            return item[0], thumbnail_media(folder, *item, args.size, force)
+        except (ThumbnailError, OSError) as error:
+            return item[0], error
+
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = dict(pool.map(run, media.items()))
+
+    files = {}
+    failed = []
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            failed.append(f'{name}: {result}')
+        else:
+            files[name] = result[0]
+    for error in failed[:5]:
+        print(f"    failed {error}", file=sys.stderr)
+
+    output.mkdir(exist_ok=True)
+    (output / THUMBNAIL_INDEX).write_text(json.dumps({
+        'version': THUMBNAIL_INDEX_VERSION,
+        'size': args.size,
+        'files': files,
+    }) + '\n')
+
+    # Thumbnails of media that is gone (those of media that failed this time stay)
+    kept = {f'{name}{suffix}' for name in media for suffix in ('.jpg', '.poster.jpg')}
+    for path in output.rglob('*.jpg'):
+        if path.relative_to(output).as_posix() not in kept:
+            path.unlink()
+
+    written = sum(1 for result in results.values() if not isinstance(result, Exception) and result[1])
+    print(f"  {folder}: {written} written, {len(files) - written} up to date"
+          + (f", {len(failed)} failed" if failed else ""))
+    return written, len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('roots', nargs='+', type=Path, help='activity folders, or folders containing them')
+    parser.add_argument('-s', '--size', type=int, default=DEFAULT_SIZE,
+                        help=f'thumbnail width and height in pixels (default: {DEFAULT_SIZE})')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='parallel conversions (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='rewrite thumbnails that are up to date')
+    args = parser.parse_args()
+
+    if Image is None and shutil.which('ffmpeg') is None:
+        print("Needs Pillow (pip install Pillow) or ffmpeg to read images", file=sys.stderr)
+        return 1
+
+    started = time.perf_counter()
+    folders = list(find_media_folders(args.roots))
+    print(f"Found {len(folders)} folders with media")
+    written = failed = 0
+    for folder in folders:
+        folder_written, folder_failed = thumbnail_folder(folder, args)
+        written += folder_written
+        failed += folder_failed
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Wrote {written} thumbnails in {elapsed:.1f}s"
+          + (f" ({failed} failed)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
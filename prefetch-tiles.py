@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Download the map tiles around an activity's track for offline viewing.
+
+For each activity folder, takes the track's bounding box (plus a margin of
+tiles), and saves every tile of the requested zoom levels from the tile source
+into tiles/{z}/{x}/{y}.png next to the activity, with tiles/tiles.json
+describing what is there. The viewer then loads those tiles from disk and
+only asks the tile source for the rest, so with a bundled viewer the activity
+works fully offline at the prefetched zoom levels.
+
+Tiles already on disk are not downloaded again. Please respect the tile
+source's usage policy: tile.openstreetmap.org does not allow bulk
+downloading, so keep the zoom range small, or point --source at your own
+tile server.
+"""
+
+import argparse
+import json
+import math
+import sys
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from activity_io import load_track, track_bounds
+
+DEFAULT_SOURCE = 'https://tile.openstreetmap.org/{z}/{x}/{y}.png'
+DEFAULT_ATTRIBUTION = '© OpenStreetMap contributors'
+TILES_DIR = 'tiles'
+TILES_INFO = 'tiles.json'
+TILES_INFO_VERSION = 1
+USER_AGENT = 'plain-text-fitness-prefetch-tiles/0.1'
+
+
+def tile_for(latitude, longitude, zoom):
+    """(x, y) of the Web Mercator tile containing a point."""
+    n = 2 ** zoom
+    latitude = max(-85.0511, min(85.0511, latitude))
+    x = int((longitude + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(latitude))) / math.pi) / 2 * n)
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_ranges(bounds, zooms, padding):
+    """{zoom: [x_min, y_min, x_max, y_max]} covering `bounds` plus `padding` tiles."""
+    south, west, north, east = bounds
+    ranges = {}
+    for zoom in zooms:
+        last = 2 ** zoom - 1
+        x_min, y_min = tile_for(north, west, zoom)
+        x_max, y_max = tile_for(south, east, zoom)
+        ranges[zoom] = [max(0, x_min - padding), max(0, y_min - padding),
+                        min(last, x_max + padding), min(last, y_max + padding)]
+    return ranges
+
+
+def count_tiles(ranges):
+    return sum((x_max - x_min + 1) * (y_max - y_min + 1) for x_min, y_min, x_max, y_max in ranges.values())
+
+
+def parse_zooms(text):
+    low, _, high = text.partition('-')
+    low, high = int(low), int(high or low)
+    if not 0 <= low <= high <= 22:
+        raise argparse.ArgumentTypeError(f'invalid zoom range {text!r}')
+    return range(low, high + 1)
+
+
+def fetch_tile(source, path, z, x, y):
+    """Download one tile unless it is on disk; returns 'cached', 'fetched' or an error message."""
+    if path.exists():
+        return 'cached'
+    request = urllib.request.Request(source.format(z=z, x=x, y=y), headers={'User-Agent': USER_AGENT})
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            data = response.read()
+    except (urllib.error.URLError, OSError) as error:
+        return f'{z}/{x}/{y}: {error}'
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write under a temporary name so the viewer never sees half a tile
+    temporary = path.with_name(path.name + '.tmp')
+    temporary.write_bytes(data)
+    temporary.replace(path)
+    return 'fetched'
+
+
+def prefetch_folder(folder, args):
+    """Prefetch one activity folder's tiles; returns the number of failed tiles."""
+    store, _ = load_track(folder)
+    bounds = track_bounds(store) if store is not None else None
+    if bounds is None:
+        print(f"  {folder}: no track, skipped")
+        return 0
+
+    ranges = tile_ranges(bounds, args.zoom, args.padding)
+    total = count_tiles(ranges)
+    if total > args.max_tiles:
+        print(f"  {folder}: {total} tiles is over --max-tiles {args.max_tiles}; "
+              f"narrow --zoom or raise the limit", file=sys.stderr)
+        return total
+
+    extension = Path(args.source.split('?')[0]).suffix or '.png'
+    output = folder / TILES_DIR
+    jobs = [(output / str(z) / str(x) / f'{y}{extension}', z, x, y)
+            for z, (x_min, y_min, x_max, y_max) in ranges.items()
+            for x in range(x_min, x_max + 1)
+            for y in range(y_min, y_max + 1)]
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+        results = list(pool.map(lambda job: fetch_tile(args.source, *job), jobs))
+
+    errors = [result for result in results if result not in ('cached', 'fetched')]
+    for error in errors[:5]:
+        print(f"    failed {error}", file=sys.stderr)
+
+    # Ranges of earlier runs stay listed: their tiles are still on disk
+    info_path = output / TILES_INFO
+    try:
+        previous = json.loads(info_path.read_text())
+    except (OSError, ValueError):
+        previous = {}
+    if previous.get('source') != args.source:
+        previous = {}
+    merged = {int(z): r for z, r in previous.get('ranges', {}).items()}
+    for z, (x_min, y_min, x_max, y_max) in ranges.items():
+        if z in merged:
+            old = merged[z]
+            x_min, y_min = min(x_min, old[0]), min(y_min, old[1])
+            x_max, y_max = max(x_max, old[2]), max(y_max, old[3])
+        merged[z] = [x_min, y_min, x_max, y_max]
+
+    output.mkdir(parents=True, exist_ok=True)
+    info_path.write_text(json.dumps({
+        'version': TILES_INFO_VERSION,
+        'tiles': f'{{z}}/{{x}}/{{y}}{extension}',
+        'source': args.source,
+        'attribution': args.attribution,
+        'minzoom': min(merged),
+        'maxzoom': max(merged),
+        'ranges': {str(z): merged[z] for z in sorted(merged)},
+    }) + '\n')
+
+    fetched = results.count('fetched')
+    print(f"  {folder}: {fetched} downloaded, {results.count('cached')} already there"
+          + (f", {len(errors)} failed" if errors else ""))
+    return len(errors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('folders', nargs='+', type=Path, help='activity folders')
+    parser.add_argument('-z', '--zoom', type=parse_zooms, default=parse_zooms('12-15'),
+                        help='zoom level or range, e.g. 14 or 12-15 (default: 12-15)')
+    parser.add_argument('-p', '--padding', type=int, default=1,
+                        help='extra tiles around the track at each zoom level (default: 1)')
+    parser.add_argument('-s', '--source', default=DEFAULT_SOURCE,
+                        help='tile URL template with {z}, {x} and {y} (default: OpenStreetMap)')
+    parser.add_argument('--attribution', default=DEFAULT_ATTRIBUTION, help='attribution shown on the map')
+    parser.add_argument('--max-tiles', type=int, default=500,
+                        help='refuse folders needing more tiles than this (default: 500)')
+    parser.add_argument('-j', '--jobs', type=int, default=2, help='parallel downloads (default: 2)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    failed = sum(prefetch_folder(folder, args) for folder in args.folders)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Prefetched tiles for {len(args.folders)} folders in {elapsed:.1f}s"
+          + (f" ({failed} tiles failed)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Preprocess activity folders into records sidecars.
+
+For every folder under the given roots that holds an activity.fit or
+activity.gpx, parse it the way the viewer does and write
+activity.records.bin next to it: the merged record columns, the summary, the
+route's level-of-detail ranking and the chart pyramids. The viewer loads that
+file with a single request instead of downloading and parsing the raw files.
+
+Folders whose sidecar was written from the current activity files (same size
+and modification time) are skipped, so rerunning over a large archive only
+touches what changed.
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
+
+from activity_io import ActivityError, find_activity_folders, preprocess_folder, sidecar_is_current
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('roots', nargs='+', type=Path, help='activity folders, or folders containing them')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='worker processes (default: one per CPU)')
+    parser.add_argument('-f', '--force', action='store_true', help='rewrite sidecars that are up to date')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    folders = list(find_activity_folders(args.roots))
+    pending = [folder for folder in folders if args.force or not sidecar_is_current(folder)]
+    print(f"Found {len(folders)} activity folders, {len(folders) - len(pending)} up to date")
+
+    failed = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=max(1, args.jobs)) as pool:
+            futures = {pool.submit(preprocess_folder, folder): folder for folder in pending}
+            for future in as_completed(futures):
+                folder = futures[future]
+                try:
+                    records = future.result()
+                    print(f"  {folder}: {records} records")
+                except (ActivityError, OSError, ValueError) as error:
+                    failed += 1
+                    print(f"  {folder}: failed ({error})", file=sys.stderr)
+
+    elapsed = time.perf_counter() - started
+    print(f"\n✅ Preprocessed {len(pending) - failed} folders in {elapsed:.1f}s"
+          + (f" ({failed} failed)" if failed else ""))
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,328 @@
+"""
+Spatial index of the routes in an archive of activity folders, for finding the
+other activities that covered a stretch of route and their times on it.
+
+Each track (as load_track reads it, so exactly the viewer's records) is reduced
+to its visits to the cells of a fixed latitude/longitude grid, about 25 m
+square at mid latitudes: one entry per cell entered, with its position, time
+and distance. The index maps every cell to the activities that visited it.
+
+A query takes a stretch of an indexed activity, between two distances, and
+turns it into the sequence of cells it crosses (its checkpoints). Activities
+found near at least 90% of the checkpoints are candidates; for each, its
+visits are walked for passes that reach the checkpoints in order, and every
+pass is timed between the points nearest the stretch's ends. Only the few
+candidates are walked, so a query takes milliseconds however many activities
+are indexed.
+
+The index is kept in .segment-index.json with the size and modification time
+of each folder's files, so updating it only reads new and changed folders.
+Only the standard library is used.
+"""
+
+import json
+import math
+from datetime import datetime, timezone
+from pathlib import Path
+
+from activity_io import (
+    METADATA_FILES, SOURCE_FILES, find_activity_folders, load_track, read_metadata, source_stats,
+)
+
+INDEX_NAME = '.segment-index.json'
+INDEX_VERSION = 1
+
+# Grid cell size: 22 m north-south, 25 m east-west at 42° latitude
+CELL_LATITUDE = 0.0002
+CELL_LONGITUDE = 0.0003
+CELL_COLUMNS = 1 << 21  # More than 360 / CELL_LONGITUDE
+
+# A pass may miss this share of the checkpoints (GPS noise, cut corners)
+MAX_MISSED_CHECKPOINTS = 0.1
+# and must cover the stretch in this range of its distance
+DISTANCE_RATIO = (0.8, 1.25)
+# Consecutive visits away from the route that end a pass
+MAX_OFF_ROUTE_VISITS = 3
+# Shortest stretch that can be looked up, km
+MIN_STRETCH = 0.1
+
+
+def cell_of(latitude, longitude):
+    """The grid cell of a position, as one integer."""
+    row = math.floor((latitude + 90) / CELL_LATITUDE)
+    column = math.floor((longitude + 180) / CELL_LONGITUDE)
+    return row * CELL_COLUMNS + column
+
+
+def neighbourhood(cell):
+    """The cell and the eight around it."""
+    return {cell + rows * CELL_COLUMNS + columns for rows in (-1, 0, 1) for columns in (-1, 0, 1)}
+
+
+def route_visits(store):
+    """The track's cell visits: cells, times (s from the first timed record),
+    distances (km) and points (flat latitude, longitude pairs), plus the last
+    record.
+
+    Records without a timestamp are skipped, as they cannot be timed.
+    """
+    latitude, longitude, distance = store['latitude'], store['longitude'], store['distance']
+    cells, times, distances, points = [], [], [], []
+    start = previous = last = None
+
+    def visit(i, cell):
+        cells.append(cell)
+        times.append(round((store['timestamp'][i] - start) / 1000, 1))
+        distances.append(round(distance[i], 4))
+        points.extend((round(latitude[i], 6), round(longitude[i], 6)))
+
+    for i in range(len(store)):
+        if store.get('timestamp', i) is None:
+            continue
+        if start is None:
+            start = store['timestamp'][i]
+        last = i
+        cell = cell_of(latitude[i], longitude[i])
+        if cell != previous:
+            visit(i, cell)
+            previous = cell
+            last = None
+    # The finish, so that stretches can run to the end of the activity
+    if last is not None:
+        visit(last, previous)
+    return {'startTime': start, 'cells': cells, 'times': times, 'distances': distances, 'points': points}
+
+
+def index_entry(folder):
+    """The index entry of one activity folder, or None when it has no timed track."""
+    store, _ = load_track(folder)
+    if store is None or not len(store):
+        return None
+    visits = route_visits(store)
+    if visits['startTime'] is None:
+        return None
+    metadata = read_metadata(folder)
+    date = str(metadata.get('date', ''))[:10]
+    if not date:
+        date = datetime.fromtimestamp(visits['startTime'] / 1000, timezone.utc).strftime('%Y-%m-%d')
+    return {
+        'title': metadata.get('title') or metadata.get('name') or folder.name,
+        'date': date,
+        **visits,
+    }
+
+
+def folder_stats(folder):
+    """What decides whether a folder's entry is current: its activity files and metadata."""
+    stats = {name: [stat['size'], stat['mtime_ns']] for name, stat in source_stats(folder).items()}
+    for name in METADATA_FILES:
+        path = folder / name
+        if path.is_file():
+            stat = path.stat()
+            stats[name] = [stat.st_size, stat.st_mtime_ns]
+    return stats
+
+
+def load_entries(root):
+    """The folder entries of the index in `root`, {} if there is none or it is outdated."""
+    try:
+        index = json.loads((Path(root) / INDEX_NAME).read_text())
+    except (OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION or index.get('cell') != [CELL_LATITUDE, CELL_LONGITUDE]:
+        return {}
+    return index['folders']
+
+
+def write_entries(root, entries):
+    path = Path(root) / INDEX_NAME
+    # Write under a temporary name so a running server never reads half a file
+    temporary = path.with_name(path.name + '.tmp')
+    index = {'version': INDEX_VERSION, 'cell': [CELL_LATITUDE, CELL_LONGITUDE], 'folders': entries}
+    temporary.write_text(json.dumps(index, separators=(',', ':'), ensure_ascii=False), encoding='utf-8')
+    temporary.replace(path)
+
+
+def pending_folders(root, entries):
+    """The current activity folders under `root` by path, and the paths whose entries are missing or stale."""
+    folders = {}
+    for folder in find_activity_folders([root], SOURCE_FILES):
+        folders[folder.relative_to(root).as_posix()] = (folder, folder_stats(folder))
+    stale = [path for path, (_, stats) in folders.items()
+             if path not in entries or entries[path]['stats'] != stats]
+    return folders, stale
+
+
+class SegmentIndex:
+    """The loaded index: activity entries by path, and the activities that visited each cell."""
+
+    def __init__(self, entries):
+        self.entries = {path: entry for path, entry in entries.items() if entry.get('cells')}
+        self.paths = list(self.entries)
+        self.postings = {}
+        for number, path in enumerate(self.paths):
+            for cell in set(self.entries[path]['cells']):
+                self.postings.setdefault(cell, []).append(number)
+
+    @classmethod
+    def load(cls, root):
+        return cls(load_entries(root))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def find(self, path, start, end):
+        """Every pass of other activities over the stretch of `path` between
+        `start` and `end` km, fastest first.
+
+        Returns {'activity', 'from', 'to', 'distance', 'elapsed', 'matches'},
+        each match with the activity's path, title, date, the distance where it
+        reached the stretch and its elapsed seconds; or None when `path` is not
+        indexed. Raises ValueError for a stretch outside the activity or
+        shorter than MIN_STRETCH.
+        """
+        entry = self.entries.get(path)
+        if entry is None:
+            return None
+        distances = entry['distances']
+        start, end = max(start, distances[0]), min(end, distances[-1])
+        if end - start < MIN_STRETCH:
+            raise ValueError(f'the stretch must be at least {MIN_STRETCH * 1000:.0f} m of the activity')
+
+        first_point, start_time = _at_distance(entry, start)
+        last_point, end_time = _at_distance(entry, end)
+        checkpoints = [cell_of(*first_point)]
+        for k in range(len(distances)):
+            if start < distances[k] < end and entry['cells'][k] != checkpoints[-1]:
+                checkpoints.append(entry['cells'][k])
+        if cell_of(*last_point) != checkpoints[-1]:
+            checkpoints.append(cell_of(*last_point))
+        nearby = [neighbourhood(cell) for cell in checkpoints]
+
+        # Candidates: activities seen near enough of the checkpoints
+        seen = {}
+        for cells in nearby:
+            numbers = set()
+            for cell in cells:
+                numbers.update(self.postings.get(cell, ()))
+            for number in numbers:
+                seen[number] = seen.get(number, 0) + 1
+        max_missed = int(len(checkpoints) * MAX_MISSED_CHECKPOINTS)
+        candidates = [number for number, count in seen.items() if count >= len(checkpoints) - max_missed]
+
+        length = end - start
+        matches = []
+        for number in candidates:
+            other = self.paths[number]
+            if other == path:
+                continue
+            candidate = self.entries[other]
+            for first, last in _passes(candidate['cells'], nearby, max_missed):
+                reached, entered = _crossing(candidate, first, first_point)
+                left, exited = _crossing(candidate, last, last_point)
+                covered = exited - entered
+                if left > reached and DISTANCE_RATIO[0] <= covered / length <= DISTANCE_RATIO[1]:
+                    matches.append({
+                        'path': other,
+                        'title': candidate['title'],
+                        'date': candidate['date'],
+                        'start': round(entered, 3),
+                        'elapsed': round(left - reached, 1),
+                    })
+        matches.sort(key=lambda match: match['elapsed'])
+        return {
+            'activity': path,
+            'from': round(start, 3),
+            'to': round(end, 3),
+            'distance': round(length, 3),
+            'elapsed': round(end_time - start_time, 1),
+            'matches': matches,
+        }
+
+
+def _at_distance(entry, target):
+    """The point and time at `target` km along an entry's visits, interpolated."""
+    distances, times, points = entry['distances'], entry['times'], entry['points']
+    k = 0
+    while k < len(distances) - 2 and distances[k + 1] <= target:
+        k += 1
+    if len(distances) == 1 or distances[k + 1] == distances[k]:
+        return (points[2 * k], points[2 * k + 1]), times[k]
+    fraction = min(max((target - distances[k]) / (distances[k + 1] - distances[k]), 0), 1)
+    latitude = points[2 * k] + fraction * (points[2 * k + 2] - points[2 * k])
+    longitude = points[2 * k + 1] + fraction * (points[2 * k + 3] - points[2 * k + 1])
+    return (latitude, longitude), times[k] + fraction * (times[k + 1] - times[k])
+
+
+def _passes(cells, nearby, max_missed):
+    """(first, last) visit ranges of the passes over the checkpoints, in order.
+
+    `first` is the run of visits near the first checkpoint that a pass starts
+    from, `last` the run near the last one where it ends.
+    """
+    found = []
+    n, m = len(cells), len(nearby)
+    i = 0
+    while i < n:
+        if cells[i] not in nearby[0]:
+            i += 1
+            continue
+        start_run = i
+        while i + 1 < n and cells[i + 1] in nearby[0]:
+            i += 1
+        j, missed, off_route, k = 1, 0, 0, i + 1
+        while k < n and j < m:
+            cell = cells[k]
+            # The next checkpoint reached, possibly skipping a few
+            for ahead in range(j, min(m, j + 1 + max_missed - missed)):
+                if cell in nearby[ahead]:
+                    missed += ahead - j
+                    j = ahead + 1
+                    while j < m and cell in nearby[j]:
+                        j += 1
+                    off_route = 0
+                    break
+            else:
+                off_route = 0 if cell in nearby[j - 1] else off_route + 1
+                if off_route > MAX_OFF_ROUTE_VISITS:
+                    break
+            k += 1
+        if j < m:
+            i += 1
+            continue
+        end_run = k - 1
+        while end_run > 0 and cells[end_run - 1] in nearby[-1] and end_run - 1 > i:
+            end_run -= 1
+        last = k - 1
+        while last + 1 < n and cells[last + 1] in nearby[-1]:
+            last += 1
+        found.append(((start_run, i), (end_run, last)))
+        i = last + 1
+    return found
+
+
+def _crossing(entry, visits, point):
+    """Time and distance where an entry's track passes closest to `point`
+    around a run of visits, interpolated along the nearest segment."""
+    points, times, distances = entry['points'], entry['times'], entry['distances']
+    latitude, longitude = point
+    scale = math.cos(math.radians(latitude))
+    best = None
+    first, last = visits
+    for k in range(max(first - 1, 0), min(last + 1, len(times) - 1)):
+        # Segment from visit k to k + 1, relative to `point` (longitude scaled to latitude degrees)
+        ax = (points[2 * k + 1] - longitude) * scale
+        ay = points[2 * k] - latitude
+        bx = (points[2 * k + 3] - longitude) * scale
+        by = points[2 * k + 2] - latitude
+        dx, dy = bx - ax, by - ay
+        span = dx * dx + dy * dy
+        fraction = min(max(-(ax * dx + ay * dy) / span, 0), 1) if span else 0
+        x, y = ax + fraction * dx, ay + fraction * dy
+        gap = x * x + y * y
+        if best is None or gap < best[0]:
+            best = (gap, times[k] + fraction * (times[k + 1] - times[k]),
+                    distances[k] + fraction * (distances[k + 1] - distances[k]))
+    if best is None:  # A single visit
+        return times[first], distances[first]
+    return best[1], best[2]
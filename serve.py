@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+"""
+Serve activity folders to the viewer, faster than python -m http.server.
+
+Adds what a static file server needs for the viewer to load quickly:
+
+- Compression: a precompressed file.br or file.gz next to a file is sent
+  when the browser accepts it and it is not older than the file; otherwise
+  text files (HTML, JS, GPX, YAML, JSON, ...) are gzipped on the fly, and the
+  result is kept in memory until the file changes.
+- Caching: every file gets a strong ETag (from its size and modification
+  time) and Last-Modified, and conditional requests get 304 Not Modified.
+  Activity files are sent with Cache-Control: no-cache (always revalidated,
+  which is what the viewer's activity cache relies on); media and map tiles
+  may be reused for a day.
+- Range requests (Accept-Ranges: bytes), for seeking in videos and resuming
+  large FIT/GPX downloads.
+- Directory listings as JSON: a GET of a folder with Accept: application/json
+  answers {"files": [...], "sizes": {...}} with every file below it, in the
+  format of manifest.json, so the viewer finds activity files and media
+  without probing for them. Browsers still get the HTML listing.
+- Segment lookups: GET /.segments?activity=<folder>&from=<km>&to=<km>
+  answers, from the .segment-index.json that build-segment-index.py wrote in
+  the root, which other activities covered that stretch of the activity
+  folder (as a URL path) and their times on it. 404 when there is no index.
+- One thread per connection, with keep-alive.
+
+Only serves files below the root folder. Meant for local use, not as a public
+web server.
+"""
+
+import argparse
+import email.utils
+import gzip
+import json
+import os
+import sys
+import threading
+from http import HTTPStatus
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+
+from segment_index import INDEX_NAME as SEGMENT_INDEX_NAME, SegmentIndex
+
+# Types the on-the-fly gzip applies to; everything else is sent as it is
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'application/gpx+xml',
+                      'application/xml', 'image/svg+xml')
+MIN_COMPRESS_SIZE = 1024
+GZIP_CACHE_BYTES = 64 * 1024 * 1024
+
+# Precompressed siblings, in order of preference
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+# Folders whose files do not change once written
+LONG_LIVED_DIRS = ('media', 'tiles')
+LONG_LIVED_MAX_AGE = 86400
+
+# Largest JSON directory listing; beyond it the listing says "truncated"
+LISTING_MAX_FILES = 5000
+
+# Segment lookups (a hidden name, so it never shadows an activity folder)
+SEGMENTS_PATH = '/.segments'
+
+
+class GzipCache:
+    """Gzipped file contents by (path, size, mtime), least recently used dropped first."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = {}
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, path, stat):
+        key = (path, stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            data = self.entries.pop(key, None)
+            if data is not None:
+                self.entries[key] = data  # Most recently used goes last
+                return data
+
+        with open(path, 'rb') as f:
+            data = gzip.compress(f.read(), compresslevel=6, mtime=0)
+        with self.lock:
+            # Older versions of the file are never asked for again
+            for old in [k for k in self.entries if k[0] == path]:
+                self.size -= len(self.entries.pop(old))
+            self.entries[key] = data
+            self.size += len(data)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                self.size -= len(self.entries.pop(next(iter(self.entries))))
+        return data
+
+
+class SegmentIndexCache:
+    """The root's segment index, loaded on first use and again whenever the file changes."""
+
+    def __init__(self, root):
+        self.path = Path(root) / SEGMENT_INDEX_NAME
+        self.key = None
+        self.index = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """The current SegmentIndex, or None when the root has no index."""
+        try:
+            stat = self.path.stat()
+        except OSError:
+            return None
+        key = (stat.st_size, stat.st_mtime_ns)
+        with self.lock:
+            if key != self.key:
+                self.index = SegmentIndex.load(self.path.parent)
+                self.key = key
+            return self.index
+
+
+def parse_range(header, size):
+    """(start, end) of a single bytes=... range, None to ignore it, or 'unsatisfiable'."""
+    unit, _, spec = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in spec:
+        return None  # Multiple ranges: send the whole file instead
+    first, _, last = spec.strip().partition('-')
+    try:
+        if not first:
+            length = int(last)
+            if length <= 0:
+                return 'unsatisfiable'
+            return max(0, size - length), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or end < start:
+        return 'unsatisfiable'
+    return start, min(end, size - 1)
+
+
+def list_files(folder):
+    """Paths of the files below `folder`, relative to it, hidden entries left out."""
+    files = []
+    for directory, dirnames, filenames in os.walk(folder):
+        dirnames[:] = sorted(name for name in dirnames if not name.startswith('.'))
+        relative = Path(directory).relative_to(folder)
+        for name in sorted(filenames):
+            if not name.startswith('.'):
+                files.append((relative / name).as_posix())
+                if len(files) > LISTING_MAX_FILES:
+                    return files
+    return files
+
+
+class ActivityRequestHandler(SimpleHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    gzip_cache = GzipCache(GZIP_CACHE_BYTES)
+    segment_index = None  # A SegmentIndexCache for the root, see create_server
+    extensions_map = {
+        **SimpleHTTPRequestHandler.extensions_map,
+        '.fit': 'application/vnd.ant.fit',
+        '.gpx': 'application/gpx+xml',
+        '.yaml': 'text/yaml',
+        '.yml': 'text/yaml',
+        '.org': 'text/plain',
+        '.bin': 'application/octet-stream',
+        '.js': 'text/javascript',
+        '.mjs': 'text/javascript',
+    }
+
+    def do_GET(self):
+        self.respond(send_body=True)
+
+    def do_HEAD(self):
+        self.respond(send_body=False)
+
+    def respond(self, send_body):
+        if urlsplit(self.path).path == SEGMENTS_PATH:
+            self.send_segments(send_body)
+            return
+        path = self.translate_path(self.path)
+        if os.path.isdir(path):
+            url_path = self.path.split('?', 1)[0].split('#', 1)[0]
+            if not url_path.endswith('/'):
+                self.send_response(HTTPStatus.MOVED_PERMANENTLY)
+                self.send_header('Location', url_path + '/' + self.path[len(url_path):])
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if 'application/json' in self.headers.get('Accept', ''):
+                self.send_listing(path, send_body)
+                return
+            index = os.path.join(path, 'index.html')
+            if not os.path.isfile(index):
+                # The HTML autoindex of http.server, for browsing
+                body = self.list_directory(path)
+                if body:
+                    with body:
+                        if send_body:
+                            self.copyfile(body, self.wfile)
+                return
+            path = index
+
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return
+        if not os.path.isfile(path):
+            self.send_error(HTTPStatus.NOT_FOUND, 'File not found')
+            return
+
+        content_type = self.guess_type(path)
+        etag = f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+        range_header = self.headers.get('Range')
+        if range_header and self.headers.get('If-Range') not in (None, etag):
+            range_header = None  # Changed since the client's copy: send all of it
+
+        # Pick the representation: a precompressed sibling, on-the-fly gzip, or the file
+        encoding, source, data = None, path, None
+        if not range_header:
+            accepted = {coding.split(';')[0].strip() for coding in self.headers.get('Accept-Encoding', '').split(',')}
+            for coding, suffix in PRECOMPRESSED:
+                try:
+                    compressed = os.stat(path + suffix)
+                except OSError:
+                    continue
+                if coding in accepted and compressed.st_mtime_ns >= stat.st_mtime_ns:
+                    encoding, source = coding, path + suffix
+                    break
+            if (not encoding and 'gzip' in accepted and stat.st_size >= MIN_COMPRESS_SIZE
+                    and content_type.startswith(COMPRESSIBLE_TYPES)):
+                encoding, data = 'gzip', self.gzip_cache.get(path, stat)
+        if encoding:
+            # Each representation has its own strong ETag
+            etag = f'{etag[:-1]}-{encoding}"'
+
+        if self.not_modified(etag, stat):
+            self.send_response(HTTPStatus.NOT_MODIFIED)
+            self.send_file_headers(path, stat, etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        size = len(data) if data is not None else os.stat(source).st_size
+        start, end = 0, size - 1
+        status = HTTPStatus.OK
+        if range_header:
+            requested = parse_range(range_header, size)
+            if requested == 'unsatisfiable':
+                self.send_response(HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+                self.send_header('Content-Range', f'bytes */{size}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            if requested:
+                start, end = requested
+                status = HTTPStatus.PARTIAL_CONTENT
+
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_file_headers(path, stat, etag)
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        if status == HTTPStatus.PARTIAL_CONTENT:
+            self.send_header('Content-Range', f'bytes {start}-{end}/{size}')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.end_headers()
+        if not send_body:
+            return
+
+        if data is not None:
+            self.wfile.write(data[start:end + 1])
+            return
+        with open(source, 'rb') as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = f.read(min(remaining, 256 * 1024))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def send_file_headers(self, path, stat, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', email.utils.formatdate(stat.st_mtime, usegmt=True))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Vary', 'Accept-Encoding')
+        relative = Path(path).relative_to(self.directory).parts
+        if any(part in LONG_LIVED_DIRS for part in relative[:-1]):
+            self.send_header('Cache-Control', f'public, max-age={LONG_LIVED_MAX_AGE}')
+        else:
+            self.send_header('Cache-Control', 'no-cache')
+
+    def not_modified(self, etag, stat):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+            return '*' in tags or etag in tags
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = email.utils.parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(stat.st_mtime) <= since
+        return False
+
+    def send_listing(self, folder, send_body):
+        files = list_files(folder)
+        truncated = len(files) > LISTING_MAX_FILES
+        files = files[:LISTING_MAX_FILES]
+        listing = {'files': files, 'sizes': {}}
+        for name in files:
+            try:
+                listing['sizes'][name] = os.stat(os.path.join(folder, name)).st_size
+            except OSError:
+                pass
+        if truncated:
+            listing['truncated'] = True
+        body = json.dumps(listing, separators=(',', ':')).encode()
+        encoding = None
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and len(body) >= MIN_COMPRESS_SIZE:
+            body, encoding = gzip.compress(body, mtime=0), 'gzip'
+
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept, Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_segments(self, send_body):
+        index = self.segment_index.get() if self.segment_index else None
+        if index is None:
+            self.send_error(HTTPStatus.NOT_FOUND, 'No segment index (run build-segment-index.py)')
+            return
+        query = parse_qs(urlsplit(self.path).query)
+        try:
+            activity = query['activity'][0].strip('/')
+            if activity.endswith('.html'):
+                activity = activity.rpartition('/')[0]
+            result = index.find(activity, float(query['from'][0]), float(query['to'][0]))
+        except (KeyError, ValueError) as error:
+            self.send_error(HTTPStatus.BAD_REQUEST, f'Bad segment lookup: {error}')
+            return
+        if result is None:
+            self.send_error(HTTPStatus.NOT_FOUND, 'Activity not in the segment index')
+            return
+
+        body = json.dumps(result, separators=(',', ':'), ensure_ascii=False).encode()
+        self.send_response(HTTPStatus.OK)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+
+def create_server(root, port=8000, bind='127.0.0.1', quiet=False):
+    """A threaded server for `root`; call serve_forever() on it."""
+    class Handler(ActivityRequestHandler):
+        segment_index = SegmentIndexCache(root)
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, directory=str(root), **kwargs)
+
+        if quiet:
+            def log_message(self, *args):
+                pass
+
+    server = ThreadingHTTPServer((bind, port), Handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('root', nargs='?', type=Path, default=Path('.'), help='folder to serve (default: .)')
+    parser.add_argument('-p', '--port', type=int, default=8000, help='port (default: 8000)')
+    parser.add_argument('-b', '--bind', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-q', '--quiet', action='store_true', help='do not log requests')
+    args = parser.parse_args()
+
+    server = create_server(args.root.resolve(), args.port, args.bind, args.quiet)
+    print(f"Serving {args.root.resolve()} at http://{args.bind}:{args.port}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
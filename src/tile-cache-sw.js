@@ -0,0 +1,71 @@
+// Map tile cache for the activity viewer.
+//
+// Copy this file next to a viewer (index.html) to turn it on: the viewer
+// registers it, and from then on every map tile the page loads is kept in a
+// cache of at most MAX_TILES tiles, least recently used going first. Tiles
+// already in the cache are shown without a network request, so revisited
+// areas appear at once, also offline.
+//
+// The limit can be changed with ?maxTiles= on the script URL, e.g. by
+// registering 'tile-cache-sw.js?maxTiles=20000'.
+
+const CACHE_NAME = 'tiles-v1';
+const MAX_TILES = Number(new URL(self.location).searchParams.get('maxTiles')) || 5000;
+const TRIM_EVERY = 50;
+
+// Any cross-origin {z}/{x}/{y} image; the page's own files (including a
+// local tiles/ directory written by prefetch-tiles.py) are left alone
+const TILE_PATH = /\/\d+\/\d+\/\d+(@2x)?\.(png|jpe?g|webp)$/;
+
+// Cache.keys() lists entries in insertion order, so putting a tile again
+// when it is used keeps that order least recently used first. Once per
+// tile per worker lifetime is enough for that, and keeps hits cheap.
+const touched = new Set();
+let putsSinceTrim = 0;
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', event => {
+    event.waitUntil(Promise.all([self.clients.claim(), trimCache()]));
+});
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') return;
+    const url = new URL(request.url);
+    if (url.origin === self.location.origin || !TILE_PATH.test(url.pathname)) return;
+    event.respondWith(cachedTile(event, request));
+});
+
+async function cachedTile(event, request) {
+    const cache = await caches.open(CACHE_NAME);
+    const cached = await cache.match(request);
+    if (cached) {
+        if (!touched.has(request.url)) {
+            touched.add(request.url);
+            event.waitUntil(cache.put(request, cached.clone()));
+        }
+        return cached;
+    }
+
+    const response = await fetch(request);
+    // Tiles fetched without CORS are opaque (status 0); their status is unknown, keep them anyway
+    if (response.ok || response.type === 'opaque') {
+        touched.add(request.url);
+        event.waitUntil(cache.put(request, response.clone()).then(() => {
+            if (++putsSinceTrim >= TRIM_EVERY) return trimCache();
+        }));
+    }
+    return response;
+}
+
+async function trimCache() {
+    putsSinceTrim = 0;
+    const cache = await caches.open(CACHE_NAME);
+    const keys = await cache.keys();
+    const excess = keys.slice(0, Math.max(0, keys.length - MAX_TILES));
+    await Promise.all(excess.map(key => {
+        touched.delete(key.url);
+        return cache.delete(key);
+    }));
+}
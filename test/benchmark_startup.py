@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Compare the bundled viewers' time to first render with an earlier build.
+
+Opens a metadata-only page and the full FIT activity in both bundled builds,
+from the working tree and from a git revision (--baseline, default HEAD), and
+reports the median time from navigation to the rendered activity and the JS
+heap in use afterwards. Each load runs in a fresh browser context, with the
+activity cache off (?cache=0), so every run parses from scratch.
+
+Run from the project root: python3 test/benchmark_startup.py --baseline HEAD~1
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+from playwright.sync_api import sync_playwright
+
+ROOT = Path(__file__).parent.parent
+sys.path.insert(0, str(Path(__file__).parent))
+from conftest import gen_background_server_ctxmanager  # noqa: E402
+
+BUILDS = ["dist/single-page-chartjs-bundled.html", "dist/single-page-d3-bundled.html"]
+CASES = ["metadata-only", "full-activity"]
+PORT = 8000
+
+# Records when the activity title is filled in, which renderActivity() does
+# before drawing the map and charts in the same task, and then waits a frame
+# so the time includes that render
+FIRST_RENDER = """
+document.addEventListener('DOMContentLoaded', () => {
+    const title = document.getElementById('activityTitle');
+    new MutationObserver((records, observer) => {
+        observer.disconnect();
+        requestAnimationFrame(() => setTimeout(() => { window.firstRender = performance.now(); }));
+    }).observe(title, { childList: true, characterData: true, subtree: true });
+});
+"""
+
+
+def measure(browser, html, case, runs):
+    """Median time to first render (ms) and heap (MB) of `runs` loads of one build and case."""
+    times, heaps = [], []
+    for _ in range(runs):
+        context = browser.new_context(viewport={"width": 1400, "height": 900})
+        page = context.new_page()
+        page.add_init_script(FIRST_RENDER)
+        # Served from the case's folder, so the page finds its activity files
+        page.route("**/__benchmark__.html", lambda route: route.fulfill(body=html, content_type="text/html"))
+        page.goto(f"http://localhost:{PORT}/test/test-cases/{case}/__benchmark__.html?cache=0")
+        page.wait_for_function("window.firstRender", timeout=30000)
+        times.append(page.evaluate("window.firstRender"))
+        heaps.append(page.evaluate("performance.memory ? performance.memory.usedJSHeapSize : 0") / 1e6)
+        context.close()
+    return statistics.median(times), statistics.median(heaps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--baseline", default="HEAD", help="git revision to compare with (default: HEAD)")
+    parser.add_argument("--runs", type=int, default=5, help="loads per build and case (default: 5)")
+    args = parser.parse_args()
+
+    builds = []
+    for build in BUILDS:
+        baseline = subprocess.run(["git", "show", f"{args.baseline}:{build}"], cwd=ROOT,
+                                  capture_output=True, text=True, check=True).stdout
+        builds.append((Path(build).stem, (ROOT / build).read_text(), baseline))
+
+    server = gen_background_server_ctxmanager(
+        cmd=[sys.executable, "serve.py", "--port", str(PORT)], cwd=str(ROOT), port=PORT, wait_seconds=2,
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    with server(), sync_playwright() as playwright:
+        browser = playwright.chromium.launch()
+        print(f"{'build':<32} {'case':<14} {args.baseline:>18} {'working tree':>18}")
+        for name, current, baseline in builds:
+            for case in CASES:
+                before = measure(browser, baseline, case, args.runs)
+                after = measure(browser, current, case, args.runs)
+                print(f"{name:<32} {case:<14} "
+                      f"{before[0]:7.0f} ms {before[1]:4.0f} MB {after[0]:7.0f} ms {after[1]:4.0f} MB")
+        browser.close()
+
+
+if __name__ == "__main__":
+    main()
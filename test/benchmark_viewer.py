@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Benchmark the four viewer builds on synthetic activities of several sizes.
+
+Not part of the test suite; run it explicitly from the project root:
+
+    pytest test/benchmark_viewer.py
+    BENCH_SIZES=1k,10k,100k,1M BENCH_RUNS=5 pytest test/benchmark_viewer.py
+
+Each build (Chart.js/D3, CDN/bundled) opens a generated FIT activity and a
+GPX-only one of each size (BENCH_SIZES, default 1k,10k,100k), written once to
+test/benchmark-data/ by generate_activity.py. The FIT activity is opened
+twice: with the viewer's own FIT decoder ("fit") and with the Garmin SDK
+("fit-sdk", ?fitsdk=1). Every load is a fresh browser
+context with the activity cache off, and the median of BENCH_RUNS loads
+(default 3) is kept of:
+
+- firstRenderMs: navigation to the end of rendering, charts included
+- parseMs: parseFitData, or the time spent parsing the GPX stream
+- heapPeakMB: the page's JS heap, sampled every 20 ms (the parsing worker's
+  own heap is not included)
+- hoverUpdateMs / hoverFrameMs: mean and worst hover update time and frame
+  interval while the pointer sweeps across the elevation chart
+
+Results are written to BENCH_OUTPUT (default benchmark-results.json). To
+compare two runs, failing on regressions of more than 10%:
+
+    python3 test/benchmark_viewer.py old.json new.json --threshold 0.1
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import pytest
+from playwright.sync_api import Browser
+
+from generate_activity import generate_folder, parse_points
+
+ROOT = Path(__file__).parent.parent
+DATA = ROOT / "test" / "benchmark-data"
+BUILDS = {
+    "chartjs": "src/single-page-chartjs.html",
+    "d3": "src/single-page-d3.html",
+    "chartjs-bundled": "dist/single-page-chartjs-bundled.html",
+    "d3-bundled": "dist/single-page-d3-bundled.html",
+}
+# Format -> (activity file, extra query)
+FORMATS = {"fit": ("fit", ""), "fit-sdk": ("fit", "&fitsdk=1"), "gpx": ("gpx", "")}
+SIZES = [parse_points(size) for size in os.environ.get("BENCH_SIZES", "1k,10k,100k").split(",")]
+RUNS = int(os.environ.get("BENCH_RUNS", "3"))
+OUTPUT = Path(os.environ.get("BENCH_OUTPUT", "benchmark-results.json"))
+HOVER_STEPS = 60
+METRICS = ["firstRenderMs", "parseMs", "heapPeakMB", "hoverUpdateMs", "hoverUpdateWorstMs",
+           "hoverFrameMs", "hoverFrameWorstMs"]
+
+# Samples the JS heap from the start, and records frame intervals on demand
+INIT_SCRIPT = """
+window.heapPeak = 0;
+setInterval(() => {
+    if (performance.memory) window.heapPeak = Math.max(window.heapPeak, performance.memory.usedJSHeapSize);
+}, 20);
+window.recordFrames = () => {
+    const frames = [];
+    let last = 0;
+    let running = true;
+    const tick = now => {
+        if (last) frames.push(now - last);
+        last = now;
+        if (running) requestAnimationFrame(tick);
+    };
+    requestAnimationFrame(tick);
+    return () => { running = false; return frames; };
+};
+"""
+
+# Rendered once the load phase and the charts (deferred in the D3 version) are timed
+RENDERED = """() => {
+    const phases = window.perfStats && window.perfStats.phases;
+    return phases && phases.autoLoadActivity && (phases.renderCharts || phases.renderChartsD3);
+}"""
+
+LOAD_METRICS = """() => {
+    const phases = window.perfStats.phases;
+    const end = phase => phase ? phase.start + phase.duration : 0;
+    const parse = phases.parseFitData ? phases.parseFitData.duration : phases.parseGpx ? phases.parseGpx.busy : null;
+    if (performance.memory) window.heapPeak = Math.max(window.heapPeak, performance.memory.usedJSHeapSize);
+    return {
+        firstRenderMs: Math.max(end(phases.autoLoadActivity), end(phases.renderCharts), end(phases.renderChartsD3)),
+        parseMs: parse,
+        heapPeakMB: window.heapPeak / 1e6,
+        records: window.perfStats.counts.records
+    };
+}"""
+
+
+@pytest.fixture(scope="session")
+def browser_type_launch_args(browser_type_launch_args):
+    """Unrounded performance.memory readings."""
+    args = [*browser_type_launch_args.get("args", []), "--enable-precise-memory-info"]
+    return {**browser_type_launch_args, "args": args}
+
+
+@pytest.fixture(scope="session")
+def benchmark_results(browser: Browser):
+    """Collects one result per case; written to OUTPUT at the end of the session."""
+    results = []
+    yield results
+    commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    OUTPUT.write_text(json.dumps({
+        "version": 1,
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit": commit.stdout.strip() or None,
+        "browser": f"{browser.browser_type.name} {browser.version}",
+        "runs": RUNS,
+        "results": results,
+    }, indent=2) + "\n")
+    print(f"\nBenchmark results written to {OUTPUT}")
+
+
+def activity_folder(fmt, points):
+    """The generated folder for a format and size, with a page for each build."""
+    folder = DATA / f"{fmt}-{points}"
+    if not (folder / f"activity.{fmt}").exists():
+        generate_folder(folder, points, formats=(fmt,))
+    for build, source in BUILDS.items():
+        page = folder / f"{build}.html"
+        if not page.is_symlink():
+            page.symlink_to(os.path.relpath(ROOT / source, folder))
+    return folder
+
+
+def measure_load(browser, url, timeout):
+    """Load metrics and hover timings of one fresh load of `url`."""
+    context = browser.new_context(viewport={"width": 1400, "height": 900})
+    try:
+        page = context.new_page()
+        page.add_init_script(INIT_SCRIPT)
+        page.goto(url)
+        page.wait_for_function(RENDERED, timeout=timeout)
+        result = page.evaluate(LOAD_METRICS)
+
+        # Sweep the pointer across the elevation chart
+        box = page.locator("#elevationChart").bounding_box()
+        page.evaluate("window.stopFrames = window.recordFrames()")
+        for step in range(HOVER_STEPS + 1):
+            page.mouse.move(box["x"] + box["width"] * step / HOVER_STEPS, box["y"] + box["height"] / 2)
+        page.evaluate("new Promise(resolve => requestAnimationFrame(() => requestAnimationFrame(resolve)))")
+        frames = page.evaluate("window.stopFrames()") or [0]
+        hover = page.evaluate("window.hoverStats")
+        result.update({
+            "hoverUpdateMs": hover["totalMs"] / hover["updates"] if hover["updates"] else None,
+            "hoverUpdateWorstMs": hover["worstMs"],
+            "hoverFrameMs": statistics.mean(frames),
+            "hoverFrameWorstMs": max(frames),
+        })
+        return result
+    finally:
+        context.close()
+
+
+@pytest.mark.parametrize("points", SIZES)
+@pytest.mark.parametrize("fmt", FORMATS)
+@pytest.mark.parametrize("build", BUILDS)
+def test_benchmark(browser: Browser, base_url: str, benchmark_results, build: str, fmt: str, points: int):
+    """Median load, parse, heap and hover figures for one build, format and size."""
+    source, query = FORMATS[fmt]
+    folder = activity_folder(source, points)
+    url = f"{base_url}/{folder.relative_to(ROOT).as_posix()}/{build}.html?cache=0{query}"
+    timeout = 30000 + points // 5  # 1M points: over 3 minutes
+    runs = [measure_load(browser, url, timeout) for _ in range(RUNS)]
+
+    result = {"build": build, "format": fmt, "points": points, "records": runs[0]["records"]}
+    for metric in METRICS:
+        values = [run[metric] for run in runs if run[metric] is not None]
+        result[metric] = round(statistics.median(values), 2) if values else None
+    benchmark_results.append(result)
+    print(f"\n{build:<16} {fmt:<7} {points:>8}: " + ", ".join(f"{metric} {result[metric]}" for metric in METRICS))
+    assert result["records"] > 0
+
+
+def compare(old, new, threshold):
+    """Print each metric of `new` against `old`; returns the regressions beyond `threshold`."""
+    previous = {(row["build"], row["format"], row["points"]): row for row in old["results"]}
+    regressions = []
+    print(f"{'case':<32} {'metric':<20} {old.get('commit') or 'old':>10} {new.get('commit') or 'new':>10}")
+    for row in new["results"]:
+        case = (row["build"], row["format"], row["points"])
+        before = previous.get(case)
+        if not before:
+            continue
+        for metric in METRICS:
+            if before.get(metric) is None or row.get(metric) is None:
+                continue
+            change = (row[metric] - before[metric]) / before[metric] if before[metric] else 0
+            flag = ""
+            if change > threshold:
+                flag = "  <- regression"
+                regressions.append((case, metric, change))
+            name = f"{case[0]} {case[1]} {case[2]}"
+            print(f"{name:<32} {metric:<20} {before[metric]:>10.1f} {row[metric]:>10.1f} {change:+7.1%}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark_viewer.py result files.")
+    parser.add_argument("old", type=Path, help="earlier results")
+    parser.add_argument("new", type=Path, help="results to check")
+    parser.add_argument("--threshold", type=float, default=0.1,
+                        help="relative increase that counts as a regression (default: 0.1)")
+    args = parser.parse_args()
+
+    regressions = compare(json.loads(args.old.read_text()), json.loads(args.new.read_text()), args.threshold)
+    if regressions:
+        print(f"\n❌ {len(regressions)} regressions over {args.threshold:.0%}")
+        return 1
+    print("\n✅ No regressions")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -91,7 +91,7 @@ def background_server():
     # Run server from project root, not test directory
     cwd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     server_ctx = gen_background_server_ctxmanager(
-        cmd=["python", "-m", "http.server", "8000"],
+        cmd=["python", "serve.py", "--port", "8000"],
         cwd=cwd,
         port=8000,
         healthendpoint="/",
@@ -105,3 +105,44 @@ def background_server():
 def base_url(background_server):
     """Provide base URL for tests."""
     return background_server
+
+
+# A 1x1 PNG, served for every tile
+TILE_PNG = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010802000000907753de"
+    "0000000c49444154789c63b87bf72e0005320298c30dfa8f0000000049454e44ae426082"
+)
+
+
+@pytest.fixture(scope="session")
+def tile_server():
+    """Stand-in tile server: serves a small PNG for any /{z}/{x}/{y}.png and records the paths asked for."""
+    import re
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    requested = []
+
+    class TileHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            requested.append(self.path)
+            if not re.fullmatch(r"/\d+/\d+/\d+\.png", self.path):
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "image/png")
+            self.send_header("Content-Length", str(len(TILE_PNG)))
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            self.wfile.write(TILE_PNG)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("localhost", 8001), TileHandler)
+    server.requested = requested
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Write synthetic activity folders of any size, for benchmarks.
+
+Generates a run recorded once per second, from 1k to millions of points:
+a meandering route with rolling hills (plus barometric noise on the
+elevation), speed that varies with effort and gradient, heart rate that lags
+behind the effort, cadence, power and a slowly drifting temperature. Like a
+real recording it has pauses (the timer is stopped: a time gap, FIT timer
+events and a new GPX track segment) and GPS dropouts (FIT records without a
+position, GPX points missing). The same seed always gives the same files.
+
+Writes activity.fit, activity.gpx and metadata.yaml into the folder:
+
+    python3 test/generate_activity.py /tmp/run-100k --points 100000
+"""
+
+import argparse
+import math
+import random
+import struct
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from activity_io import FIT_EPOCH_OFFSET  # noqa: E402
+
+START = datetime(2025, 11, 2, 17, 0, 0, tzinfo=timezone.utc)
+START_LAT, START_LON = 42.4208, -72.4267
+METERS_PER_DEGREE = 111320.0
+
+# One pause every ~25 minutes of 20 s to 3 min; one dropout every ~40 minutes of 5-40 s
+PAUSE_CHANCE = 1 / 1500
+DROPOUT_CHANCE = 1 / 2400
+
+FIT_INVALID_SINT32 = 0x7FFFFFFF
+DEGREES_TO_SEMICIRCLES = 2 ** 31 / 180
+
+# Local message types and their definitions: (global number, [(field, size, base type)])
+FIT_FILE_ID, FIT_EVENT, FIT_RECORD = 0, 1, 2
+FIT_DEFINITIONS = {
+    FIT_FILE_ID: (0, [(0, 1, 0x00), (1, 2, 0x84), (2, 2, 0x84), (3, 4, 0x8C), (4, 4, 0x86)]),
+    FIT_EVENT: (21, [(253, 4, 0x86), (0, 1, 0x00), (1, 1, 0x00)]),
+    FIT_RECORD: (20, [
+        (253, 4, 0x86),  # timestamp
+        (0, 4, 0x85),    # position_lat (semicircles)
+        (1, 4, 0x85),    # position_long
+        (2, 2, 0x84),    # altitude ((m + 500) * 5)
+        (3, 1, 0x02),    # heart_rate
+        (4, 1, 0x02),    # cadence (rpm)
+        (5, 4, 0x86),    # distance (cm)
+        (6, 2, 0x84),    # speed (mm/s)
+        (7, 2, 0x84),    # power
+        (13, 1, 0x01),   # temperature
+    ]),
+}
+FIT_RECORD_STRUCT = struct.Struct('<BIiiHBBIHHb')
+FIT_EVENT_STRUCT = struct.Struct('<BIBB')
+FIT_TIMER_START, FIT_TIMER_STOP_ALL = 0, 4
+
+
+def _fit_crc_table():
+    nibbles = [0x0000, 0xCC01, 0xD801, 0x1400, 0xF001, 0x3C00, 0x2800, 0xE401,
+               0xA001, 0x6C00, 0x7800, 0xB401, 0x5000, 0x9C01, 0x8801, 0x4400]
+    table = []
+    for byte in range(256):
+        crc = 0
+        for nibble in (byte & 0x0F, byte >> 4):
+            tmp = nibbles[crc & 0x0F]
+            crc = ((crc >> 4) & 0x0FFF) ^ tmp ^ nibbles[nibble]
+        table.append(crc)
+    return table
+
+
+FIT_CRC_TABLE = _fit_crc_table()
+
+
+def fit_crc(data, crc=0):
+    """The FIT file CRC (CRC-16/ARC) of `data`, continuing from `crc`."""
+    table = FIT_CRC_TABLE
+    for byte in data:
+        crc = (crc >> 8) ^ table[(crc ^ byte) & 0xFF]
+    return crc
+
+
+def generate_samples(points, seed=1):
+    """Yield `points` one-second samples as dicts, in order.
+
+    Each has `time` (datetime), `latitude`/`longitude` (None during a GPS
+    dropout), `elevation` (m), `distance` (m), `speed` (m/s), `heartRate`,
+    `cadence`, `power`, `temperature`, and `resumed` (True for the first
+    sample after a pause).
+    """
+    rng = random.Random(seed)
+    t = START
+    latitude, longitude = START_LAT, START_LON
+    heading = rng.uniform(0, 2 * math.pi)
+    distance = 0.0
+    heart_rate = 95.0
+    temperature = 14.0
+    noise = 0.0
+    dropout_left = 0
+    resumed = False
+
+    for _ in range(points):
+        # Effort rises and falls over a few minutes, like intervals on a steady run
+        effort = 0.75 + 0.15 * math.sin(distance / 900) + 0.08 * math.sin(distance / 170) + rng.gauss(0, 0.02)
+        gradient = (_terrain(distance + 5) - _terrain(distance - 5)) / 10
+        speed = max(0.8, 3.1 * effort - 6 * gradient + rng.gauss(0, 0.08))
+
+        heart_rate += (70 + 110 * effort + 150 * max(gradient, 0) - heart_rate) * 0.03 + rng.gauss(0, 0.6)
+        heart_rate = min(max(heart_rate, 55), 200)
+        temperature += rng.gauss(0, 0.002)
+
+        # Meander, steering back towards the start beyond ~5 km so long runs stay in the area
+        heading += rng.gauss(0, 0.04)
+        north = (latitude - START_LAT) * METERS_PER_DEGREE
+        east = (longitude - START_LON) * METERS_PER_DEGREE * math.cos(math.radians(START_LAT))
+        if math.hypot(north, east) > 5000:
+            home = math.atan2(-east, -north)
+            heading += 0.02 * math.sin(home - heading)
+        latitude += speed * math.cos(heading) / METERS_PER_DEGREE
+        longitude += speed * math.sin(heading) / (METERS_PER_DEGREE * math.cos(math.radians(latitude)))
+        distance += speed
+        # Barometric noise drifts rather than jumping from one sample to the next
+        noise = 0.95 * noise + rng.gauss(0, 0.05)
+        elevation = _terrain(distance) + noise
+
+        if dropout_left == 0 and rng.random() < DROPOUT_CHANCE:
+            dropout_left = rng.randint(5, 40)
+        lost = dropout_left > 0
+        dropout_left = max(0, dropout_left - 1)
+
+        yield {
+            'time': t,
+            'latitude': None if lost else latitude,
+            'longitude': None if lost else longitude,
+            'elevation': elevation,
+            'distance': distance,
+            'speed': speed,
+            'heartRate': round(heart_rate),
+            'cadence': round(86 + 4 * (effort - 0.75) + rng.gauss(0, 1)),
+            'power': round(max(0, 78 * speed + 900 * gradient + rng.gauss(0, 8))),
+            'temperature': round(temperature),
+            'resumed': resumed,
+        }
+
+        resumed = rng.random() < PAUSE_CHANCE
+        t += timedelta(seconds=1 + (rng.randint(20, 180) if resumed else 0))
+
+
+def _terrain(distance):
+    """Rolling hills: elevation (m) at `distance` (m) along the route."""
+    return 300 + 25 * math.sin(distance / 700) + 8 * math.sin(distance / 230 + 1.3)
+
+
+def _fit_time(t):
+    return int(t.timestamp()) - FIT_EPOCH_OFFSET
+
+
+def write_fit(path, samples):
+    """Write the samples as a FIT activity file; returns the number of records."""
+    data = bytearray()
+    for local, (global_number, fields) in FIT_DEFINITIONS.items():
+        data += struct.pack('<BBBHB', 0x40 | local, 0, 0, global_number, len(fields))
+        for field in fields:
+            data += bytes(field)
+
+    # file_id: an activity from a development device
+    data += struct.pack('<BBHHII', FIT_FILE_ID, 4, 255, 0, 1, _fit_time(START))
+    data += FIT_EVENT_STRUCT.pack(FIT_EVENT, _fit_time(START), 0, FIT_TIMER_START)
+
+    count = 0
+    last = None
+    for sample in samples:
+        timestamp = _fit_time(sample['time'])
+        if sample['resumed']:
+            data += FIT_EVENT_STRUCT.pack(FIT_EVENT, _fit_time(last['time']), 0, FIT_TIMER_STOP_ALL)
+            data += FIT_EVENT_STRUCT.pack(FIT_EVENT, timestamp, 0, FIT_TIMER_START)
+        if sample['latitude'] is None:
+            latitude = longitude = FIT_INVALID_SINT32
+        else:
+            latitude = round(sample['latitude'] * DEGREES_TO_SEMICIRCLES)
+            longitude = round(sample['longitude'] * DEGREES_TO_SEMICIRCLES)
+        data += FIT_RECORD_STRUCT.pack(
+            FIT_RECORD, timestamp, latitude, longitude,
+            round((sample['elevation'] + 500) * 5), sample['heartRate'], sample['cadence'],
+            round(sample['distance'] * 100), round(sample['speed'] * 1000), sample['power'],
+            sample['temperature'],
+        )
+        count += 1
+        last = sample
+
+    if last:
+        data += FIT_EVENT_STRUCT.pack(FIT_EVENT, _fit_time(last['time']), 0, FIT_TIMER_STOP_ALL)
+
+    header = struct.pack('<BBHI4s', 14, 0x20, 2132, len(data), b'.FIT')
+    header += struct.pack('<H', fit_crc(header))
+    crc = fit_crc(data, fit_crc(header))
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(data)
+        f.write(struct.pack('<H', crc))
+    return count
+
+
+GPX_HEADER = """<?xml version="1.0" encoding="UTF-8"?>
+<gpx creator="generate_activity.py" version="1.1"
+  xsi:schemaLocation="http://www.topografix.com/GPX/1/1 http://www.topografix.com/GPX/11.xsd"
+  xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1"
+  xmlns="http://www.topografix.com/GPX/1/1"
+  xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance">
+  <metadata>
+    <time>{time}</time>
+  </metadata>
+  <trk>
+    <name>{name}</name>
+    <type>running</type>
+    <trkseg>
+"""
+
+GPX_POINT = """      <trkpt lat="{latitude:.8f}" lon="{longitude:.8f}">
+        <ele>{elevation:.1f}</ele>
+        <time>{time}</time>
+        <extensions>
+          <power>{power}</power>
+          <ns3:TrackPointExtension>
+            <ns3:atemp>{temperature}</ns3:atemp>
+            <ns3:hr>{heartRate}</ns3:hr>
+            <ns3:cad>{cadence}</ns3:cad>
+          </ns3:TrackPointExtension>
+        </extensions>
+      </trkpt>
+"""
+
+
+def _gpx_time(t):
+    return t.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+def write_gpx(path, samples, name='Synthetic Run'):
+    """Write the samples as a GPX track (Garmin Connect style); returns the number of points."""
+    count = 0
+    with open(path, 'w') as f:
+        f.write(GPX_HEADER.format(time=_gpx_time(START), name=name))
+        chunk = []
+        for sample in samples:
+            if sample['resumed']:
+                chunk.append('    </trkseg>\n    <trkseg>\n')
+            if sample['latitude'] is None:
+                continue
+            chunk.append(GPX_POINT.format(**{**sample, 'time': _gpx_time(sample['time'])}))
+            count += 1
+            if len(chunk) >= 10000:
+                f.write(''.join(chunk))
+                chunk = []
+        f.write(''.join(chunk))
+        f.write('    </trkseg>\n  </trk>\n</gpx>\n')
+    return count
+
+
+def generate_folder(folder, points, seed=1, formats=('fit', 'gpx')):
+    """Write activity.fit and/or activity.gpx and metadata.yaml for `points` samples."""
+    folder = Path(folder)
+    folder.mkdir(parents=True, exist_ok=True)
+    name = f'Synthetic Run ({points:,} points)'
+    written = {}
+    if 'fit' in formats:
+        written['activity.fit'] = write_fit(folder / 'activity.fit', generate_samples(points, seed))
+    if 'gpx' in formats:
+        written['activity.gpx'] = write_gpx(folder / 'activity.gpx', generate_samples(points, seed), name)
+    (folder / 'metadata.yaml').write_text(
+        f'title: "{name}"\n'
+        f'date: {START.date().isoformat()}\n'
+        'type: "running"\n'
+        f'description: "Generated by generate_activity.py (seed {seed})."\n'
+    )
+    return written
+
+
+def parse_points(text):
+    """Parse a point count like 5000, 10k or 1M."""
+    multipliers = {'k': 1000, 'm': 1000000}
+    text = text.strip().lower()
+    if text and text[-1] in multipliers:
+        return int(float(text[:-1]) * multipliers[text[-1]])
+    return int(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('folder', type=Path, help='activity folder to write')
+    parser.add_argument('--points', type=parse_points, default=10000,
+                        help='samples to generate, e.g. 5000, 100k or 1M (default: 10k)')
+    parser.add_argument('--seed', type=int, default=1, help='random seed (default: 1)')
+    parser.add_argument('--format', nargs='+', choices=['fit', 'gpx'], default=['fit', 'gpx'],
+                        help='files to write (default: fit gpx)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    written = generate_folder(args.folder, args.points, args.seed, args.format)
+    for name, count in written.items():
+        size = (args.folder / name).stat().st_size
+        print(f"  {args.folder / name}: {count} points, {size / 1024:.0f} KB")
+    print(f"✅ Generated {args.points} samples in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1 @@
+../../../src/tile-cache-sw.js
\ No newline at end of file
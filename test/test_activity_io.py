@@ -0,0 +1,165 @@
+"""
+Tests for activity_io and preprocess-activities.py.
+"""
+import shutil
+import struct
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import activity_io
+from generate_activity import generate_folder
+
+ROOT = Path(__file__).parent.parent
+FULL_ACTIVITY = ROOT / "test" / "test-cases" / "full-activity"
+
+GPX_EDGE_CASES = """<?xml version="1.0"?>
+<gpx xmlns:ns3="http://www.garmin.com/xmlschemas/TrackPointExtension/v1">
+  <!-- <trkpt lat="1" lon="1"></trkpt> -->
+  <trk><trkseg>
+    <trkpt lat="42.1" lon="-72.1"><ele>100.5</ele><time>2025-11-02T17:00:18.250Z</time>
+      <extensions><ns3:TrackPointExtension><ns3:hr>120</ns3:hr></ns3:TrackPointExtension></extensions>
+    </trkpt>
+    <trkpt lat='42.2' lon='-72.2'/>
+    <trkpt lat="42.3" lon="-72.3"><ele><![CDATA[101]]></ele><ele>999</ele><hr>130</hr></trkpt>
+  </trkseg></trk>
+</gpx>
+"""
+
+
+class TestActivityIo:
+    """Test that Python parsing matches what the viewer computes."""
+
+    def test_fit_summary_matches_viewer(self):
+        """Test that the FIT fixture decodes to the records and summary the viewer shows."""
+        store, point_count = activity_io.decode_fit((FULL_ACTIVITY / "activity.fit").read_bytes())
+        assert len(store) == point_count == 2024
+        summary = activity_io.calculate_metrics(store)
+        assert summary["distance"] == pytest.approx(6.241107746832442)
+        assert summary["avgSpeed"] == pytest.approx(3.0701032971204976)
+        assert summary["duration"] == 2023
+        assert summary["maxHeartRate"] == 172
+        assert [effort["distance"] for effort in summary["bestEfforts"]["distance"]] == [0.4, 1, 5]
+        assert [effort["duration"] for effort in summary["bestEfforts"]["power"]] == [5, 60, 1200]
+
+    def test_fit_laps(self):
+        """Test that FIT lap messages decode like the viewer's fitLap."""
+        laps = []
+        activity_io.decode_fit((FULL_ACTIVITY / "activity.fit").read_bytes(), laps)
+        assert len(laps) == 4
+        assert laps[0] == {
+            "startTime": 1762102818000, "elapsed": 527.705, "timer": 527.705, "distance": 1.60934,
+            "avgSpeed": pytest.approx(10.9789, abs=1e-4), "avgHeartRate": 135, "maxHeartRate": 146,
+            "avgPower": 539, "ascent": 137,
+        }
+        assert sum(lap["distance"] for lap in laps) == pytest.approx(6.22732)
+
+    def test_best_efforts_match_brute_force(self, tmp_path: Path):
+        """Test that the two-pointer best efforts match trying every window."""
+        generate_folder(tmp_path, 900, seed=5, formats=("fit",))
+        store, _ = activity_io.decode_fit((tmp_path / "activity.fit").read_bytes())
+        efforts = activity_io.calculate_metrics(store)["bestEfforts"]
+        timestamp, distance, flags = store["timestamp"], store["distance"], store["flags"]
+        n = len(store)
+
+        assert [effort["distance"] for effort in efforts["distance"]] == [0.4, 1]
+        for effort in efforts["distance"]:
+            target = effort["distance"]
+            # Every stretch that covers the distance, timed from the interpolated start
+            fastest = min(
+                (timestamp[end] - timestamp[start] - (distance[end] - target - distance[start])
+                 / (distance[start + 1] - distance[start]) * (timestamp[start + 1] - timestamp[start])) / 1000
+                for end in range(n) for start in range(end)
+                if distance[end] - distance[start] >= target > distance[end] - distance[start + 1])
+            assert effort["seconds"] == pytest.approx(fastest)
+
+        for channel in ("power", "heartRate"):
+            assert [effort["duration"] for effort in efforts[channel]] == [5, 60]
+            for effort in efforts[channel]:
+                span = effort["duration"] * 1000
+                best = 0
+                for end in range(n):
+                    starts = [start for start in range(end) if timestamp[end] - timestamp[start] >= span]
+                    if not starts:
+                        continue
+                    start = starts[-1]
+                    total = sum(store[channel][i] * min(timestamp[i] - timestamp[i - 1], 10000)
+                                for i in range(start + 1, end + 1) if flags[i] & activity_io.CHANNEL_FLAGS[channel])
+                    best = max(best, total / (timestamp[end] - timestamp[start]))
+                assert effort["value"] == pytest.approx(best)
+
+    @pytest.mark.parametrize("global_number, field", [(132, (3, 1, 0x02)), (20, (8, 3, 0x0D))])
+    def test_fit_declined_like_viewer(self, tmp_path: Path, global_number, field):
+        """Test that FIT files the viewer leaves to the SDK are refused, not half-decoded."""
+        definition = struct.pack("<BBBHB3B", 0x40, 0, 0, global_number, 1, *field)
+        fit = struct.pack("<BBHI4sH", 14, 0x20, 2132, len(definition), b".FIT", 0) + definition + b"\0\0"
+        with pytest.raises(activity_io.UnsupportedFitError):
+            activity_io.decode_fit(fit)
+
+        # No GPX fallback: the viewer would show the FIT file's records
+        (tmp_path / "activity.fit").write_bytes(fit)
+        shutil.copy(FULL_ACTIVITY / "activity.gpx", tmp_path)
+        with pytest.raises(activity_io.UnsupportedFitError):
+            activity_io.load_activity(tmp_path)
+
+    def test_gpx_fast_path_matches_tokenizer(self):
+        """Test that the per-point GPX fast path agrees with the full tokenizer."""
+        text = (FULL_ACTIVITY / "activity.gpx").read_text()
+        fast, _ = activity_io.parse_gpx(text)
+        tokens, _ = activity_io._parse_gpx_tokens(text)
+        assert len(fast) == 2024
+        for name in activity_io.RECORD_COLUMNS:
+            assert fast[name] == tokens[name], name
+
+    def test_gpx_edge_cases(self):
+        """Test comments, CDATA, self-closing points and first-occurrence fields."""
+        store, _ = activity_io.parse_gpx(GPX_EDGE_CASES)
+        assert len(store) == 3
+        assert store.get("elevation", 0) == 100.5
+        assert store.get("timestamp", 0) == 1762102818250
+        assert store.get("heartRate", 0) == 120
+        assert store.get("elevation", 1) is None
+        assert store.get("elevation", 2) == 101
+        assert store.get("heartRate", 2) == 130
+
+    def test_sidecar_round_trip(self, tmp_path: Path):
+        """Test that the sidecar stores every column at an aligned offset."""
+        activity = activity_io.load_activity(FULL_ACTIVITY)
+        path = tmp_path / activity_io.SIDECAR_NAME
+        activity_io.write_sidecar(path, activity, activity_io.source_stats(FULL_ACTIVITY))
+
+        header, store = activity_io.read_sidecar(path)
+        assert header["source"] == "activity.fit"
+        assert header["summary"] == activity["summary"]
+        assert header["laps"] == activity["laps"] and len(header["laps"]) == 4
+        for name in activity_io.RECORD_COLUMNS:
+            assert header["columns"][name]["offset"] % 8 == 0
+            assert store[name] == activity["store"][name], name
+        assert all(level["bucketSize"] > 1 for level in header["lod"]["elevation"])
+
+
+class TestPreprocessCommand:
+    """Test the preprocess-activities.py command."""
+
+    def run(self, *args):
+        return subprocess.run(
+            [sys.executable, str(ROOT / "preprocess-activities.py"), *map(str, args)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+
+    def test_skips_unchanged_folders(self, tmp_path: Path):
+        """Test that a rerun only processes folders whose activity files changed."""
+        for name in ("first", "second"):
+            shutil.copytree(FULL_ACTIVITY, tmp_path / name, symlinks=True)
+
+        assert "0 up to date" in self.run(tmp_path, "--jobs", "2")
+        assert (tmp_path / "first" / activity_io.SIDECAR_NAME).exists()
+        assert "2 up to date" in self.run(tmp_path)
+
+        with open(tmp_path / "second" / "activity.gpx", "a") as f:
+            f.write("\n")
+        output = self.run(tmp_path)
+        assert "1 up to date" in output
+        assert "second" in output and "first:" not in output
@@ -5,6 +5,9 @@ Run with: pytest test_activity_viewer.py -v
 
 Note: The background HTTP server is automatically started by the conftest.py fixture.
 """
+import re
+from pathlib import Path
+
 import pytest
 from playwright.sync_api import Page, expect
 import time
@@ -54,6 +57,74 @@ class TestFullActivity:
         stat_cards = page.locator(".stat-card")
         expect(stat_cards).to_have_count(6)  # Distance, Duration, Pace, Elevation, HR avg, HR max
 
+    def test_best_efforts(self, page: Page, base_url: str):
+        """Test that best efforts are listed by distance and by duration, and follow the units."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        card = page.locator("#bestEffortsCard")
+        expect(card).to_be_visible(timeout=10000)
+
+        # 6.24 km: 400 m, 1 km and 5 km; 34 minutes: 5 s, 1 min and 20 min
+        expect(card.locator("tr")).to_have_count(2 + 3 + 3)
+        five_km = card.locator("tr", has_text="5 km")
+        expect(five_km).to_contain_text("/km")
+        expect(card.locator("tr", has_text="20 min")).to_contain_text(re.compile(r"\d+ W\s+\d+ bpm"))
+        assert page.evaluate("window.activityData.summary.bestEfforts.distance[2].seconds") > 1000
+
+        page.locator(".toggle-switch .slider").click()
+        expect(five_km).to_contain_text("/mi")
+
+    def test_splits_laps_and_zones(self, page: Page, base_url: str):
+        """Test the split, lap and heart rate zone breakdowns, and splits following the units."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        splits = page.locator("#splitsCard")
+        expect(splits).to_be_visible(timeout=10000)
+
+        # 6.24 km: six whole kilometres and 0.24 km; the FIT file has four mile laps
+        expect(splits.locator("tr")).to_have_count(1 + 7)
+        expect(splits.locator("tr").last).to_contain_text("0.24")
+        expect(page.locator("#lapsCard tr")).to_have_count(1 + 4)
+        expect(page.locator("#lapsCard tr").nth(1)).to_contain_text("1.61")
+        # Default heart rate zones: five, from the activity's maximum
+        expect(page.locator("#zonesCard .zone-bar")).to_have_count(5)
+
+        page.locator(".toggle-switch .slider").click()
+        expect(splits.locator("tr")).to_have_count(1 + 4)
+        expect(splits.locator("tr").last).to_contain_text("0.88")
+        expect(page.locator("#lapsCard tr").nth(1)).to_contain_text("1.00")
+
+    def test_configured_zones(self, page: Page, base_url: str):
+        """Test that zone boundaries from metadata.yaml are used for heart rate, pace and power."""
+        metadata = (Path(__file__).parent / "test-cases/full-activity/metadata.yaml").read_text()
+        page.route("**/full-activity/metadata.yaml", lambda route: route.fulfill(
+            body=metadata + '\nzones:\n  heart_rate: [130, 140, 150, 160]\n  pace: ["6:00", "5:00"]\n  power: [300]\n',
+            content_type="text/yaml"))
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        zones = page.locator("#zonesCard")
+        expect(zones).to_be_visible(timeout=10000)
+
+        expect(zones.locator("h4")).to_have_text(["Heart rate", "Pace", "Power"])
+        expect(zones.locator(".zone-bar")).to_have_count(5 + 3 + 2)
+        expect(zones.locator(".zone-range", has_text="5:00")).to_have_count(2)
+        expect(zones).to_contain_text("≥ 300 W")
+
+    def test_fit_decoders_agree(self, page: Page, base_url: str):
+        """Test that the fast FIT decoder is used, and gives the same activity as the FIT SDK."""
+        loaded = {}
+        for query in ("", "&fitsdk=1"):
+            page.goto(f"{base_url}/test/test-cases/full-activity/?cache=0{query}")
+            expect(page.locator("#statsGrid")).to_be_visible(timeout=10000)
+            loaded[query] = page.evaluate("""() => ({
+                decoder: window.activityData.fit.decoder,
+                records: window.activityData.records.length,
+                laps: window.activityData.laps,
+                summary: JSON.stringify(window.activityData.summary),
+            })""")
+
+        assert loaded[""]["decoder"] == "fast"
+        assert loaded["&fitsdk=1"]["decoder"] == "sdk"
+        for key in ("records", "laps", "summary"):
+            assert loaded[""][key] == loaded["&fitsdk=1"][key], key
+
     def test_unit_toggle_visible(self, page: Page, base_url: str):
         """Test that km/mi toggle is displayed."""
         page.goto(f"{base_url}/test/test-cases/full-activity/")
@@ -282,6 +353,42 @@ class TestWithMedia:
         back_src = modal_img.get_attribute("src")
         assert back_src == initial_src
 
+    def test_thumbnail_index(self, page: Page, base_url: str):
+        """Test that thumbnails from build-thumbnails.py replace the originals, and videos show their poster."""
+        page.route("**/with-media/manifest.json", lambda route: route.fulfill(json={"files": [
+            "activity.fit", "metadata.yaml", "media/photo1.svg", "media/photo2.svg", "media/clip.mp4",
+            "thumbnails/thumbnails.json",
+        ]}))
+        page.route("**/with-media/thumbnails/thumbnails.json", lambda route: route.fulfill(json={
+            "version": 1, "size": 128, "files": {
+                "photo1.svg": {"thumbnail": "photo1.svg.jpg"},
+                "clip.mp4": {"thumbnail": "clip.mp4.jpg", "poster": "clip.mp4.poster.jpg"},
+            },
+        }))
+        page.route("**/with-media/thumbnails/*.jpg", lambda route: route.fulfill(
+            path=Path(__file__).parent / "test-cases/with-media/media/photo3.svg", content_type="image/svg+xml"))
+        requests = []
+        page.on("request", lambda request: requests.append(request.url.split("/with-media/", 1)[-1]))
+        page.goto(f"{base_url}/test/test-cases/with-media/")
+
+        thumbnails = page.locator(".media-thumbnail")
+        expect(thumbnails).to_have_count(3, timeout=10000)
+        expect(thumbnails.nth(0)).to_have_attribute("src", "thumbnails/photo1.svg.jpg")
+        expect(thumbnails.nth(1)).to_have_attribute("src", "media/photo2.svg")
+        expect(thumbnails.nth(2)).to_have_class(re.compile("media-video"))
+        assert "media/photo1.svg" not in requests
+
+        # The video opens with its poster frame; the photos either side are prefetched
+        with page.expect_request("**/with-media/media/photo1.svg"):
+            thumbnails.nth(2).click()
+        expect(page.locator("#modalVideo")).to_be_visible()
+        expect(page.locator("#modalVideo")).to_have_attribute("poster", "thumbnails/clip.mp4.poster.jpg")
+        expect(page.locator("#modalImage")).to_be_hidden()
+
+        page.keyboard.press("ArrowRight")
+        expect(page.locator("#modalImage")).to_have_attribute("src", "media/photo1.svg")
+        expect(page.locator("#modalVideo")).to_be_hidden()
+
     def test_all_gps_features_work(self, page: Page, base_url: str):
         """Test that all GPS features from Test 1 also work here."""
         page.goto(f"{base_url}/test/test-cases/with-media/")
@@ -412,6 +519,27 @@ class TestD3Version:
         assert "mi" in new_text
         assert new_text != initial_text
 
+    def test_canvas_charts_follow_resize(self, page: Page, base_url: str):
+        """Test that the canvas-drawn charts re-lay out on resize and keep hovering."""
+        page.set_viewport_size({"width": 1200, "height": 900})
+        page.goto(f"{base_url}/test/test-cases/full-activity-d3/")
+        canvas = page.locator("#elevationChart canvas")
+        expect(canvas).to_be_visible(timeout=10000)
+        size = "() => chartState.charts.map(chart => [chart.canvas.width, chart.svg.attr('width')])"
+        wide = page.evaluate(size)
+
+        page.set_viewport_size({"width": 600, "height": 900})
+        page.wait_for_function(f"({size})()[0][0] < {wide[0][0]}")
+        narrow = page.evaluate(size)
+        for before, after in zip(wide, narrow):
+            assert after[0] < before[0]
+            assert float(after[1]) < float(before[1])
+
+        box = page.locator("#heartRateChart svg").bounding_box()
+        page.mouse.move(box["x"] + box["width"] * 0.9, box["y"] + box["height"] / 2)
+        page.wait_for_function("chartState.currentHoverIndex !== null")
+        assert page.evaluate("chartState.currentHoverIndex") > 1000
+
     def test_no_console_errors(self, page: Page, base_url: str):
         """Test that D3 version has no console errors."""
         console_errors = []
@@ -423,3 +551,746 @@ class TestD3Version:
         # Filter out known acceptable errors (like 404s for optional files)
         serious_errors = [e for e in console_errors if "404" not in e]
         assert len(serious_errors) == 0, f"Console errors: {serious_errors}"
+
+
+LIBRARY_HOSTS = ("unpkg.com", "cdn.jsdelivr.net", "d3js.org")
+
+
+class TestLazyLibraries:
+    """Test that libraries are only loaded when the activity needs them."""
+
+    def test_metadata_only_skips_track_libraries(self, page: Page, base_url: str):
+        """Test that a gym workout loads js-yaml but no map, chart or FIT libraries."""
+        scripts = []
+        page.on("request", lambda request: scripts.append(request.url)
+                if any(host in request.url for host in LIBRARY_HOSTS) else None)
+        page.goto(f"{base_url}/test/test-cases/metadata-only/")
+        expect(page.locator("#activityTitle")).to_contain_text("Gym Session", timeout=10000)
+
+        assert [url for url in scripts if url.endswith(".js")] == [
+            "https://cdn.jsdelivr.net/npm/js-yaml@4.1.0/dist/js-yaml.min.js"
+        ]
+        assert page.evaluate("[typeof L, typeof Chart, Object.keys(libraryLoads)]") == [
+            "undefined", "undefined", ["jsyaml"]
+        ]
+
+    @pytest.mark.parametrize("case", ["bundled", "bundled-d3"])
+    def test_bundled_compiles_on_demand(self, page: Page, base_url: str, case: str):
+        """Test that bundled builds load their inlined libraries, and leave the FIT SDK to the worker."""
+        scripts = []
+        page.on("request", lambda request: scripts.append(request.url)
+                if any(host in request.url for host in LIBRARY_HOSTS) else None)
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+
+        assert scripts == []
+        assert page.evaluate("window.activityData.parseMode") == "worker"
+        assert "fitsdk" not in page.evaluate("Object.keys(libraryLoads)")
+        assert page.evaluate("libraryUrl('leaflet')").startswith("blob:")
+
+
+class TestParsingWorker:
+    """Test that FIT/GPX parsing runs in the Web Worker, with a main-thread fallback."""
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3", "bundled", "bundled-d3"])
+    def test_parses_in_worker(self, page: Page, base_url: str, case: str):
+        """Test that all four builds parse in the worker and still render stats."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        assert page.evaluate("window.activityData.parseMode") == "worker"
+        assert page.evaluate("window.activityData.records.length") > 0
+        expect(page.locator(".stat-card")).to_have_count(6)
+
+    def test_main_thread_fallback(self, page: Page, base_url: str):
+        """Test that ?worker=0 parses on the main thread with the same summary."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        worker_summary = page.evaluate("window.activityData.summary.distance")
+
+        # cache=0: the first visit may already have cached the parsed records
+        page.goto(f"{base_url}/test/test-cases/full-activity/?worker=0&cache=0")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        assert page.evaluate("window.activityData.parseMode") == "main"
+        main_summary = page.evaluate("window.activityData.summary.distance")
+        assert main_summary == pytest.approx(worker_summary)
+
+
+class TestRecordStore:
+    """Test that activity records live in the columnar typed-array store."""
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3"])
+    def test_columns_are_typed_arrays(self, page: Page, base_url: str, case: str):
+        """Test that each channel is a typed array sized to the record count."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        info = page.evaluate("""() => {
+            const records = window.activityData.records;
+            return {
+                length: records.length,
+                distance: records.distance.constructor.name,
+                heartRate: records.heartRate.constructor.name,
+                flags: records.flags.constructor.name,
+                columnLength: records.distance.length,
+                withHeartRate: records.flags.filter(f => f & CHANNEL_FLAGS.heartRate).length
+            };
+        }""")
+        assert info["length"] > 0
+        assert info["columnLength"] == info["length"]
+        assert info["distance"] == "Float64Array"
+        assert info["heartRate"] == "Int16Array"
+        assert info["flags"] == "Uint8Array"
+        assert 0 < info["withHeartRate"] <= info["length"]
+
+    def test_d3_hover_reads_columns(self, page: Page, base_url: str):
+        """Test that D3 hover resolves a sample from the columns and shows its info."""
+        page.goto(f"{base_url}/test/test-cases/full-activity-d3/")
+        chart = page.locator("#elevationChart svg")
+        expect(chart).to_be_visible(timeout=5000)
+        box = chart.bounding_box()
+        page.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+        expect(page.locator("#hoverInfo")).to_have_class(re.compile("visible"))
+        expect(page.locator("#hoverDistance")).to_contain_text("Distance:")
+
+
+class TestStreamingGpx:
+    """Test that a GPX-only activity is parsed while it downloads."""
+
+    @pytest.mark.parametrize("worker", ["1", "0"])
+    def test_gpx_only_preview(self, page: Page, base_url: str, worker: str):
+        """Test that preview batches arrive before the full render, in both parse modes."""
+        page.goto(f"{base_url}/test/test-cases/gpx-only/?worker={worker}")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        expect(page.locator("#activityTitle")).to_have_text("Evening Run (GPX only)")
+        expect(page.locator(".stat-card")).to_have_count(6)
+        assert page.evaluate("window.activityData.previewBatches") >= 1
+        assert page.evaluate("window.activityData.gpx.pointCount") == 2024
+        assert page.evaluate("window.activityData.records.length") == 2024
+
+    def test_fit_activity_skips_preview(self, page: Page, base_url: str):
+        """Test that the GPX is not previewed when a FIT file takes precedence."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        expect(page.locator(".stat-card")).to_have_count(6)
+        assert page.evaluate("window.activityData.previewBatches") is None
+
+
+def without_folder_listing(page: Page, folder: str):
+    """Answer the page's JSON listing request for `folder` with 404, as a plain static server would."""
+    page.route(f"**/{folder}/", lambda route: route.fulfill(status=404)
+               if route.request.resource_type == "fetch" else route.continue_())
+
+
+class TestFileDiscovery:
+    """Test concurrent, manifest-driven discovery of activity files."""
+
+    def test_gpx_not_downloaded_with_fit(self, page: Page, base_url: str):
+        """Test that the GPX is only checked for when the FIT file supplies the records."""
+        without_folder_listing(page, "full-activity")
+        requests = []
+        page.on("request", lambda request: requests.append((request.method, request.url.rsplit("/", 1)[-1])))
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+
+        assert ("HEAD", "activity.gpx") in requests
+        assert ("GET", "activity.gpx") not in requests
+        expect(page.locator("#filesDetected")).to_contain_text("activity.gpx")
+        expect(page.locator("#status")).to_contain_text("skipped activity.gpx")
+
+    def test_manifest_avoids_probes(self, page: Page, base_url: str):
+        """Test that only files listed in manifest.json are requested."""
+        page.route("**/full-activity/manifest.json", lambda route: route.fulfill(
+            json={"files": ["activity.fit", "activity.gpx", "metadata.yaml"]}
+        ))
+        requests = []
+        page.on("request", lambda request: requests.append(request.url.split("/full-activity/", 1)[-1]))
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator("#activityTitle")).to_have_text("Morning Run", timeout=10000)
+
+        for probe in ["metadata.yml", "metadata.org", "media/", "activity.gpx"]:
+            assert probe not in requests
+        assert page.evaluate("window.activityData.loadReport.manifest") is True
+        expect(page.locator("#filesDetected")).to_contain_text("activity.gpx")
+        expect(page.locator(".stat-card")).to_have_count(6)
+
+    @pytest.mark.parametrize("case", ["full-activity", "with-media"])
+    def test_folder_listing_avoids_probes(self, page: Page, base_url: str, case: str):
+        """Test that serve.py's JSON folder listing replaces probing for files and media."""
+        responses = []
+        page.on("response", lambda response: responses.append(
+            (response.url.split(f"/{case}/", 1)[-1], response.status)) if f"/{case}/" in response.url else None)
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+
+        missing = [url for url, status in responses if status == 404 and url != "manifest.json"]
+        assert missing == []
+        assert ("media/", 200) not in responses
+        assert page.evaluate("window.activityData.loadReport.listing") is True
+        expect(page.locator("#status")).to_contain_text("files listed by the server")
+        if case == "with-media":
+            expect(page.locator(".media-thumbnail")).to_have_count(3)
+
+
+class TestPreprocessedRecords:
+    """Test loading records from a sidecar written by preprocess-activities.py."""
+
+    def test_sidecar_replaces_parsing(self, page: Page, base_url: str):
+        """Test that the sidecar is used instead of downloading and parsing the FIT file."""
+        requests = []
+        page.on("request", lambda request: requests.append((request.method, request.url.rsplit("/", 1)[-1])))
+        page.goto(f"{base_url}/test/test-cases/preprocessed/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+
+        assert ("GET", "activity.records.bin") in requests
+        assert ("GET", "activity.fit") not in requests
+        assert page.evaluate("window.activityData.parseMode") == "sidecar"
+        assert page.evaluate("lodPyramids === window.activityData.lodPyramids")
+        expect(page.locator(".stat-card").first).to_contain_text("6.24")
+        expect(page.locator("#filesDetected")).to_contain_text("activity.fit")
+
+    @pytest.mark.parametrize("check", ["head", "listing"])
+    def test_stale_sidecar_is_ignored(self, page: Page, base_url: str, check: str):
+        """Test that the FIT file is parsed when it no longer matches the sidecar."""
+        if check == "head":
+            without_folder_listing(page, "preprocessed")
+            page.route("**/preprocessed/activity.fit", lambda route: route.fulfill(
+                status=200, headers={"Content-Length": "1"}, body=b"x"
+            ) if route.request.method == "HEAD" else route.continue_())
+        else:
+            def changed_size(route):
+                if route.request.resource_type != "fetch":
+                    route.continue_()
+                    return
+                response = route.fetch()
+                listing = response.json()
+                listing["sizes"]["activity.fit"] = 1
+                route.fulfill(response=response, json=listing)
+            page.route("**/preprocessed/", changed_size)
+        page.goto(f"{base_url}/test/test-cases/preprocessed/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        assert page.evaluate("window.activityData.parseMode") != "sidecar"
+
+
+# Resolves to the folder URLs in the viewer's IndexedDB activity cache, once there are any
+CACHED_ACTIVITIES = """() => new Promise(resolve => {
+    const poll = () => {
+        const open = indexedDB.open('plain-text-fitness');
+        open.onsuccess = () => {
+            const db = open.result;
+            if (!db.objectStoreNames.contains('entries')) {
+                db.close();
+                setTimeout(poll, 50);
+                return;
+            }
+            const keys = db.transaction('entries').objectStore('entries').getAllKeys();
+            keys.onsuccess = () => {
+                db.close();
+                keys.result.length ? resolve(keys.result) : setTimeout(poll, 50);
+            };
+        };
+    };
+    poll();
+})"""
+
+
+class TestActivityCache:
+    """Test the IndexedDB cache of parsed activities."""
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3"])
+    def test_repeat_visit_uses_cache(self, page: Page, base_url: str, case: str):
+        """Test that a reload revalidates the FIT file (304) and renders without parsing."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        distance = page.evaluate("window.activityData.summary.distance")
+        assert page.evaluate(CACHED_ACTIVITIES) == [f"{base_url}/test/test-cases/{case}/"]
+
+        responses = []
+        page.on("response", lambda response: responses.append((response.url.rsplit("/", 1)[-1], response.status)))
+        page.reload()
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+
+        assert page.evaluate("window.activityData.parseMode") == "cache"
+        assert ("activity.fit", 304) in responses
+        assert ("activity.fit", 200) not in responses
+        assert page.evaluate("window.activityData.summary.distance") == pytest.approx(distance)
+        assert page.evaluate("window.activityData.records.length") == 2024
+        expect(page.locator("#status")).to_contain_text("cached records")
+
+    def test_changed_file_is_parsed(self, page: Page, base_url: str):
+        """Test that the cache is bypassed when the FIT file no longer matches it."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        page.evaluate(CACHED_ACTIVITIES)
+
+        # Without its conditional headers the request gets a 200, as for a changed file
+        page.route("**/full-activity/activity.fit", lambda route: route.continue_(headers={
+            name: value for name, value in route.request.headers.items()
+            if name not in ("if-modified-since", "if-none-match")
+        }))
+        page.reload()
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        assert page.evaluate("window.activityData.parseMode") == "worker"
+
+
+class TestChartLevelOfDetail:
+    """Test decimated Chart.js rendering and drag-to-zoom."""
+
+    def test_points_fit_chart_width(self, page: Page, base_url: str):
+        """Test that a narrow chart gets a decimated series within its point budget."""
+        page.set_viewport_size({"width": 420, "height": 900})
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        expect(page.locator("#activityContent")).to_be_visible(timeout=10000)
+        info = page.evaluate("""() => {
+            const chart = window.charts.elevation;
+            return {
+                points: chart.data.datasets[0].data.length,
+                width: chart.chartArea.width,
+                level: chart.$lod.level,
+                records: window.activityData.records.length
+            };
+        }""")
+        assert info["level"] > 0
+        assert info["points"] < info["records"]
+        assert info["points"] <= info["width"] * 2 + 16
+
+    def test_drag_zoom_refines_and_resets(self, page: Page, base_url: str):
+        """Test that drag-zooming narrows all charts and double-click resets them."""
+        page.set_viewport_size({"width": 420, "height": 900})
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        chart = page.locator("#elevationChart")
+        expect(chart).to_be_visible(timeout=10000)
+        level_before = page.evaluate("window.charts.elevation.$lod.level")
+
+        box = chart.bounding_box()
+        y = box["y"] + box["height"] / 2
+        page.mouse.move(box["x"] + box["width"] * 0.4, y)
+        page.mouse.down()
+        page.mouse.move(box["x"] + box["width"] * 0.5, y, steps=5)
+        page.mouse.up()
+
+        expect(page.locator("#resetZoom")).to_be_visible()
+        zoomed = page.evaluate("""() => ['elevation', 'heartRate', 'pace'].map(key => {
+            const chart = window.charts[key];
+            return { min: chart.scales.x.min, max: chart.scales.x.max, level: chart.$lod.level };
+        })""")
+        total = page.evaluate("window.activityData.summary.distance")
+        for axis in zoomed:
+            assert axis["max"] - axis["min"] < total / 2
+        assert zoomed[0]["level"] < level_before
+
+        chart.dblclick()
+        expect(page.locator("#resetZoom")).to_be_hidden()
+        assert page.evaluate("window.charts.elevation.$lod.level") == level_before
+
+    def test_zoom_looks_up_segment(self, page: Page, base_url: str):
+        """Test that a drag-zoom lists the stretch in other activities from serve.py's index."""
+        lookups = []
+
+        def answer(route):
+            lookups.append(route.request.url)
+            route.fulfill(json={
+                "activity": "test/test-cases/full-activity", "from": 2.5, "to": 3.5, "distance": 1.0,
+                "elapsed": 330.0, "matches": [
+                    {"path": "runs/fast", "title": "Tempo <b>Run</b>", "date": "2025-10-01", "start": 0.4, "elapsed": 300.0},
+                    {"path": "runs/slow", "title": "Easy Run", "date": "2025-10-05", "start": 2.1, "elapsed": 360.0},
+                ]})
+        page.route("**/.segments?*", answer)
+        page.set_viewport_size({"width": 420, "height": 900})
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        chart = page.locator("#elevationChart")
+        expect(chart).to_be_visible(timeout=10000)
+
+        box = chart.bounding_box()
+        y = box["y"] + box["height"] / 2
+        page.mouse.move(box["x"] + box["width"] * 0.4, y)
+        page.mouse.down()
+        page.mouse.move(box["x"] + box["width"] * 0.6, y, steps=5)
+        page.mouse.up()
+
+        rows = page.locator("#segmentMatches tr")
+        expect(rows).to_have_count(4)
+        assert "activity=%2Ftest%2Ftest-cases%2Ffull-activity%2F" in lookups[0]
+        expect(rows.nth(1)).to_contain_text("Tempo <b>Run</b>")
+        expect(rows.nth(2)).to_have_class("current")
+        expect(rows.nth(1).locator("a")).to_have_attribute("href", "/runs/fast/")
+        expect(rows.nth(1)).to_contain_text("5:00")
+
+        page.locator("#resetZoom").click()
+        expect(page.locator("#segmentCard")).to_be_hidden()
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3"])
+    def test_map_clicks_look_up_segment(self, page: Page, base_url: str, case: str):
+        """Test that two clicks on the map route snap to records and look up the stretch between them."""
+        lookups = []
+
+        def answer(route):
+            lookups.append(route.request.url)
+            route.fulfill(json={
+                "activity": f"test/test-cases/{case}", "from": 1.5, "to": 4.7, "distance": 3.2,
+                "elapsed": 1100.0, "matches": [
+                    {"path": "runs/fast", "title": "Tempo Run", "date": "2025-10-01", "start": 0.4, "elapsed": 1000.0},
+                ]})
+        page.route("**/.segments?*", answer)
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        page.wait_for_function("routeDetail && routeDetail.vertexCount > 1")
+        box = page.locator("#map").bounding_box()
+        for index in (1500, 500):
+            point = page.evaluate(f"""() => {{
+                const records = activityData.records;
+                const point = map.latLngToContainerPoint([records.latitude[{index}], records.longitude[{index}]]);
+                return {{ x: point.x, y: point.y }};
+            }}""")
+            page.mouse.click(box["x"] + point["x"], box["y"] + point["y"])
+
+        rows = page.locator("#segmentMatches tr")
+        expect(rows).to_have_count(3)
+        selection = page.evaluate("""() => {
+            const { distance } = activityData.records;
+            return { from: distance[mapSelection.to], to: distance[mapSelection.from], line: !!mapSelection.line };
+        }""")
+        assert selection["line"]
+        assert f"from={selection['from']:.3f}" in lookups[-1]
+        assert f"to={selection['to']:.3f}" in lookups[-1]
+
+    def test_hover_resolves_record_index(self, page: Page, base_url: str):
+        """Test that hovering a decimated chart selects a real record index."""
+        page.set_viewport_size({"width": 420, "height": 900})
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        chart = page.locator("#paceChart")
+        expect(chart).to_be_visible(timeout=10000)
+        box = chart.bounding_box()
+        page.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+        page.wait_for_function("currentHoverIndex !== null")
+        index = page.evaluate("currentHoverIndex")
+        assert isinstance(index, int)
+        assert 0 < index < page.evaluate("window.activityData.records.length")
+
+
+class TestCoordinatedHover:
+    """Test the frame-coalesced hover shared by the charts and the map."""
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3"])
+    def test_hover_reuses_map_marker(self, page: Page, base_url: str, case: str):
+        """Test that moving across a chart moves one marker instead of recreating it."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        chart = page.locator("#paceChart")
+        expect(chart).to_be_visible(timeout=10000)
+        box = chart.bounding_box()
+        y = box["y"] + box["height"] / 2
+        page.mouse.move(box["x"] + box["width"] * 0.3, y)
+        expect(page.locator(".hover-marker")).to_have_count(1, timeout=5000)
+        page.evaluate("window.firstMarker = hoverMarker")
+        page.mouse.move(box["x"] + box["width"] * 0.7, y, steps=10)
+        page.wait_for_function("hoverStats.updates > 1")
+        expect(page.locator(".hover-marker")).to_have_count(1)
+        assert page.evaluate("hoverMarker === window.firstMarker")
+
+    def test_hover_updates_are_coalesced(self, page: Page, base_url: str):
+        """Test that hover work runs at most once per pointer event and is timed."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/")
+        chart = page.locator("#elevationChart")
+        expect(chart).to_be_visible(timeout=10000)
+        box = chart.bounding_box()
+        y = box["y"] + box["height"] / 2
+        page.mouse.move(box["x"] + box["width"] * 0.2, y)
+        page.mouse.move(box["x"] + box["width"] * 0.8, y, steps=40)
+        page.wait_for_function("hoverStats.updates > 0")
+        stats = page.evaluate("window.hoverStats")
+        assert 0 < stats["updates"] <= stats["events"]
+        assert stats["worstMs"] > 0
+
+
+class TestPlayback:
+    """Test replaying an activity along its timestamps."""
+
+    @pytest.mark.parametrize("case, hover_index", [
+        ("full-activity", "currentHoverIndex"),
+        ("full-activity-d3", "chartState.currentHoverIndex"),
+    ])
+    def test_playback_moves_marker_and_crosshair(self, page: Page, base_url: str, case: str, hover_index: str):
+        """Test that playback moves one marker and the crosshairs, counts dropped frames and seeks."""
+        page.goto(f"{base_url}/test/test-cases/{case}/?perf=1")
+        toggle = page.locator("#playbackToggle")
+        expect(toggle).to_be_visible(timeout=10000)
+        page.select_option("#playbackSpeed", "500")
+        toggle.click()
+        expect(toggle).to_have_text("Pause")
+        expect(page.locator(".hover-marker")).to_have_count(1, timeout=5000)
+        page.evaluate("window.firstMarker = hoverMarker")
+        page.wait_for_function("playback.cursor > 10 && playbackStats.frames > 10")
+        toggle.click()
+        expect(toggle).to_have_text("Play")
+
+        assert page.evaluate("hoverMarker === window.firstMarker")
+        assert page.evaluate(f"{hover_index} === playback.cursor")
+        stats = page.evaluate("window.playbackStats")
+        assert stats["dropped"] < stats["frames"]
+        expect(page.locator(".perf-readout")).to_contain_text("dropped")
+
+        # A seek lands on the last record at or before the new time
+        page.locator("#playbackScrubber").fill("600")
+        assert page.evaluate("""() => {
+            const t = activityData.records.timestamp, i = playback.cursor;
+            return t[i] - t[0] <= 600000 && t[i + 1] - t[0] > 600000;
+        }""")
+
+
+class TestComparison:
+    """Test overlaying other activity folders with ?compare=."""
+
+    @pytest.mark.parametrize("worker", ["1", "0"])
+    def test_overlays_compared_activities(self, page: Page, base_url: str, worker: str):
+        """Test that compared folders are drawn on the charts and map, with their memory, and follow hover."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/"
+                  f"?worker={worker}&compare=../gpx-only/,../full-activity-d3/,../missing/")
+        card = page.locator("#compareCard")
+        expect(card).to_be_visible(timeout=15000)
+        expect(card.locator("tr")).to_have_count(5)  # Header, this activity and three compared
+        expect(card).to_contain_text("Not loaded")
+        assert page.evaluate("charts.elevation.data.datasets.length") == 3
+        assert page.evaluate("charts.pace.data.datasets[2].data.length") > 0
+
+        loaded = [entry for entry in page.evaluate("window.compareStats.activities") if "error" not in entry]
+        assert len(loaded) == 2
+        assert all(0 < entry["keptBytes"] < entry["parsedBytes"] for entry in loaded)
+
+        chart = page.locator("#paceChart")
+        box = chart.bounding_box()
+        page.mouse.move(box["x"] + box["width"] * 0.5, box["y"] + box["height"] / 2)
+        page.wait_for_function("comparison.activities.filter(a => a.marker && map.hasLayer(a.marker)).length === 2")
+        # gpx-only is this activity's track: on the shared grid both read the same time
+        cells = page.evaluate("comparison.hoverCells.map(cell => cell && cell.textContent)")
+        assert cells[0] == cells[1] != ""
+
+    def test_unreadable_fit_falls_back_to_gpx(self, page: Page, base_url: str):
+        """Test that a compared folder whose activity.fit cannot be parsed is loaded from its GPX."""
+        page.route("**/gpx-only/activity.fit", lambda route: route.fulfill(body=b"not a fit file"))
+        page.goto(f"{base_url}/test/test-cases/full-activity/?compare=../gpx-only/")
+        card = page.locator("#compareCard")
+        expect(card).to_be_visible(timeout=15000)
+        expect(card.locator("tr")).to_have_count(3)
+        expect(card).not_to_contain_text("Not loaded")
+        assert page.evaluate("comparison.activities[0].records") == 2024
+
+    def test_d3_overlays_compared_activities(self, page: Page, base_url: str):
+        """Test that the D3 viewer loads compared folders, widens its charts to them and follows hover."""
+        page.goto(f"{base_url}/test/test-cases/full-activity-d3/?compare=../gpx-only/,../full-activity/")
+        card = page.locator("#compareCard")
+        expect(card).to_be_visible(timeout=15000)
+        expect(card.locator("tr")).to_have_count(4)  # Header, this activity and two compared
+        assert page.evaluate("comparison.activities.every(a => a.route && map.hasLayer(a.route))")
+
+        chart = page.locator("#paceChart")
+        box = chart.bounding_box()
+        page.mouse.move(box["x"] + box["width"] * 0.5, box["y"] + box["height"] / 2)
+        page.wait_for_function("comparison.activities.filter(a => a.marker && map.hasLayer(a.marker)).length === 2")
+        cells = page.evaluate("comparison.hoverCells.map(cell => cell.textContent)")
+        assert cells[0] == cells[1] == cells[2] != ""
+
+
+class TestUnitToggle:
+    """Test that switching units updates the page in place."""
+
+    @pytest.mark.parametrize("case, chart, x_title", [
+        ("full-activity", "charts.elevation", "charts.elevation.options.scales.x.title.text"),
+        ("full-activity-d3", "chartState.charts[0]", "chartState.charts[0].xLabel.text()"),
+    ])
+    def test_toggle_keeps_map_and_charts(self, page: Page, base_url: str, case: str, chart: str, x_title: str):
+        """Test that the map and charts are reused and relabelled, not rebuilt."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".stat-card").first).to_contain_text("km", timeout=10000)
+        page.wait_for_function(f"map && {chart}")
+        page.evaluate(f"window.previous = {{ map, chart: {chart} }}")
+        assert page.evaluate(x_title) == "Distance (km)"
+
+        page.locator(".toggle-switch .slider").click()
+        expect(page.locator(".stat-card").first).to_contain_text("mi")
+        assert page.evaluate(x_title) == "Distance (mi)"
+        assert page.evaluate(f"map === window.previous.map && {chart} === window.previous.chart")
+
+
+class TestRouteLevelOfDetail:
+    """Test the simplified, canvas-rendered map route."""
+
+    @pytest.mark.parametrize("case", ["full-activity", "full-activity-d3"])
+    def test_route_is_simplified_on_canvas(self, page: Page, base_url: str, case: str):
+        """Test that the route is drawn on a canvas with fewer vertices than records."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".leaflet-overlay-pane canvas")).to_have_count(1, timeout=10000)
+        expect(page.locator(".leaflet-overlay-pane svg")).to_have_count(0)
+        page.wait_for_function("routeDetail && routeDetail.vertexCount > 1")
+        vertices = page.evaluate("routeDetail.vertexCount")
+        assert vertices < page.evaluate("window.activityData.records.length")
+
+    def test_frame_time_readout(self, page: Page, base_url: str):
+        """Test that ?perf=1 reports frame times after a zoom."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/?perf=1")
+        readout = page.locator(".perf-readout")
+        expect(readout).to_be_visible(timeout=10000)
+        page.wait_for_function("routeDetail && routeDetail.vertexCount > 1")
+        page.evaluate("map.zoomIn()")
+        expect(readout).to_contain_text("frames", timeout=5000)
+        stats = page.evaluate("window.mapFrameStats")
+        assert stats["frames"] > 0
+        assert stats["vertices"] > 1
+
+
+class TestPerformanceInstrumentation:
+    """Test the load-phase timings in window.perfStats and the ?perf=1 panel."""
+
+    @pytest.mark.parametrize("case, charts", [
+        ("full-activity", "renderCharts"),
+        ("full-activity-d3", "renderChartsD3"),
+    ])
+    def test_phase_timings(self, page: Page, base_url: str, case: str, charts: str):
+        """Test that every load phase is measured, including those in the parsing worker."""
+        page.goto(f"{base_url}/test/test-cases/{case}/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        page.wait_for_function(f"window.perfStats.phases.{charts} && routeDetail.vertexCount > 1")
+
+        phases = page.evaluate("window.perfStats.phases")
+        for name in ["loadManifest", "fetch activity.fit", "parseFitData", "mergeActivityData",
+                     "calculateMetrics", "renderStats", "renderMap", charts, "autoLoadActivity"]:
+            assert phases[name]["duration"] >= 0, name
+        assert phases["parseFitData"]["worker"] is True
+        assert phases["fetch activity.fit"]["start"] < phases["parseFitData"]["start"] < phases["renderMap"]["start"]
+        assert page.evaluate("performance.getEntriesByName('ptf:renderMap', 'measure').length") == 1
+
+        counts = page.evaluate("window.perfStats.counts")
+        assert counts["records"] == counts["fitPoints"] == 2024
+        assert 1 < counts["routeVertices"] < 2024
+        assert counts["chartPoints"] > 0
+
+    def test_perf_panel(self, page: Page, base_url: str):
+        """Test that ?perf=1 shows the timings in a panel and measures hover updates."""
+        page.goto(f"{base_url}/test/test-cases/full-activity/?perf=1")
+        panel = page.locator(".perf-panel")
+        expect(panel).to_contain_text("parseFitData", timeout=10000)
+        expect(panel).to_contain_text("records 2024")
+        expect(panel).to_contain_text("Long tasks")
+
+        box = page.locator("#elevationChart").bounding_box()
+        page.mouse.move(box["x"] + box["width"] / 2, box["y"] + box["height"] / 2)
+        page.wait_for_function("window.perfStats.phases.hover")
+        expect(panel).to_contain_text("hover")
+
+
+# Resolves to the URLs in the service worker's tile cache, once there are any
+TILE_CACHE_KEYS = """() => new Promise(resolve => {
+    const poll = () => caches.open('tiles-v1').then(cache => cache.keys()).then(keys =>
+        keys.length ? resolve(keys.map(key => key.url)) : setTimeout(poll, 50));
+    poll();
+})"""
+
+
+class TestMapTiles:
+    """Test map tiles prefetched by prefetch-tiles.py and the tile cache service worker."""
+
+    def tile_paths(self, urls, prefix):
+        return {url.split(prefix, 1)[1] for url in urls if prefix in url and url.endswith(".png")}
+
+    def test_local_tiles_preferred(self, page: Page, base_url: str, tile_server):
+        """Test that tiles in the folder's tiles/ directory are not requested from the tile source."""
+        requests = []
+        page.on("request", lambda request: requests.append(request.url))
+        page.goto(f"{base_url}/test/test-cases/local-tiles/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        expect(page.locator("#map img.leaflet-tile-loaded").first).to_be_visible(timeout=10000)
+        page.wait_for_load_state("networkidle")
+
+        local = self.tile_paths(requests, "/local-tiles/tiles/")
+        assert local
+        assert not local & self.tile_paths(requests, "localhost:8001/")
+        expect(page.locator(".leaflet-control-attribution")).to_contain_text("Stand-in tiles")
+
+    def test_missing_local_tile_falls_back(self, page: Page, base_url: str, tile_server):
+        """Test that a tile listed in tiles.json but missing on disk is loaded from the tile source."""
+        page.route(re.compile(r".*/local-tiles/tiles/\d+/.*"), lambda route: route.fulfill(status=404))
+        requests = []
+        page.on("request", lambda request: requests.append(request.url))
+        page.goto(f"{base_url}/test/test-cases/local-tiles/")
+        expect(page.locator("#map img.leaflet-tile-loaded").first).to_be_visible(timeout=10000)
+        page.wait_for_load_state("networkidle")
+
+        local = self.tile_paths(requests, "/local-tiles/tiles/")
+        assert local and local <= self.tile_paths(requests, "localhost:8001/")
+
+    def test_tile_cache_worker(self, page: Page, base_url: str, tile_server):
+        """Test that with tile-cache-sw.js next to the page, source tiles are cached and reused."""
+        page.goto(f"{base_url}/test/test-cases/local-tiles/")
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        page.evaluate("navigator.serviceWorker.ready.then(() => true)")
+
+        page.reload()
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        assert page.evaluate("!!navigator.serviceWorker.controller")
+        # Zoomed out of the prefetched levels, tiles come from the source through the worker
+        page.evaluate("map.setZoom(12)")
+        assert any("localhost:8001/12/" in url for url in page.evaluate(TILE_CACHE_KEYS))
+
+        responses = []
+        page.on("response", lambda response: responses.append(response))
+        page.reload()
+        expect(page.locator(".stat-card")).to_have_count(6, timeout=10000)
+        page.evaluate("map.setZoom(12)")
+        page.wait_for_load_state("networkidle")
+        page.wait_for_timeout(500)
+        cached = [response for response in responses if "localhost:8001/12/" in response.url]
+        assert cached and all(response.from_service_worker for response in cached)
+
+
+class TestLibraryPage:
+    """Test the library page over library.json from build-library-index.py."""
+
+    def test_lists_activity_folders(self, page: Page, base_url: str):
+        """Test that every indexed folder is listed and links to its viewer."""
+        page.goto(f"{base_url}/test/test-cases/library.html")
+        expect(page.locator(".library-row:visible")).to_have_count(9, timeout=10000)
+        expect(page.locator("#libraryMeta")).to_contain_text("9 activities")
+
+        page.fill("#searchInput", "gym")
+        expect(page.locator(".library-row:visible")).to_have_count(1)
+        row = page.locator(".library-row:visible").first
+        expect(row).to_contain_text("Gym Session")
+        expect(row).to_have_attribute("href", "metadata-only/")
+
+    def test_large_index_is_virtualized(self, page: Page, base_url: str):
+        """Test that 10k activities only put the visible rows in the DOM, sorted and filtered."""
+        rows = [
+            [f"runs/{i:05d}", f"Run {i:05d}", f"20{10 + i % 15}-01-01", "cycling" if i % 4 == 0 else "running",
+             (i * 7919 % 10000) / 100, 1800 + i, i % 500, None]
+            for i in range(10000)
+        ]
+        index = {"version": 1, "fields": ["path", "title", "date", "type", "distance", "duration",
+                                          "elevationGain", "bbox"], "activities": rows}
+        page.route("**/library.json", lambda route: route.fulfill(json=index))
+        page.goto(f"{base_url}/test/test-cases/library.html")
+        expect(page.locator("#libraryMeta")).to_contain_text("10000 activities", timeout=10000)
+        assert page.locator(".library-row").count() < 80
+
+        page.click("#libraryHead button[data-field='distance']")
+        expect(page.locator(".library-row:visible").first).to_contain_text("99.99 km")
+
+        page.locator("#libraryList").evaluate("list => list.scrollTop = list.scrollHeight")
+        expect(page.locator(".library-row:visible", has_text=re.compile(r"\b0\.00 km"))).to_have_count(1)
+        assert page.locator(".library-row").count() < 80
+
+        page.select_option("#typeFilter", "cycling")
+        expect(page.locator("#libraryMeta")).to_contain_text("2500 of 10000 activities")
+        page.fill("#searchInput", "run 0999")
+        expect(page.locator("#libraryMeta")).to_contain_text("2 of 10000 activities")
+
+
+class TestHeatmapPage:
+    """Test the heatmap page over the tiles from build-heatmap.py."""
+
+    def test_shows_heat_tiles(self, page: Page, base_url: str):
+        """Test that the archive is shown as one prerendered tile layer, not as polylines."""
+        page.goto(f"{base_url}/test/test-cases/heatmap.html")
+        expect(page.locator("#heatmapMeta")).to_contain_text("8 activities", timeout=10000)
+        expect(page.locator("img.leaflet-tile[src*='heatmap/14/']").first).to_be_visible(timeout=10000)
+        assert page.evaluate("heatLayer.options.maxNativeZoom") == 14
+        assert page.locator(".leaflet-overlay-pane path").count() == 0
+
+        page.uncheck("#baseMapSwitch")
+        expect(page.locator(".base-tiles")).to_have_count(0)
+        expect(page.locator("img.leaflet-tile[src*='heatmap/']").first).to_be_visible()
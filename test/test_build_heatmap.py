@@ -0,0 +1,100 @@
+"""
+Tests for build-heatmap.py.
+"""
+import json
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+FULL_ACTIVITY = ROOT / "test" / "test-cases" / "full-activity"
+
+
+def read_alpha(path: Path):
+    """The alpha channel of an RGBA heatmap tile, as bytes."""
+    data = path.read_bytes()
+    assert data.startswith(b"\x89PNG\r\n\x1a\n")
+    width, height, depth, colour = struct.unpack(">IIBB", data[16:26])
+    assert (width, height, depth, colour) == (256, 256, 8, 6)
+    idat, pos = b"", 8
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos:pos + 8])
+        if kind == b"IDAT":
+            idat += data[pos + 8:pos + 8 + length]
+        pos += 12 + length
+    raw = zlib.decompress(idat)
+    stride = 1 + 256 * 4
+    assert all(raw[row * stride] == 0 for row in range(256))  # Filter type None
+    return b"".join(raw[row * stride + 1:(row + 1) * stride][3::4] for row in range(256))
+
+
+def copy_route(folder: Path, latitude_shift=0.0):
+    """The full-activity route as a GPX-only folder, optionally moved north."""
+    text = (FULL_ACTIVITY / "activity.gpx").read_text()
+    text = re.sub(r'lat="([-\d.]+)"', lambda m: f'lat="{float(m.group(1)) + latitude_shift:.7f}"', text)
+    folder.mkdir(parents=True)
+    (folder / "activity.gpx").write_text(text)
+
+
+class TestBuildHeatmap:
+    """Test the heatmap tile pyramid and its incremental updates."""
+
+    def build(self, root: Path, *args):
+        return subprocess.run(
+            [sys.executable, str(ROOT / "build-heatmap.py"), str(root), "--zoom", "13-14", "--jobs", "2", *args],
+            capture_output=True, text=True, check=True,
+        ).stdout
+
+    def tiles(self, root: Path):
+        return {path.relative_to(root / "heatmap").as_posix(): path.stat().st_mtime_ns
+                for path in (root / "heatmap").rglob("*.png")}
+
+    def test_counts_activities_per_pixel(self, tmp_path: Path):
+        """Test that tiles are written at every zoom level, brighter where routes overlap."""
+        copy_route(tmp_path / "first")
+        copy_route(tmp_path / "second")
+        copy_route(tmp_path / "elsewhere", latitude_shift=0.05)
+        self.build(tmp_path)
+
+        tiles = self.tiles(tmp_path)
+        assert {name.split("/")[0] for name in tiles} == {"13", "14"}
+        info = json.loads((tmp_path / "heatmap" / "heatmap.json").read_text())
+        assert (info["minZoom"], info["maxZoom"], info["activities"]) == (13, 14, 3)
+        south, west, north, east = info["bounds"]
+        assert south < 42.42 and north > 42.48 and west < -72.44 < -72.42 < east
+
+        # The two copies overlap everywhere: one activity count above the lone route
+        shared = read_alpha(tmp_path / "heatmap" / "14" / "4895" / "6055.png")
+        shutil.rmtree(tmp_path / "second")
+        self.build(tmp_path)
+        single = read_alpha(tmp_path / "heatmap" / "14" / "4895" / "6055.png")
+        assert {value for value in shared if value} == {max(shared)}
+        assert max(single) < max(shared)
+        assert [bool(value) for value in shared] == [bool(value) for value in single]
+
+    def test_rerenders_only_touched_tiles(self, tmp_path: Path):
+        """Test that a rerun rerenders the tiles of changed activities and deletes emptied ones."""
+        copy_route(tmp_path / "home")
+        copy_route(tmp_path / "away", latitude_shift=0.05)
+        self.build(tmp_path)
+        before = self.tiles(tmp_path)
+
+        output = self.build(tmp_path)
+        assert "2 unchanged" in output and "Rendered 0 tiles" in output
+        assert self.tiles(tmp_path) == before
+
+        shutil.rmtree(tmp_path / "away")
+        output = self.build(tmp_path)
+        assert "1 removed" in output
+        after = self.tiles(tmp_path)
+        assert after and set(after) < set(before)
+        # Tiles of the route that stayed were not touched
+        assert all(after[name] == before[name] for name in after)
+
+        # New settings start over
+        self.build(tmp_path, "--saturation", "5")
+        assert all(self.tiles(tmp_path)[name] != before[name] for name in after)
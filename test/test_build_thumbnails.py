@@ -0,0 +1,105 @@
+"""
+Tests for build-thumbnails.py. Skipped without Pillow or ffmpeg to read images.
+"""
+import json
+import shutil
+import struct
+import subprocess
+import sys
+import zlib
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).parent.parent
+WITH_MEDIA = ROOT / "test" / "test-cases" / "with-media"
+
+try:
+    import PIL  # noqa: F401
+    HAS_PILLOW = True
+except ImportError:
+    HAS_PILLOW = False
+
+pytestmark = pytest.mark.skipif(not HAS_PILLOW and shutil.which("ffmpeg") is None,
+                                reason="needs Pillow or ffmpeg")
+
+
+def write_png(path: Path, width: int, height: int):
+    """A plain two-colour RGB PNG."""
+    row = b"".join(bytes((255, 80, 0) if x < width // 2 else (0, 80, 255)) for x in range(width))
+    rows = (b"\0" + row) * height
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+                     + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b""))
+
+
+def jpeg_size(path: Path):
+    """(width, height) from a JPEG's frame header."""
+    data = path.read_bytes()
+    assert data[:2] == b"\xff\xd8"
+    offset = 2
+    while True:
+        marker, length = data[offset + 1], struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        if 0xC0 <= marker <= 0xC2:
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+
+
+class TestBuildThumbnails:
+    """Test thumbnails, their index, and reruns."""
+
+    def run(self, *args):
+        return subprocess.run(
+            [sys.executable, str(ROOT / "build-thumbnails.py"), *map(str, args)],
+            capture_output=True, text=True,
+        )
+
+    def test_thumbnails_and_index(self, tmp_path: Path):
+        """Test that photos get square thumbnails listed in thumbnails.json, and SVGs none."""
+        folder = tmp_path / "2025" / "run"
+        shutil.copytree(WITH_MEDIA, folder, symlinks=False)
+        write_png(folder / "media" / "wide.png", 600, 300)
+        write_png(folder / "media" / "day 2" / "tall.png", 200, 400)
+
+        result = self.run(tmp_path)
+        assert result.returncode == 0, result.stderr
+        assert "Found 1 folders with media" in result.stdout
+        index = json.loads((folder / "thumbnails" / "thumbnails.json").read_text())
+        assert index["version"] == 1 and index["size"] == 128
+        assert index["files"] == {"day 2/tall.png": {"thumbnail": "day 2/tall.png.jpg"},
+                                  "wide.png": {"thumbnail": "wide.png.jpg"}}
+        assert jpeg_size(folder / "thumbnails" / "wide.png.jpg") == (128, 128)
+        assert jpeg_size(folder / "thumbnails" / "day 2" / "tall.png.jpg") == (128, 128)
+
+        # Up to date: nothing written again; a deleted photo loses its thumbnail
+        (folder / "media" / "wide.png").unlink()
+        result = self.run(folder)
+        assert "0 written, 1 up to date" in result.stdout
+        assert not (folder / "thumbnails" / "wide.png.jpg").exists()
+        assert list(json.loads((folder / "thumbnails" / "thumbnails.json").read_text())["files"]) == ["day 2/tall.png"]
+
+        # Another size rewrites them all
+        result = self.run(folder, "--size", "96")
+        assert "1 written" in result.stdout
+        assert jpeg_size(folder / "thumbnails" / "day 2" / "tall.png.jpg") == (96, 96)
+
+    @pytest.mark.skipif(shutil.which("ffmpeg") is None, reason="needs ffmpeg")
+    def test_video_poster(self, tmp_path: Path):
+        """Test that a video gets a poster frame and a thumbnail cut from it."""
+        video = tmp_path / "media" / "clip.mp4"
+        video.parent.mkdir()
+        subprocess.run(["ffmpeg", "-v", "error", "-f", "lavfi", "-i", "testsrc=size=320x240:duration=0.5",
+                        "-pix_fmt", "yuv420p", str(video)], check=True)
+
+        result = self.run(tmp_path)
+        assert result.returncode == 0, result.stderr
+        index = json.loads((tmp_path / "thumbnails" / "thumbnails.json").read_text())
+        assert index["files"] == {"clip.mp4": {"thumbnail": "clip.mp4.jpg", "poster": "clip.mp4.poster.jpg"}}
+        # Shorter than a second: the first frame
+        assert jpeg_size(tmp_path / "thumbnails" / "clip.mp4.poster.jpg") == (320, 240)
+        assert jpeg_size(tmp_path / "thumbnails" / "clip.mp4.jpg") == (128, 128)
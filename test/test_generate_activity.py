@@ -0,0 +1,43 @@
+"""
+Tests for generate_activity.py, read back with activity_io.
+"""
+from pathlib import Path
+
+import activity_io
+from generate_activity import fit_crc, generate_folder
+
+
+class TestGenerateActivity:
+    """Test that the synthetic files decode like recorded ones."""
+
+    def test_fit_and_gpx_match(self, tmp_path: Path):
+        """Test that both files hold the same track, with pauses and dropouts, and a valid FIT CRC."""
+        written = generate_folder(tmp_path, 6000, seed=3)
+        fit = (tmp_path / "activity.fit").read_bytes()
+        assert fit_crc(fit) == 0  # The trailing CRC makes the whole file check to 0
+
+        store, point_count = activity_io.decode_fit(fit)
+        assert point_count == written["activity.fit"] == 6000
+        # Dropouts: records without a position are dropped, and missing from the GPX
+        assert len(store) == written["activity.gpx"] < 6000
+        gpx, _ = activity_io.parse_gpx((tmp_path / "activity.gpx").read_text())
+        assert len(gpx) == len(store)
+        assert abs(gpx["latitude"][100] - store["latitude"][100]) < 1e-6
+
+        # Pauses: gaps in the timestamps
+        timestamps = store["timestamp"]
+        gaps = [b - a for a, b in zip(timestamps, timestamps[1:]) if b - a > 1000]
+        assert any(gap >= 20000 for gap in gaps)
+
+        for channel in ("heartRate", "cadence", "power", "elevation", "temperature"):
+            assert store.get(channel, 100) is not None, channel
+        summary = activity_io.calculate_metrics(store)
+        assert 90 < summary["avgHeartRate"] < 190
+        assert 10 < summary["distance"] < 20
+
+    def test_same_seed_same_files(self, tmp_path: Path):
+        """Test that generating twice with one seed writes identical files."""
+        generate_folder(tmp_path / "a", 1000, seed=7)
+        generate_folder(tmp_path / "b", 1000, seed=7)
+        for name in ("activity.fit", "activity.gpx", "metadata.yaml"):
+            assert (tmp_path / "a" / name).read_bytes() == (tmp_path / "b" / name).read_bytes()
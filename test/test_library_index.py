@@ -0,0 +1,58 @@
+"""
+Tests for build-library-index.py.
+"""
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+TEST_CASES = ROOT / "test" / "test-cases"
+
+
+class TestLibraryIndex:
+    """Test the library index and its rescan cache."""
+
+    def build(self, root: Path):
+        output = subprocess.run(
+            [sys.executable, str(ROOT / "build-library-index.py"), str(root), "--jobs", "2"],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        index = json.loads((root / "library.json").read_text())
+        rows = {row[0]: dict(zip(index["fields"], row)) for row in index["activities"]}
+        return output, rows
+
+    def test_index_rows(self, tmp_path: Path):
+        """Test that tracks and metadata-only folders are indexed with their summaries."""
+        for name in ("full-activity", "gpx-only", "metadata-only"):
+            shutil.copytree(TEST_CASES / name, tmp_path / "2025" / name, symlinks=False)
+
+        _, rows = self.build(tmp_path)
+        assert set(rows) == {"2025/full-activity", "2025/gpx-only", "2025/metadata-only"}
+
+        run = rows["2025/full-activity"]
+        assert (run["title"], run["date"], run["type"]) == ("Morning Run", "2025-11-03", "running")
+        assert run["distance"] == 6.241 and run["duration"] == 2023
+        assert run["bbox"] == [42.41983, -72.44189, 42.43518, -72.41841]
+        assert rows["2025/gpx-only"]["distance"] == run["distance"]
+
+        gym = rows["2025/metadata-only"]
+        assert gym["type"] == "strength-training"
+        assert gym["distance"] is None and gym["bbox"] is None
+
+    def test_rescan_reads_only_changed_folders(self, tmp_path: Path):
+        """Test that a rescan reuses cached rows for folders whose files did not change."""
+        for name in ("full-activity", "metadata-only"):
+            shutil.copytree(TEST_CASES / name, tmp_path / name, symlinks=False)
+        self.build(tmp_path)
+
+        output, _ = self.build(tmp_path)
+        assert "2 unchanged" in output
+
+        metadata = tmp_path / "metadata-only" / "metadata.yaml"
+        metadata.write_text(metadata.read_text().replace("Upper Body", "Lower Body"))
+        output, rows = self.build(tmp_path)
+        assert "1 unchanged" in output
+        assert "metadata-only" in output and "full-activity" not in output
+        assert rows["metadata-only"]["title"] == "Gym Session - Lower Body"
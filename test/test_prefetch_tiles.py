@@ -0,0 +1,53 @@
+"""
+Tests for prefetch-tiles.py, against the stand-in tile server from conftest.py.
+"""
+import json
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+FULL_ACTIVITY = ROOT / "test" / "test-cases" / "full-activity"
+SOURCE = "http://localhost:8001/{z}/{x}/{y}.png"
+
+
+class TestPrefetchTiles:
+    """Test prefetching the tiles around an activity's track."""
+
+    def run(self, *args):
+        return subprocess.run(
+            [sys.executable, str(ROOT / "prefetch-tiles.py"), "--source", SOURCE, *map(str, args)],
+            capture_output=True, text=True,
+        )
+
+    def test_prefetches_track_bounds(self, tmp_path: Path, tile_server):
+        """Test that the tiles covering the track are saved once and listed in tiles.json."""
+        folder = tmp_path / "run"
+        shutil.copytree(FULL_ACTIVITY, folder, symlinks=False)
+
+        result = self.run(folder, "--zoom", "13-14", "--padding", "0")
+        assert result.returncode == 0, result.stderr
+        info = json.loads((folder / "tiles" / "tiles.json").read_text())
+        assert info["source"] == SOURCE and info["tiles"] == "{z}/{x}/{y}.png"
+        # 42.41983..42.43518 N, -72.44189..-72.41841 E
+        assert info["ranges"] == {"13": [2447, 3027, 2448, 3028], "14": [4895, 6055, 4896, 6056]}
+
+        tiles = sorted(path.relative_to(folder / "tiles").as_posix() for path in folder.glob("tiles/*/*/*.png"))
+        assert len(tiles) == 8 and "14/4895/6055.png" in tiles
+        assert all(f"/{tile}" in tile_server.requested for tile in tiles)
+
+        requested = len(tile_server.requested)
+        result = self.run(folder, "--zoom", "13-14", "--padding", "0")
+        assert "0 downloaded, 8 already there" in result.stdout
+        assert len(tile_server.requested) == requested
+
+    def test_refuses_too_many_tiles(self, tmp_path: Path, tile_server):
+        """Test that a folder needing more than --max-tiles tiles is not downloaded."""
+        folder = tmp_path / "run"
+        shutil.copytree(FULL_ACTIVITY, folder, symlinks=False)
+
+        result = self.run(folder, "--zoom", "14-18", "--max-tiles", "50")
+        assert result.returncode == 1
+        assert "over --max-tiles 50" in result.stderr
+        assert not (folder / "tiles").exists()
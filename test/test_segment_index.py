@@ -0,0 +1,110 @@
+"""
+Tests for segment_index and build-segment-index.py.
+"""
+import json
+import re
+import shutil
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+from http.client import HTTPConnection
+from pathlib import Path
+
+import pytest
+
+import segment_index
+from serve import create_server
+
+ROOT = Path(__file__).parent.parent
+TEST_CASES = ROOT / "test" / "test-cases"
+START = datetime(2025, 11, 2, 17, 0, 18)
+
+
+def write_variant(folder: Path, latitude_shift=0.0, slowdown=1.0):
+    """The full-activity GPX moved north and/or recorded more slowly."""
+    text = (TEST_CASES / "full-activity" / "activity.gpx").read_text()
+    text = re.sub(r'lat="([-\d.]+)"', lambda m: f'lat="{float(m.group(1)) + latitude_shift:.7f}"', text)
+
+    def stretch(match):
+        time = datetime.strptime(match.group(1), "%Y-%m-%dT%H:%M:%S")
+        return f"<time>{START + (time - START) * slowdown:%Y-%m-%dT%H:%M:%S}"
+    text = re.sub(r"<time>(\d{4}-\d\d-\d\dT\d\d:\d\d:\d\d)", stretch, text)
+    folder.mkdir(parents=True)
+    (folder / "activity.gpx").write_text(text)
+
+
+@pytest.fixture
+def archive(tmp_path: Path):
+    """The fixture run, a GPX-only copy, a slower run on the same route and one elsewhere."""
+    shutil.copytree(TEST_CASES / "full-activity", tmp_path / "run", symlinks=False)
+    shutil.copytree(TEST_CASES / "gpx-only", tmp_path / "gpx-only", symlinks=False)
+    write_variant(tmp_path / "slow", slowdown=1.25)
+    write_variant(tmp_path / "elsewhere", latitude_shift=0.01)
+    return tmp_path
+
+
+class TestSegmentIndex:
+    """Test finding the passes over a stretch of route."""
+
+    def build(self, root: Path, *args):
+        return subprocess.run(
+            [sys.executable, str(ROOT / "build-segment-index.py"), str(root), "--jobs", "2", *map(str, args)],
+            capture_output=True, text=True, check=True,
+        ).stdout
+
+    def test_finds_passes_in_order(self, archive: Path):
+        """Test that only the activities over the stretch are found, timed like the stretch itself."""
+        self.build(archive)
+        index = segment_index.SegmentIndex.load(archive)
+        assert len(index) == 4
+
+        result = index.find("run", 1.0, 2.5)
+        assert result["distance"] == 1.5
+        matches = {match["path"]: match for match in result["matches"]}
+        assert set(matches) == {"gpx-only", "slow"}
+        assert matches["gpx-only"]["elapsed"] == pytest.approx(result["elapsed"], abs=1)
+        assert matches["slow"]["elapsed"] == pytest.approx(result["elapsed"] * 1.25, abs=2)
+        assert matches["slow"]["start"] == pytest.approx(1.0, abs=0.02)
+        assert [match["path"] for match in result["matches"]] == ["gpx-only", "slow"]
+
+        assert index.find("missing", 1.0, 2.5) is None
+        with pytest.raises(ValueError):
+            index.find("run", 1.0, 1.05)
+
+    def test_update_reads_only_changed_folders(self, archive: Path):
+        """Test that a rerun indexes new folders only and drops removed ones."""
+        assert "0 unchanged" in self.build(archive)
+        assert "4 unchanged" in self.build(archive)
+
+        shutil.rmtree(archive / "elsewhere")
+        write_variant(archive / "new", slowdown=0.9)
+        output = self.build(archive, "--find", "run", 1.0, 2.5)
+        assert "3 unchanged" in output and "  new:" in output
+        assert "3 passes in 4 activities" in output
+
+        folders = json.loads((archive / segment_index.INDEX_NAME).read_text())["folders"]
+        assert set(folders) == {"run", "gpx-only", "slow", "new"}
+
+    def test_served_lookup(self, archive: Path):
+        """Test that serve.py answers lookups from the index, for the viewer."""
+        server = create_server(archive, port=0, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            def get(query):
+                conn = HTTPConnection("127.0.0.1", server.server_address[1])
+                conn.request("GET", f"/.segments?{query}")
+                response = conn.getresponse()
+                return response.status, response.read()
+
+            assert get("activity=/run/&from=1&to=2.5")[0] == 404  # No index yet
+            self.build(archive)
+            status, body = get("activity=/run/&from=1&to=2.5")
+            assert status == 200
+            assert {match["path"] for match in json.loads(body)["matches"]} == {"gpx-only", "slow"}
+            assert get("activity=/run/index.html&from=1&to=2.5")[0] == 200
+            assert get("activity=/run/&from=1")[0] == 400
+            assert get("activity=/nowhere/&from=1&to=2.5")[0] == 404
+        finally:
+            server.shutdown()
+            server.server_close()
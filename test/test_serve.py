@@ -0,0 +1,117 @@
+"""
+Tests for serve.py, against a server on a free port.
+"""
+import gzip
+import json
+import os
+import threading
+from http.client import HTTPConnection
+from pathlib import Path
+
+import pytest
+
+from serve import create_server
+
+ROOT = Path(__file__).parent.parent
+TEST_CASES = "/test/test-cases"
+
+
+@pytest.fixture(scope="module")
+def serve_root():
+    """Start serve.py on the project root; yields a function making one request."""
+    server = create_server(ROOT, port=0, quiet=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def request(path, method="GET", **headers):
+        conn = HTTPConnection("127.0.0.1", server.server_address[1])
+        conn.request(method, path, headers=headers)
+        response = conn.getresponse()
+        body = response.read()
+        conn.close()
+        return response, body
+
+    yield request
+    server.shutdown()
+    server.server_close()
+
+
+class TestServe:
+    """Test compression, caching headers, ranges and JSON listings."""
+
+    def test_gzip_and_revalidation(self, serve_root):
+        """Test that text files are gzipped and revalidate with their ETag."""
+        path = f"{TEST_CASES}/full-activity/activity.gpx"
+        response, body = serve_root(path, **{"Accept-Encoding": "gzip, br"})
+        assert response.status == 200
+        assert response.getheader("Content-Encoding") == "gzip"
+        assert response.getheader("Cache-Control") == "no-cache"
+        assert gzip.decompress(body) == (ROOT / path.lstrip("/")).read_bytes()
+
+        etag = response.getheader("ETag")
+        assert etag.startswith('"') and not etag.startswith('W/')
+        response, body = serve_root(path, **{"Accept-Encoding": "gzip", "If-None-Match": etag})
+        assert response.status == 304 and body == b""
+
+        # The identity representation has its own ETag
+        response, _ = serve_root(path, **{"If-None-Match": etag})
+        assert response.status == 200 and response.getheader("Content-Encoding") is None
+
+    def test_range_requests(self, serve_root):
+        """Test that byte ranges get 206 and ranges past the end get 416."""
+        path = f"{TEST_CASES}/full-activity/activity.fit"
+        data = (ROOT / path.lstrip("/")).read_bytes()
+        response, body = serve_root(path, Range="bytes=100-199")
+        assert response.status == 206 and body == data[100:200]
+        assert response.getheader("Content-Range") == f"bytes 100-199/{len(data)}"
+
+        response, body = serve_root(path, Range="bytes=-16")
+        assert response.status == 206 and body == data[-16:]
+
+        response, _ = serve_root(path, Range=f"bytes={len(data)}-")
+        assert response.status == 416
+        assert response.getheader("Content-Range") == f"bytes */{len(data)}"
+
+        # A range of an older version of the file gets all of the current one
+        response, body = serve_root(path, Range="bytes=0-9", **{"If-Range": '"0-0"'})
+        assert response.status == 200 and body == data
+
+    def test_json_listing(self, serve_root):
+        """Test that folders list their files as JSON when asked, and as HTML otherwise."""
+        response, body = serve_root(f"{TEST_CASES}/with-media/", Accept="application/json")
+        assert response.getheader("Content-Type") == "application/json"
+        listing = json.loads(body)
+        assert "media/photo1.svg" in listing["files"] and "activity.fit" in listing["files"]
+        assert listing["sizes"]["media/photo1.svg"] == (ROOT / "test/test-cases/with-media/media/photo1.svg").stat().st_size
+
+        response, body = serve_root(f"{TEST_CASES}/with-media/media/")
+        assert response.status == 200 and b'href="photo1.svg"' in body
+
+        response, _ = serve_root(f"{TEST_CASES}/with-media/media/photo1.svg")
+        assert response.getheader("Cache-Control") == "public, max-age=86400"
+
+    def test_precompressed_files(self, tmp_path: Path):
+        """Test that a .br or .gz next to a file is sent when accepted and up to date."""
+        (tmp_path / "activity.gpx").write_text("<gpx></gpx>")
+        (tmp_path / "activity.gpx.br").write_bytes(b"brotli")
+        server = create_server(tmp_path, port=0, quiet=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            def get(**headers):
+                conn = HTTPConnection("127.0.0.1", server.server_address[1])
+                conn.request("GET", "/activity.gpx", headers=headers)
+                response = conn.getresponse()
+                return response, response.read()
+
+            response, body = get(**{"Accept-Encoding": "gzip, br"})
+            assert response.getheader("Content-Encoding") == "br" and body == b"brotli"
+            response, body = get(**{"Accept-Encoding": "gzip"})
+            assert response.getheader("Content-Encoding") is None and body == b"<gpx></gpx>"
+
+            # Older than the file: stale, not sent
+            stat = (tmp_path / "activity.gpx").stat()
+            os.utime(tmp_path / "activity.gpx.br", ns=(stat.st_atime_ns, stat.st_mtime_ns - 10**9))
+            response, body = get(**{"Accept-Encoding": "br"})
+            assert response.getheader("Content-Encoding") is None and body == b"<gpx></gpx>"
+        finally:
+            server.shutdown()
+            server.server_close()